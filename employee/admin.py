@@ -1,19 +1,27 @@
 from django.contrib import admin
-from .models import Department, Employee, Attendance, Salary
+from django.db.models import OuterRef, Subquery
+from .models import Department, Employee, Attendance, Salary, FaceTemplate, EncodingJob
 
 @admin.register(Department)
 class DepartmentAdmin(admin.ModelAdmin):
     list_display = ('name', 'created_at')
     search_fields = ('name',)
 
+class FaceTemplateInline(admin.TabularInline):
+    model = FaceTemplate
+    fields = ('image', 'source', 'face_size', 'captured_at')
+    readonly_fields = ('image', 'source', 'face_size', 'captured_at')
+    extra = 0
+    can_delete = True
+
 @admin.register(Employee)
 class EmployeeAdmin(admin.ModelAdmin):
-    list_display = ('employee_id', 'get_full_name', 'department', 'position', 'base_salary', 'hourly_rate', 'is_active')
-    list_filter = ('department', 'is_active')
+    list_display = ('employee_id', 'get_full_name', 'department', 'position', 'base_salary', 'hourly_rate', 'is_active', 'get_face_job_status')
+    list_filter = ('department', 'site', 'is_active')
     search_fields = ('employee_id', 'user__first_name', 'user__last_name')
     fieldsets = (
         ('Basic Information', {
-            'fields': ('user', 'employee_id', 'department', 'position', 'is_active', 'joining_date')
+            'fields': ('user', 'employee_id', 'department', 'site', 'position', 'is_active', 'joining_date')
         }),
         ('Contact Information', {
             'fields': ('phone_number', 'address')
@@ -22,14 +30,46 @@ class EmployeeAdmin(admin.ModelAdmin):
             'fields': ('base_salary', 'hourly_rate', 'overtime_rate', 'standard_work_hours')
         }),
         ('Face Recognition', {
-            'fields': ('face_image', 'face_encoding')
+            'fields': ('face_image', 'face_encoding', 'face_spread')
         }),
     )
+    readonly_fields = ('employee_id', 'face_encoding', 'face_spread')
+    inlines = (FaceTemplateInline,)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if not any(formset.has_changed() for formset in formsets):
+            return
+        # Templates deleted inline change the primary encoding, centroid and spread
+        employee = form.instance
+        employee.refresh_face_encoding()
+        employee.save(update_fields=['face_encoding', 'face_centroid', 'face_spread', 'face_encoding_version'])
     
+    def get_queryset(self, request):
+        latest_job = EncodingJob.objects.filter(employee=OuterRef('pk')).order_by('-created_at', '-pk')
+        return super().get_queryset(request).annotate(face_job_status=Subquery(latest_job.values('status')[:1]))
+
     def get_full_name(self, obj):
         return obj.user.get_full_name()
     get_full_name.short_description = 'Full Name'
 
+    def get_face_job_status(self, obj):
+        return dict(EncodingJob.STATUS_CHOICES).get(obj.face_job_status, '-')
+    get_face_job_status.short_description = 'Face Encoding Job'
+
+@admin.register(EncodingJob)
+class EncodingJobAdmin(admin.ModelAdmin):
+    list_display = ('employee', 'image', 'status', 'attempts', 'created_at', 'finished_at', 'error')
+    list_filter = ('status',)
+    search_fields = ('employee__employee_id', 'employee__user__first_name', 'employee__user__last_name')
+    readonly_fields = ('employee', 'image', 'attempts', 'error', 'created_at', 'started_at', 'finished_at')
+    actions = ['retry_jobs']
+
+    def retry_jobs(self, request, queryset):
+        updated = queryset.filter(status='failed').update(status='queued', error='', finished_at=None)
+        self.message_user(request, f'{updated} job(s) queued again')
+    retry_jobs.short_description = 'Retry failed jobs'
+
 @admin.register(Attendance)
 class AttendanceAdmin(admin.ModelAdmin):
     list_display = ('employee', 'date', 'status', 'check_in', 'check_out', 'get_working_hours')
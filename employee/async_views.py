@@ -0,0 +1,252 @@
+"""Async (ASGI) variants of the kiosk recognition and check-in/check-out views.
+
+CPU-bound work is awaited on the recognition pool (or a thread when the pool
+is disabled) and database access goes through Django's async ORM, so a
+waiting kiosk request does not hold a worker.
+"""
+from datetime import date
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.http import JsonResponse
+from django.shortcuts import redirect
+from django.utils import timezone
+from django.utils.timezone import localtime
+
+from .face_cache import get_employee_templates
+from .face_executor import arun_recognition, RecognitionError, RecognitionBusy, RecognitionTimeout
+from .face_candidates import match_for_kiosk, remember_match
+from .face_debounce import in_cooldown, recent_frame, recent_result, remember_frame, remember_result
+from .face_metrics import observe_timings, stage_timer, timed
+from .kiosk_logging import kiosk_logger, sampled_logging
+from .models import Employee, Attendance
+from .views import (
+    kiosk_error, kiosk_key, kiosk_scope, kiosk_upload, recognition_task, recognition_error_response,
+    check_gallery_match, attendance_response
+)
+
+logger = kiosk_logger(__name__)
+
+
+def async_login_required(view):
+    """login_required for coroutine views; redirects anonymous users to LOGIN_URL"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), settings.LOGIN_URL)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def arecord_attendance(employee_pk, employee_name, employee_code, department_name, confidence):
+    """Async `record_attendance`"""
+    with stage_timer('attendance'):
+        attendance, created = await Attendance.objects.aget_or_create(
+            employee_id=employee_pk,
+            date=date.today(),
+            defaults={
+                'status': 'present',
+                'check_in': timezone.now(),
+                'face_confidence': confidence
+            }
+        )
+
+        current_time = localtime()
+
+        if not created:
+            if not attendance.check_out and in_cooldown(attendance.check_in):
+                # Scanned again right after checking in: answer with the check-in, not a check-out
+                current_time = localtime(attendance.check_in)
+                status = "Đã chấm công vào"
+            elif not attendance.check_out:
+                attendance.check_out = current_time
+                await attendance.asave(update_fields=['check_out'])
+                status = "Đã chấm công ra"
+            else:
+                status = "Đã chấm công đủ"
+        else:
+            status = "Đã chấm công vào"
+
+    logger.info("Xử lý chấm công thành công cho nhân viên %s", employee_pk)
+    return attendance_response(employee_name, employee_code, department_name, status, current_time, confidence)
+
+
+@async_login_required
+@timed('request')
+@sampled_logging
+async def process_auto_attendance(request):
+    """Async face recognition attendance; same request and response format as views.process_auto_attendance"""
+    from .face_engine import get_engine
+    from .face_gallery import get_gallery
+
+    image_file = kiosk_upload(request) if request.method == 'POST' else None
+    if not image_file:
+        logger.error("Yêu cầu không hợp lệ: Không có file ảnh")
+        return JsonResponse(kiosk_error('invalid_request', 'Yêu cầu không hợp lệ. Vui lòng cung cấp ảnh.'))
+
+    try:
+        if not image_file.content_type.startswith('image/'):
+            logger.error("Loại file không hợp lệ: %s", image_file.content_type)
+            return JsonResponse(kiosk_error('invalid_file'))
+
+        image_bytes = image_file.read()
+        kiosk = kiosk_key(request)
+        digest, previous = recent_frame(kiosk, image_bytes)
+        if previous:
+            logger.info("Ảnh lặp lại từ kiosk, trả lại kết quả trước đó")
+            return JsonResponse(previous)
+
+        try:
+            task, args, kwargs = recognition_task(request, image_bytes)
+            with stage_timer('recognition'):
+                face_locations, face_encodings, timings = await arun_recognition(task, *args, **kwargs)
+            observe_timings(timings)
+        except RecognitionBusy:
+            logger.warning("Hàng đợi nhận diện đã đầy")
+            return JsonResponse(kiosk_error('recognition_busy'))
+        except RecognitionTimeout:
+            logger.warning("Quá thời gian xử lý nhận diện")
+            return JsonResponse(kiosk_error('recognition_timeout'))
+        except RecognitionError as e:
+            return JsonResponse(recognition_error_response(e.stage, e.message))
+
+        if not face_locations:
+            return JsonResponse(kiosk_error('no_face_detected'))
+        if len(face_locations) > 1:
+            return JsonResponse(kiosk_error('multiple_faces'))
+        face_encoding = face_encodings[0]
+
+        user = await request.auser()
+        if not user.is_staff:
+            try:
+                current_employee = await Employee.objects.select_related('user', 'department').aget(user=user)
+            except Employee.DoesNotExist:
+                return JsonResponse(kiosk_error('employee_not_found', 'Không tìm thấy hồ sơ nhân viên.'), status=404)
+            if not current_employee.face_encoding:
+                return JsonResponse(kiosk_error(
+                    'no_registered_face',
+                    'Chưa đăng ký khuôn mặt cho tài khoản của bạn. Vui lòng liên hệ quản trị viên.'
+                ))
+
+            # Closest face template, same rule as face_recognition.compare_faces with its default 0.6 tolerance
+            with stage_timer('match'):
+                templates = await sync_to_async(get_employee_templates)(current_employee)
+                distance = float(get_engine().distance(templates, face_encoding).min(initial=float('inf')))
+            if distance > 0.6:
+                return JsonResponse(kiosk_error(
+                    'face_mismatch',
+                    'Khuôn mặt không khớp với khuôn mặt đã đăng ký. Vui lòng đảm bảo bạn đang sử dụng đúng tài khoản của mình.'
+                ))
+
+            confidence = (1 - distance) * 100
+            if confidence < 60:
+                return JsonResponse(kiosk_error(
+                    'low_confidence',
+                    'Độ tin cậy nhận diện khuôn mặt quá thấp. Vui lòng thử lại với điều kiện ánh sáng tốt hơn.'
+                ))
+
+            previous = recent_result(kiosk, current_employee.pk)
+            if previous:
+                remember_frame(kiosk, digest, previous)
+                return JsonResponse(previous)
+
+            response = await arecord_attendance(
+                current_employee.pk,
+                current_employee.user.get_full_name(),
+                current_employee.employee_id,
+                current_employee.department.name if current_employee.department else '',
+                confidence
+            )
+            remember_result(kiosk, current_employee.pk, response, digest)
+            return JsonResponse(response)
+
+        # A stale gallery is rebuilt from the database, so look it up off the event loop
+        with stage_timer('match'):
+            gallery = await sync_to_async(get_gallery)()
+            match = match_for_kiosk(gallery, face_encoding, kiosk, kiosk_scope(request))
+        error = check_gallery_match(match)
+        if error:
+            return JsonResponse(error)
+        remember_match(kiosk, match.employee_pk)
+
+        previous = recent_result(kiosk, match.employee_pk)
+        if previous:
+            remember_frame(kiosk, digest, previous)
+            return JsonResponse(previous)
+
+        response = await arecord_attendance(
+            match.employee_pk, match.name, match.employee_id, match.department, (1 - match.distance) * 100
+        )
+        remember_result(kiosk, match.employee_pk, response, digest)
+        return JsonResponse(response)
+
+    except Exception as e:
+        logger.exception("Lỗi không mong đợi trong quá trình nhận diện khuôn mặt: %s", e)
+        return JsonResponse(kiosk_error(
+            'unexpected_error',
+            f'Lỗi không mong đợi: {str(e)}. Vui lòng thử lại hoặc liên hệ quản trị viên.'
+        ))
+
+
+@async_login_required
+async def check_in(request):
+    if request.method == 'POST':
+        user = await request.auser()
+        try:
+            employee = await Employee.objects.aget(user=user)
+        except Employee.DoesNotExist:
+            messages.error(request, 'Không tìm thấy hồ sơ nhân viên.')
+            return redirect('employee:dashboard')
+        today = timezone.localdate()
+
+        attendance, created = await Attendance.objects.aget_or_create(
+            employee=employee,
+            date=today,
+            defaults={
+                'status': 'present',
+                'check_in': timezone.now()
+            }
+        )
+
+        if created:
+            messages.success(request, 'Chấm công vào thành công!')
+        else:
+            if attendance.check_in:
+                messages.info(request, 'Bạn đã chấm công vào hôm nay rồi!')
+            else:
+                attendance.check_in = timezone.now()
+                attendance.status = 'present'
+                await attendance.asave(update_fields=['check_in', 'status'])
+                messages.success(request, 'Chấm công vào thành công!')
+
+    return redirect('employee:dashboard')
+
+
+@async_login_required
+async def check_out(request):
+    if request.method == 'POST':
+        user = await request.auser()
+        today = timezone.localdate()
+
+        try:
+            attendance = await Attendance.objects.aget(
+                employee__user=user,
+                date=today
+            )
+
+            if attendance.check_out:
+                messages.info(request, 'Bạn đã chấm công ra hôm nay rồi!')
+            elif not attendance.check_in:
+                messages.error(request, 'Bạn chưa chấm công vào!')
+            else:
+                attendance.check_out = timezone.now()
+                await attendance.asave(update_fields=['check_out'])
+                messages.success(request, 'Chấm công ra thành công!')
+        except Attendance.DoesNotExist:
+            messages.error(request, 'Không tìm thấy bản ghi chấm công cho hôm nay!')
+
+    return redirect('employee:dashboard')
@@ -0,0 +1,42 @@
+"""Excel workbook helpers for the export views.
+
+openpyxl is slow to import, so views import this module inside the export
+views rather than at module level.
+"""
+from django.http import HttpResponse
+from openpyxl import Workbook
+from openpyxl.styles import Alignment, Font, PatternFill
+
+
+def new_sheet(title, headers):
+    """Return (workbook, worksheet) with a bold, shaded header row"""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = title
+    for col, header in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col)
+        cell.value = header
+        cell.font = Font(bold=True)
+        cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
+        cell.alignment = Alignment(horizontal='center')
+    return wb, ws
+
+
+def bold(cell):
+    cell.font = Font(bold=True)
+    return cell
+
+
+def autosize_columns(ws):
+    """Set each column's width to fit its longest value"""
+    for column in ws.columns:
+        column = list(column)
+        max_length = max(len(str(cell.value)) for cell in column)
+        ws.column_dimensions[column[0].column_letter].width = max_length + 2
+
+
+def xlsx_response(wb, filename):
+    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    response['Content-Disposition'] = f'attachment; filename={filename}'
+    wb.save(response)
+    return response
@@ -0,0 +1,129 @@
+"""Bounded LRU cache of decoded face templates for 1:1 verification.
+
+Entries are keyed by (employee pk, face_encoding_version), so the fresh
+Employee row a view already loads never resolves to a stale vector. Other
+changes (deletion, template or version changes, bulk conversion) bump the
+`face_encodings` CacheGeneration row; each process re-reads it at most
+every FACE_CACHE_GENERATION_TTL seconds and drops its entries when it moves.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import CacheGeneration
+
+GENERATION_NAME = 'face_encodings'
+
+
+class FaceEncodingCache:
+    """Thread-safe LRU mapping of keys to NumPy arrays, bounded by total array bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.generation = None
+        self._generation_checked = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if value.nbytes > self.max_bytes:
+            return
+        # Entries are shared between threads
+        value.setflags(write=False)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = value
+            self._bytes += value.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def invalidate(self, employee_pk):
+        """Drop every cached version for one employee"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == employee_pk]:
+                self._bytes -= self._entries.pop(key).nbytes
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+
+    def sync_generation(self, ttl):
+        """Clear the cache if another process bumped the generation since the last check"""
+        now = time.monotonic()
+        if now - self._generation_checked < ttl:
+            return
+        self._generation_checked = now
+        generation = CacheGeneration.read(GENERATION_NAME)
+        if generation != self.generation:
+            if self.generation is not None:
+                self.clear()
+            self.generation = generation
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'generation': self.generation,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_face_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FaceEncodingCache(getattr(settings, 'FACE_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+        return _cache
+
+
+def get_employee_templates(employee):
+    """`employee.get_face_templates()`, served from the cache while its version is current"""
+    cache = get_face_cache()
+    cache.sync_generation(getattr(settings, 'FACE_CACHE_GENERATION_TTL', 1.0))
+    key = (employee.pk, employee.face_encoding_version)
+    templates = cache.get(key)
+    if templates is None:
+        templates = employee.get_face_templates()
+        cache.put(key, templates)
+    return templates
+
+
+def invalidate_employee(employee_pk):
+    """Drop one employee locally and tell other processes to drop their entries"""
+    get_face_cache().invalidate(employee_pk)
+    CacheGeneration.bump(GENERATION_NAME)
@@ -0,0 +1,149 @@
+"""Narrower 1:N searches for kiosks: recent-match short lists and department/site scopes.
+
+The same people scan at the same kiosk every day, so the employees a kiosk
+matched recently are compared first. A candidate counts only within the
+strict FACE_KIOSK_CANDIDATE_MAX_DISTANCE and when no one outside the short
+list can be closer (see FaceGallery.candidate_match); otherwise the scan is
+searched as if there were no short list, so a lookalike who checked in
+recently cannot take another employee's scan. A kiosk may also declare a scope
+(department and/or site); its short list is then checked against its
+partition only, the partition is searched next and, with
+FACE_PARTITION_FALLBACK, a scan it cannot place falls through to the full
+gallery. Short lists live in this worker process only.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .face_metrics import count_candidate_lookup, count_partition_search, stage_timer
+
+
+class CandidateCache:
+    """LRU of kiosks, each holding an LRU of its most recently matched employee pks"""
+
+    def __init__(self, size, max_kiosks):
+        self.size = size
+        self.max_kiosks = max_kiosks
+        self._kiosks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kiosk):
+        with self._lock:
+            candidates = self._kiosks.get(kiosk)
+            return list(candidates) if candidates else []
+
+    def add(self, kiosk, employee_pk):
+        with self._lock:
+            candidates = self._kiosks.get(kiosk)
+            if candidates is None:
+                candidates = self._kiosks[kiosk] = OrderedDict()
+                if len(self._kiosks) > self.max_kiosks:
+                    self._kiosks.popitem(last=False)
+            self._kiosks.move_to_end(kiosk)
+            candidates[employee_pk] = None
+            candidates.move_to_end(employee_pk)
+            if len(candidates) > self.size:
+                candidates.popitem(last=False)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_candidate_cache():
+    """Return the process-wide candidate cache, or None when FACE_KIOSK_CANDIDATES is 0"""
+    global _cache
+    size = getattr(settings, 'FACE_KIOSK_CANDIDATES', 50)
+    if not size:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = CandidateCache(size, getattr(settings, 'FACE_KIOSK_MAX_KIOSKS', 256))
+        return _cache
+
+
+def partition_accepts(match):
+    return match is not None and match.distance <= getattr(settings, 'FACE_PARTITION_MAX_DISTANCE', 0.5)
+
+
+def match_for_kiosk(gallery, encoding, kiosk, scope=None):
+    """Closest FaceMatch from the kiosk's recent employees, then its scope's partition, then the gallery.
+
+    `scope` is a (department id, site) pair or None for the whole gallery.
+    """
+    cache = get_candidate_cache() if kiosk else None
+    candidates = cache.get(kiosk) if cache is not None else []
+    if candidates:
+        # A scoped kiosk's short list is checked within its partition only
+        searched = gallery.partition(*scope) if scope else gallery
+        with stage_timer('match_candidates'):
+            match = searched.candidate_match(encoding, candidates)
+        if match is not None and match.distance <= getattr(settings, 'FACE_KIOSK_CANDIDATE_MAX_DISTANCE', 0.4):
+            count_candidate_lookup('hit')
+            return match
+        count_candidate_lookup('miss')
+
+    if scope:
+        with stage_timer('match_partition'):
+            match = gallery.partition(*scope).best_match(encoding)
+        if partition_accepts(match):
+            count_partition_search('hit')
+            return match
+        if not getattr(settings, 'FACE_PARTITION_FALLBACK', True):
+            count_partition_search('miss')
+            return match
+        count_partition_search('fallback')
+
+    with stage_timer('match_gallery'):
+        return gallery.best_match(encoding)
+
+
+def best_matches_in_scope(gallery, encodings, scope=None):
+    """`gallery.best_matches` over the scope's partition, falling back to the whole gallery per frame"""
+    if not scope:
+        return gallery.best_matches(encodings)
+    matches = gallery.partition(*scope).best_matches(encodings)
+    misses = [i for i, match in enumerate(matches) if not partition_accepts(match)]
+    for _ in range(len(matches) - len(misses)):
+        count_partition_search('hit')
+    if not getattr(settings, 'FACE_PARTITION_FALLBACK', True):
+        for _ in misses:
+            count_partition_search('miss')
+        return matches
+    if misses:
+        for i, match in zip(misses, gallery.best_matches([encodings[i] for i in misses])):
+            count_partition_search('fallback')
+            matches[i] = match
+    return matches
+
+
+def assign_matches_in_scope(gallery, encodings, scope=None):
+    """`gallery.assign_matches` for the faces of one frame over the scope's partition.
+
+    With FACE_PARTITION_FALLBACK, faces the partition cannot place are assigned
+    from the whole gallery among the employees not already taken.
+    """
+    if not scope:
+        return gallery.assign_matches(encodings)
+    matches = gallery.partition(*scope).assign_matches(encodings)
+    misses = [i for i, match in enumerate(matches) if not partition_accepts(match)]
+    for _ in range(len(matches) - len(misses)):
+        count_partition_search('hit')
+    if not getattr(settings, 'FACE_PARTITION_FALLBACK', True):
+        for _ in misses:
+            count_partition_search('miss')
+        return matches
+    if misses:
+        taken = {matches[i].employee_pk for i in range(len(matches)) if i not in misses}
+        for i, match in zip(misses, gallery.assign_matches([encodings[i] for i in misses], exclude=taken)):
+            count_partition_search('fallback')
+            matches[i] = match
+    return matches
+
+
+def remember_match(kiosk, employee_pk):
+    """Put an accepted match at the front of the kiosk's short list"""
+    cache = get_candidate_cache() if kiosk else None
+    if cache is not None:
+        cache.add(kiosk, employee_pk)
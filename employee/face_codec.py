@@ -0,0 +1,116 @@
+"""Self-describing binary format for stored face encodings.
+
+Layout: a 16-byte header (magic, format version, payload dtype, dimension,
+model id, int8 scale) followed by the payload. float32 halves the legacy
+1024-byte float64 blobs; int8 stores symmetric per-vector quantized codes
+in an eighth of the space. Blobs without the magic are legacy raw float64
+written by `ndarray.tobytes()` and are still read.
+"""
+import struct
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+ENCODING_MAGIC = b'FENC'
+ENCODING_FORMAT_VERSION = 1
+ENCODING_HEADER = struct.Struct('<4sBBHHxxf')
+
+# Payload dtype codes stored in the header
+DTYPE_CODES = {'float32': 1, 'int8': 2}
+CODE_DTYPES = {code: name for name, code in DTYPE_CODES.items()}
+
+# dlib ResNet face descriptor used by face_recognition
+DLIB_RESNET_V1 = 1
+
+
+def default_dtype():
+    return getattr(settings, 'FACE_ENCODING_DTYPE', 'float32')
+
+
+def encode_encoding(encoding, dtype=None, model=DLIB_RESNET_V1):
+    """Serialize an encoding vector as header + float32 or int8 payload"""
+    dtype = dtype or default_dtype()
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f'Unsupported face encoding dtype: {dtype}')
+
+    vector = np.asarray(encoding, dtype=np.float32).ravel()
+    scale = 0.0
+    if dtype == 'int8':
+        peak = float(np.abs(vector).max()) if len(vector) else 0.0
+        scale = peak / 127 if peak else 1.0
+        payload = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+    else:
+        payload = vector
+    header = ENCODING_HEADER.pack(
+        ENCODING_MAGIC, ENCODING_FORMAT_VERSION, DTYPE_CODES[dtype], len(vector), model, scale
+    )
+    return header + payload.tobytes()
+
+
+def is_legacy(data):
+    """True for a raw float64 blob written before the versioned format"""
+    return bytes(data[:len(ENCODING_MAGIC)]) != ENCODING_MAGIC
+
+
+def encoding_info(data):
+    """Return (dtype name, dimension, model id) of a stored blob"""
+    if is_legacy(data):
+        return 'float64', len(data) // 8, DLIB_RESNET_V1
+    _, version, code, dimension, model, _ = ENCODING_HEADER.unpack_from(data)
+    if version != ENCODING_FORMAT_VERSION or code not in CODE_DTYPES:
+        raise ValueError(f'Unsupported face encoding format (version {version}, dtype {code})')
+    return CODE_DTYPES[code], dimension, model
+
+
+def decode_encoding(data, dtype=np.float32):
+    """Read a stored blob in either format as a `dtype` vector"""
+    data = bytes(data)
+    if is_legacy(data):
+        return np.frombuffer(data, dtype=np.float64).astype(dtype)
+
+    _, version, code, dimension, _, scale = ENCODING_HEADER.unpack_from(data)
+    if version != ENCODING_FORMAT_VERSION or code not in CODE_DTYPES:
+        raise ValueError(f'Unsupported face encoding format (version {version}, dtype {code})')
+    if CODE_DTYPES[code] == 'int8':
+        codes = np.frombuffer(data, dtype=np.int8, count=dimension, offset=ENCODING_HEADER.size)
+        return (codes * np.float32(scale)).astype(dtype, copy=False)
+    return np.frombuffer(data, dtype=np.float32, count=dimension, offset=ENCODING_HEADER.size).astype(dtype)
+
+
+def needs_conversion(data, dtype):
+    return bool(data) and (is_legacy(data) or encoding_info(data)[0] != dtype)
+
+
+def convert_encodings(model, fields, dtype=None, batch_size=500, start_pk=0, progress=None):
+    """Rewrite `fields` of every `model` row into the `dtype` format, in pk order.
+
+    Each batch commits on its own and rows already in the target format are
+    skipped, so an interrupted run can simply be started again (or resumed
+    from `start_pk`). Returns (rows converted, last pk seen).
+    """
+    dtype = dtype or default_dtype()
+    converted = 0
+    last_pk = start_pk
+    while True:
+        rows = list(model.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', *fields)[:batch_size])
+        if not rows:
+            return converted, last_pk
+
+        changed = []
+        for row in rows:
+            dirty = False
+            for field in fields:
+                value = getattr(row, field)
+                if needs_conversion(value, dtype):
+                    setattr(row, field, encode_encoding(decode_encoding(value), dtype))
+                    dirty = True
+            if dirty:
+                changed.append(row)
+        with transaction.atomic():
+            model.objects.bulk_update(changed, fields)
+
+        converted += len(changed)
+        last_pk = rows[-1].pk
+        if progress:
+            progress(converted, last_pk)
@@ -0,0 +1,183 @@
+"""Debouncing of repeated kiosk scans.
+
+Before recognition, a kiosk frame within FACE_SCAN_HASH_DISTANCE bits (of a
+256-bit difference hash) of a frame the same kiosk answered successfully in the
+last FACE_SCAN_FRAME_TTL seconds gets that response back without a dlib pass.
+The tolerance is tight and the window short, so only a near-identical resend of
+the same picture matches: the next person in the queue changes far more bits.
+
+After recognition, a successful response is also remembered per kiosk and
+recognized employee for FACE_SCAN_DEBOUNCE_TTL seconds. When the same kiosk
+recognizes the same employee again within that time (someone still standing at
+the camera), the earlier response is returned without another attendance
+transaction. Separately, an employee recognized again within FACE_SCAN_COOLDOWN
+seconds of checking in is not checked out. Recent results live in this worker
+process only, like the kiosk short lists in face_candidates.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .face_metrics import count_debounced_scan
+
+
+class RecentScans:
+    """LRU of kiosks, each mapping its recently recognized employees to (response, expiry)"""
+
+    def __init__(self, max_kiosks, per_kiosk=16):
+        self.max_kiosks = max_kiosks
+        self.per_kiosk = per_kiosk
+        self._kiosks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kiosk, employee_pk, now):
+        """The unexpired response the kiosk gave this employee, or None"""
+        with self._lock:
+            scans = self._kiosks.get(kiosk)
+            scan = scans.get(employee_pk) if scans else None
+            if scan is None:
+                return None
+            if scan[1] <= now:
+                del scans[employee_pk]
+                return None
+            return scan[0]
+
+    def add(self, kiosk, employee_pk, response, expires):
+        with self._lock:
+            scans = self._kiosks.get(kiosk)
+            if scans is None:
+                scans = self._kiosks[kiosk] = OrderedDict()
+                if len(self._kiosks) > self.max_kiosks:
+                    self._kiosks.popitem(last=False)
+            self._kiosks.move_to_end(kiosk)
+            scans.pop(employee_pk, None)
+            scans[employee_pk] = (response, expires)
+            if len(scans) > self.per_kiosk:
+                scans.popitem(last=False)
+
+
+class RecentFrames:
+    """LRU of kiosks, each holding its last successful (frame hash, response, expiry) entries"""
+
+    def __init__(self, max_kiosks, per_kiosk=4):
+        self.max_kiosks = max_kiosks
+        self.per_kiosk = per_kiosk
+        self._kiosks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kiosk, digest, max_distance, now):
+        """Response of the closest unexpired frame within `max_distance` bits of `digest`, or None"""
+        with self._lock:
+            frames = self._kiosks.get(kiosk)
+            if not frames:
+                return None
+            frames[:] = [frame for frame in frames if frame[2] > now]
+            best = None
+            for frame_digest, response, _ in frames:
+                distance = (frame_digest ^ digest).bit_count()
+                if distance <= max_distance and (best is None or distance < best[0]):
+                    best = distance, response
+            return best[1] if best else None
+
+    def add(self, kiosk, digest, response, expires):
+        with self._lock:
+            frames = self._kiosks.get(kiosk)
+            if frames is None:
+                frames = self._kiosks[kiosk] = []
+                if len(self._kiosks) > self.max_kiosks:
+                    self._kiosks.popitem(last=False)
+            self._kiosks.move_to_end(kiosk)
+            frames.append((digest, response, expires))
+            del frames[:-self.per_kiosk]
+
+
+_scans = None
+_frames = None
+_scans_lock = threading.Lock()
+
+
+def debounce_ttl():
+    return getattr(settings, 'FACE_SCAN_DEBOUNCE_TTL', 5.0)
+
+
+def get_recent_scans():
+    """Return the process-wide recent scans, or None when FACE_SCAN_DEBOUNCE_TTL is 0"""
+    global _scans
+    if not debounce_ttl():
+        return None
+    with _scans_lock:
+        if _scans is None:
+            _scans = RecentScans(getattr(settings, 'FACE_KIOSK_MAX_KIOSKS', 256))
+        return _scans
+
+
+def frame_ttl():
+    return getattr(settings, 'FACE_SCAN_FRAME_TTL', 2.0)
+
+
+def get_recent_frames():
+    """Return the process-wide recent frames, or None when FACE_SCAN_FRAME_TTL is 0"""
+    global _frames
+    if not frame_ttl():
+        return None
+    with _scans_lock:
+        if _frames is None:
+            _frames = RecentFrames(getattr(settings, 'FACE_KIOSK_MAX_KIOSKS', 256))
+        return _frames
+
+
+def recent_frame(kiosk, image_bytes):
+    """(frame hash, earlier response or None) for a kiosk frame, before recognition; the hash is None when off"""
+    frames = get_recent_frames() if kiosk else None
+    if frames is None:
+        return None, None
+    from .face_pipeline import frame_hash  # NumPy and PIL
+
+    digest = frame_hash(image_bytes)
+    if digest is None:
+        return None, None
+    response = frames.get(kiosk, digest, getattr(settings, 'FACE_SCAN_HASH_DISTANCE', 4), time.monotonic())
+    if response is None:
+        return digest, None
+    count_debounced_scan('frame')
+    return digest, dict(response, repeated=True)
+
+
+def remember_frame(kiosk, digest, response):
+    """Remember a successful kiosk response for the hash of the frame it answered"""
+    frames = get_recent_frames() if kiosk and digest is not None else None
+    if frames is not None and response.get('success'):
+        frames.add(kiosk, digest, response, time.monotonic() + frame_ttl())
+
+
+def recent_result(kiosk, employee_pk):
+    """The response this kiosk gave the recognized employee in the last FACE_SCAN_DEBOUNCE_TTL seconds, or None"""
+    scans = get_recent_scans() if kiosk else None
+    if scans is None:
+        return None
+    response = scans.get(kiosk, employee_pk, time.monotonic())
+    if response is None:
+        return None
+    count_debounced_scan('repeat')
+    return dict(response, repeated=True)
+
+
+def remember_result(kiosk, employee_pk, response, digest=None):
+    """Remember a successful kiosk response for the employee it recognized and the hash of its frame"""
+    scans = get_recent_scans() if kiosk else None
+    if scans is not None and response.get('success'):
+        scans.add(kiosk, employee_pk, response, time.monotonic() + debounce_ttl())
+    remember_frame(kiosk, digest, response)
+
+
+def in_cooldown(check_in):
+    """Whether a check-in is too recent for a new scan to count as the check-out"""
+    cooldown = getattr(settings, 'FACE_SCAN_COOLDOWN', 60)
+    if not cooldown or check_in is None or timezone.now() - check_in >= timedelta(seconds=cooldown):
+        return False
+    count_debounced_scan('cooldown')
+    return True
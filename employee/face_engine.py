@@ -0,0 +1,139 @@
+"""Face engines: the detection, encoding and distance backend behind the recognition pipeline.
+
+FACE_ENGINE is the dotted path of the engine class and `get_engine` returns
+one instance per process. `DlibEngine`, the default, wraps face_recognition
+and dlib. `HashEngine` needs neither: it is a deterministic pure-NumPy
+stand-in for benchmarks and load tests, which "detects" one centred face in
+any frame with detail and derives the encoding from a hash of the face crop.
+Images are RGB uint8 arrays and face locations (top, right, bottom, left)
+tuples in pixels of the image passed in.
+"""
+import hashlib
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+from PIL import Image
+
+DEFAULT_ENGINE = 'employee.face_engine.DlibEngine'
+
+
+class FaceEngine:
+    """Interface of a face engine"""
+
+    def warm_up(self):
+        """Load models so the first real call is not slowed down"""
+
+    def detect(self, image, upsample=1, model='hog'):
+        """Face locations in `image`"""
+        raise NotImplementedError
+
+    def encode(self, image, locations):
+        """One 128-d encoding per location"""
+        raise NotImplementedError
+
+    def batch_encode(self, images, locations):
+        """Encodings for several images; `locations` holds each image's face locations"""
+        return [self.encode(image, image_locations) for image, image_locations in zip(images, locations)]
+
+    def landmarks(self, image, location):
+        """5-point landmarks ({'left_eye': [2 points], 'right_eye': [2 points], 'nose_tip': [1 point]}) or None"""
+        return None
+
+    def distance(self, known, encoding):
+        """Euclidean distance from `encoding` to each row of `known`"""
+        known = np.asarray(known)
+        if not len(known):
+            return np.empty(0)
+        return np.linalg.norm(known - encoding, axis=1)
+
+
+class DlibEngine(FaceEngine):
+    """face_recognition/dlib: HOG or CNN detection and the ResNet face encoder"""
+
+    def __init__(self):
+        # Importing face_recognition loads the dlib detector, landmark and encoder models
+        import face_recognition  # noqa: F401
+
+    def warm_up(self):
+        import face_recognition
+        face_recognition.face_locations(np.zeros((64, 64, 3), dtype=np.uint8))
+
+    def detect(self, image, upsample=1, model='hog'):
+        import face_recognition
+        return face_recognition.face_locations(image, number_of_times_to_upsample=upsample, model=model)
+
+    def encode(self, image, locations):
+        import face_recognition
+        return face_recognition.face_encodings(image, locations)
+
+    def landmarks(self, image, location):
+        import face_recognition
+        landmarks = face_recognition.face_landmarks(image, [location], model='small')
+        return landmarks[0] if landmarks else None
+
+    def distance(self, known, encoding):
+        import face_recognition
+        return face_recognition.face_distance(known, encoding)
+
+
+class HashEngine(FaceEngine):
+    """Deterministic NumPy fake: the same face crop always gets the same pseudo-encoding.
+
+    A frame whose grayscale standard deviation is below `min_detail` (a blank
+    or uniform frame) has no face. Crops are reduced to 8x8 and quantized
+    before hashing, so re-encoding a JPEG rarely changes the encoding, while
+    different photos land about 1.4 apart, far beyond any match threshold.
+    """
+
+    # Face box side as a fraction of the shorter image side
+    FACE_FRACTION = 0.5
+
+    def __init__(self, min_detail=8.0):
+        self.min_detail = min_detail
+
+    def detect(self, image, upsample=1, model='hog'):
+        height, width = image.shape[:2]
+        if not height or not width or np.asarray(image, dtype=np.float32).mean(axis=2).std() < self.min_detail:
+            return []
+        side = int(min(height, width) * self.FACE_FRACTION)
+        top, left = (height - side) // 2, (width - side) // 2
+        return [(top, left + side, top + side, left)]
+
+    def encode(self, image, locations):
+        encodings = []
+        for top, right, bottom, left in locations:
+            crop = Image.fromarray(np.ascontiguousarray(image[top:bottom, left:right])).convert('L')
+            cells = np.asarray(crop.resize((8, 8), Image.Resampling.BOX)) // 32
+            digest = hashlib.blake2b(cells.tobytes(), digest_size=8).digest()
+            rng = np.random.default_rng(int.from_bytes(digest, 'big'))
+            # dlib encodings have a norm of about 1
+            encodings.append(rng.normal(0.0, 1.0 / np.sqrt(128), 128))
+        return encodings
+
+    def landmarks(self, image, location):
+        top, right, bottom, left = location
+        width, height = right - left, bottom - top
+        eye_y = top + height * 0.4
+        return {
+            'left_eye': [(left + width * 0.25, eye_y), (left + width * 0.4, eye_y)],
+            'right_eye': [(left + width * 0.6, eye_y), (left + width * 0.75, eye_y)],
+            'nose_tip': [(left + width * 0.5, top + height * 0.65)],
+        }
+
+
+_engine = None
+_engine_path = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """The FACE_ENGINE instance of this process, rebuilt if the setting changes"""
+    global _engine, _engine_path
+    path = getattr(settings, 'FACE_ENGINE', DEFAULT_ENGINE)
+    with _engine_lock:
+        if _engine is None or path != _engine_path:
+            _engine = import_string(path)()
+            _engine_path = path
+        return _engine
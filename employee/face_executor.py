@@ -0,0 +1,364 @@
+"""Shared process pool for dlib face detection and encoding.
+
+Views submit raw image bytes and get face locations plus encodings back, so a
+slow HOG pass occupies a pool process instead of the web worker thread.
+Each web worker process has its own pool, so a host runs WEB_CONCURRENCY x
+FACE_POOL_SIZE recognition processes; FACE_POOL_SIZE = None sizes every pool
+to its share of the host's CPUs. With FACE_POOL_SIZE = 0 the work runs inline
+in the calling thread.
+"""
+import asyncio
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+
+class RecognitionError(Exception):
+    """Failure inside the recognition task; `stage` is one of load, chip, detect, encode or pool"""
+
+    def __init__(self, stage, message):
+        super().__init__(stage, message)
+        self.stage = stage
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class RecognitionBusy(Exception):
+    """Every pool slot and queue slot is taken"""
+
+
+class RecognitionTimeout(Exception):
+    """The task did not finish within its deadline"""
+
+
+def _init_worker():
+    from .face_engine import get_engine
+    get_engine()
+
+
+def _warm_up():
+    from . import face_pipeline  # noqa: F401  (PIL)
+    from .face_engine import get_engine
+    from .face_policy import detection_costs
+    get_engine().warm_up()
+    detection_costs()
+    return True
+
+
+def detect_and_encode(image_bytes, model='hog', upsample=1, max_faces=None, timings=None, prefilter=False, site=None):
+    """Decode `image_bytes`, detect faces and encode the first `max_faces` of them (all if None).
+
+    With a call `site` ('kiosk' or 'enrollment'), the model, upsampling and
+    detection size come from the face_policy latency budget for this image
+    instead of `model` and `upsample`. With `prefilter`, frames without a Haar
+    face candidate are rejected before dlib and HOG only searches around the
+    candidates. When a `timings` dict is given, the seconds spent in each
+    stage are stored in it.
+    """
+    from .face_pipeline import decode_image, detect_faces, detect_faces_near, encode_faces, haar_candidates
+    from .face_policy import detection_params
+
+    started = time.perf_counter()
+    try:
+        image = decode_image(image_bytes)
+    except Exception as e:
+        raise RecognitionError('load', str(e))
+
+    loaded = time.perf_counter()
+    if timings is not None:
+        timings['load'] = loaded - started
+    max_size = None
+    if site is not None:
+        model, upsample, max_size = detection_params(site, image.shape[1], image.shape[0])
+    try:
+        if prefilter:
+            hints = haar_candidates(image)
+            if timings is not None:
+                timings['prefilter'] = time.perf_counter() - loaded
+            if not hints:
+                return [], []
+            locations = detect_faces_near(image, hints, model=model, upsample=upsample, max_size=max_size)
+        else:
+            locations = detect_faces(image, model=model, upsample=upsample, max_size=max_size)
+    except Exception as e:
+        raise RecognitionError('detect', str(e))
+
+    detected = time.perf_counter()
+    if timings is not None:
+        timings['detect'] = detected - loaded
+    if not locations:
+        return [], []
+
+    try:
+        encodings = encode_faces(image, locations[:max_faces])
+    except Exception as e:
+        raise RecognitionError('encode', str(e))
+    if timings is not None:
+        timings['encode'] = time.perf_counter() - detected
+    return locations, encodings
+
+
+def detect_and_encode_timed(image_bytes, **kwargs):
+    """`detect_and_encode` that also returns its {stage: seconds} timings, measured where the task runs"""
+    timings = {}
+    locations, encodings = detect_and_encode(image_bytes, timings=timings, **kwargs)
+    return locations, encodings, timings
+
+
+def encode_chip(image_bytes, box, timings=None):
+    """Encode a client-cropped face chip at its validated `box`, skipping full-frame detection.
+
+    Returns ([box], encodings) like `detect_and_encode`.
+    """
+    from .face_pipeline import decode_image, encode_faces, validate_chip_box
+
+    started = time.perf_counter()
+    try:
+        image = decode_image(image_bytes)
+    except Exception as e:
+        raise RecognitionError('load', str(e))
+    try:
+        box = validate_chip_box(image, box)
+    except ValueError as e:
+        raise RecognitionError('chip', str(e))
+
+    loaded = time.perf_counter()
+    try:
+        encodings = encode_faces(image, [box])
+    except Exception as e:
+        raise RecognitionError('encode', str(e))
+    if timings is not None:
+        timings['load'] = loaded - started
+        timings['encode'] = time.perf_counter() - loaded
+    return [box], encodings
+
+
+def encode_chip_timed(image_bytes, box):
+    """`encode_chip` that also returns its {stage: seconds} timings"""
+    timings = {}
+    locations, encodings = encode_chip(image_bytes, box, timings=timings)
+    return locations, encodings, timings
+
+
+def detect_and_encode_batch(images, model='hog', upsample=1, max_faces=None, prefilter=False, site=None):
+    """Run `detect_and_encode` over several frames in one task (see `run_recognition_batch` to spread them).
+
+    Returns one (locations, encodings, error) tuple per frame, where error is
+    a (stage, message) pair or None, so one bad frame does not fail the batch.
+    """
+    results = []
+    for image_bytes in images:
+        try:
+            locations, encodings = detect_and_encode(
+                image_bytes, model=model, upsample=upsample, max_faces=max_faces, prefilter=prefilter, site=site
+            )
+            results.append((locations, encodings, None))
+        except RecognitionError as e:
+            results.append(([], [], (e.stage, e.message)))
+    return results
+
+
+def select_burst_frame(images, top_k=3, site='enrollment'):
+    """Pick the enrollment frame of a burst worth storing, encoding only the most promising frames.
+
+    Frames showing exactly one face are ranked by `face_quality` (sharpness,
+    face size, pose) and only the `top_k` best are encoded; of those, the one
+    whose encoding is closest to their mean is kept, so a single odd frame
+    cannot win. Returns (frame index, location, encoding, scores), scores
+    holding each frame's quality score or None, or None if no frame qualifies.
+    """
+    import numpy as np
+    from .face_pipeline import decode_image, detect_faces, encode_faces, face_quality, quality_score
+    from .face_policy import detection_params
+
+    scores = [None] * len(images)
+    ranked = []
+    for index, image_bytes in enumerate(images):
+        try:
+            image = decode_image(image_bytes)
+        except Exception:
+            continue
+        model, upsample, max_size = detection_params(site, image.shape[1], image.shape[0])
+        try:
+            locations = detect_faces(image, model=model, upsample=upsample, max_size=max_size)
+        except Exception as e:
+            raise RecognitionError('detect', str(e))
+        if len(locations) != 1:
+            continue
+        scores[index] = quality_score(face_quality(image, locations[0]))
+        ranked.append((scores[index], index, image, locations[0]))
+    if not ranked:
+        return None
+
+    ranked.sort(key=lambda item: item[0], reverse=True)
+    top = ranked[:max(1, top_k)]
+    try:
+        encodings = [encode_faces(image, [location])[0] for _, _, image, location in top]
+    except Exception as e:
+        raise RecognitionError('encode', str(e))
+    best = int(np.argmin(np.linalg.norm(np.asarray(encodings) - np.mean(encodings, axis=0), axis=1)))
+    _, index, _, location = top[best]
+    return index, location, encodings[best], scores
+
+
+class RecognitionExecutor:
+    """Bounded, pre-warmed process pool with per-task deadlines"""
+
+    def __init__(self, workers, queue_depth, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        # Spawned children do not inherit the web worker's threads, locks or DB connections
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+        )
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+
+    def warm_up(self, wait=False):
+        """Start every child process and load the models before the first real task"""
+        futures = [self._pool.submit(_warm_up) for _ in range(self.workers)]
+        if wait:
+            for future in futures:
+                future.result()
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise RecognitionBusy('Hệ thống nhận diện đang bận, vui lòng thử lại')
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=timeout or self.timeout)
+        except FutureTimeoutError:
+            # Only drops tasks still waiting in the queue; a running task finishes in the background
+            future.cancel()
+            raise RecognitionTimeout('Quá thời gian xử lý nhận diện')
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def pool_size():
+    """FACE_POOL_SIZE, or with None this web worker's share of the CPUs among the host's WEB_CONCURRENCY workers"""
+    workers = getattr(settings, 'FACE_POOL_SIZE', 0)
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // max(1, getattr(settings, 'WEB_CONCURRENCY', 1)))
+    return workers
+
+
+def get_recognition_executor():
+    """Return the process-wide executor, or None when recognition runs inline"""
+    global _executor
+    workers = pool_size()
+    if not workers:
+        return None
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = RecognitionExecutor(
+                workers=workers,
+                queue_depth=getattr(settings, 'FACE_POOL_QUEUE_DEPTH', 16),
+                timeout=getattr(settings, 'FACE_TASK_TIMEOUT', 5.0),
+            )
+            _executor.warm_up()
+            atexit.register(_executor.shutdown)
+        return _executor
+
+
+def warm_up_recognition():
+    """Load the face models and pipeline here and, when recognition runs on the pool, in every pool process"""
+    # Views compare encodings with the engine in the web process even when the pool does the detection
+    _warm_up()
+    executor = get_recognition_executor()
+    if executor is not None:
+        executor.warm_up(wait=True)
+
+
+def _reset_executor(executor):
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown()
+
+
+def run_recognition(fn, *args, **kwargs):
+    """Run a recognition task on the shared pool, or inline when the pool is disabled"""
+    executor = get_recognition_executor()
+    if executor is None:
+        return fn(*args, **kwargs)
+    try:
+        return executor.run(fn, *args, **kwargs)
+    except BrokenProcessPool as e:
+        # A child crashed inside dlib; start a fresh pool for the next request
+        _reset_executor(executor)
+        raise RecognitionError('pool', str(e))
+
+
+def run_recognition_batch(images, **kwargs):
+    """Run `detect_and_encode_batch` over `images`, split into one chunk per pool process.
+
+    The chunks are detected and encoded in parallel and their results returned
+    in frame order, like `detect_and_encode_batch`. All chunks share one
+    FACE_TASK_TIMEOUT deadline; when the queue cannot take every chunk, the ones
+    already queued are cancelled and RecognitionBusy is raised. Runs inline when
+    the pool is disabled.
+    """
+    executor = get_recognition_executor()
+    if executor is None:
+        return detect_and_encode_batch(images, **kwargs)
+    size = -(-len(images) // executor.workers)
+    futures = []
+    try:
+        for start in range(0, len(images), size):
+            futures.append(executor.submit(detect_and_encode_batch, images[start:start + size], **kwargs))
+        deadline = time.monotonic() + executor.timeout
+        results = []
+        for future in futures:
+            results.extend(future.result(timeout=max(deadline - time.monotonic(), 0)))
+        return results
+    except FutureTimeoutError:
+        raise RecognitionTimeout('Quá thời gian xử lý nhận diện')
+    except BrokenProcessPool as e:
+        _reset_executor(executor)
+        raise RecognitionError('pool', str(e))
+    finally:
+        # Drops chunks still waiting in the queue after a failure; finished ones are unaffected
+        for future in futures:
+            future.cancel()
+
+
+async def arun_recognition(fn, *args, **kwargs):
+    """Async `run_recognition`: awaits the pool without holding a thread, or runs inline work in a thread"""
+    executor = get_recognition_executor()
+    if executor is None:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    try:
+        future = executor.submit(fn, *args, **kwargs)
+        # Cancelling the wrapper on timeout also cancels the task if it has not started yet
+        return await asyncio.wait_for(asyncio.wrap_future(future), executor.timeout)
+    except asyncio.TimeoutError:
+        raise RecognitionTimeout('Quá thời gian xử lý nhận diện')
+    except BrokenProcessPool as e:
+        _reset_executor(executor)
+        raise RecognitionError('pool', str(e))
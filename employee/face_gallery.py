@@ -0,0 +1,563 @@
+"""In-memory gallery of enrolled face encodings used for 1:N matching."""
+import copy
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: exporters rely on the generation check alone
+    fcntl = None
+
+import numpy as np
+from django.conf import settings
+
+from .face_codec import decode_encoding
+from .face_index import IVFIndex
+from .models import CacheGeneration, FaceTemplate
+
+logger = logging.getLogger(__name__)
+
+# Gallery file: fixed header padded to 64 bytes, then employee pks (int64),
+# template owners (int64), squared norms, the template matrix and a JSON side table.
+GALLERY_FILE_MAGIC = b'EMPFACE1'
+GALLERY_FILE_VERSION = 3
+GALLERY_FILE_HEADER = struct.Struct('<8sI4sIQQQQ')
+GALLERY_FILE_DATA_OFFSET = 64
+# Fields shared by every file version, up to and including the generation
+GALLERY_FILE_HEADER_PREFIX = struct.Struct('<8sI4sIQ')
+
+# CacheGeneration row bumped on every invalidation, so other processes rebuild too
+GENERATION_NAME = 'face_gallery'
+
+FaceMatch = namedtuple('FaceMatch', ['employee_pk', 'employee_id', 'name', 'department', 'distance'])
+
+
+class FaceGallery:
+    """Contiguous matrix of active employees' face templates plus a compact side table.
+
+    Templates of one employee occupy consecutive rows; `owners[row]` is the
+    position of that employee in the side table. Without `owners` every
+    employee has exactly one row.
+    """
+
+    def __init__(self, employee_pks, employee_ids, names, departments, encodings, owners=None, sq_norms=None,
+                 generation=0, department_ids=None, sites=None):
+        self.employee_pks = np.asarray(employee_pks, dtype=np.int64)
+        self.employee_ids = list(employee_ids)
+        self.names = list(names)
+        self.departments = list(departments)
+        # Partition keys; -1 stands for no department
+        if department_ids is None:
+            department_ids = [-1] * len(self.employee_pks)
+        self.department_ids = np.asarray(department_ids, dtype=np.int64)
+        self.sites = list(sites) if sites is not None else [''] * len(self.employee_pks)
+        if owners is None:
+            owners = np.arange(len(self.employee_pks))
+        self.owners = np.asarray(owners, dtype=np.int64)
+        # float32 halves memory and GEMM bandwidth; its rounding is far below match thresholds
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32)
+        if self.encodings.ndim != 2:
+            self.encodings = self.encodings.reshape(len(self.owners), -1)
+        if sq_norms is None:
+            sq_norms = np.einsum('ij,ij->i', self.encodings, self.encodings)
+        self.sq_norms = sq_norms
+        self.generation = generation
+        # First row of each employee, for reducing template distances to one per employee
+        self.starts = np.searchsorted(self.owners, np.arange(len(self.employee_pks)))
+        self.single_template = len(self.owners) == len(self.employee_pks)
+        self.max_templates = int(np.diff(np.append(self.starts, len(self.owners))).max()) if len(self.owners) else 0
+        self.index = None
+        self.positions = None
+        self.partitions = {}
+        # Per employee position: distance from each of its templates to the closest template of anyone else
+        self.separations = {}
+
+    def build_index(self, recall_target=0.99, n_lists=None):
+        """Attach an approximate index; exact search is still used if it returns nothing"""
+        self.index = IVFIndex(self.encodings, self.sq_norms, n_lists=n_lists, recall_target=recall_target)
+        return self.index
+
+    @classmethod
+    def from_database(cls):
+        """Load every face template of active employees in a single query"""
+        rows = FaceTemplate.objects.filter(
+            employee__is_active=True
+        ).values_list(
+            'employee_id', 'employee__employee_id', 'employee__user__first_name', 'employee__user__last_name',
+            'employee__department__name', 'employee__department_id', 'employee__site', 'encoding'
+        ).order_by('employee_id', 'pk')
+
+        pks, employee_ids, names, departments, department_ids, sites, owners, encodings = [], [], [], [], [], [], [], []
+        for pk, employee_id, first_name, last_name, department, department_id, site, encoding in rows:
+            if not encoding:
+                continue
+            if not pks or pks[-1] != pk:
+                pks.append(pk)
+                employee_ids.append(employee_id)
+                # Same format as User.get_full_name()
+                names.append(f'{first_name} {last_name}'.strip())
+                departments.append(department or '')
+                department_ids.append(department_id or -1)
+                sites.append(site)
+            owners.append(len(pks) - 1)
+            encodings.append(decode_encoding(encoding))
+
+        if encodings:
+            matrix = np.vstack(encodings)
+        else:
+            matrix = np.empty((0, 128), dtype=np.float32)
+        return cls(
+            pks, employee_ids, names, departments, matrix, owners=owners, department_ids=department_ids, sites=sites
+        )
+
+    @classmethod
+    def from_file(cls, path):
+        """Map a gallery file written by `to_file`; the arrays share the page cache"""
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, dtype, dimension, generation, count, rows, side_table_length = \
+            GALLERY_FILE_HEADER.unpack_from(buffer, 0)
+        if magic != GALLERY_FILE_MAGIC or version != GALLERY_FILE_VERSION:
+            raise ValueError(f'{path} is not a face gallery file')
+        dtype = np.dtype(dtype.rstrip(b'\0').decode())
+
+        offset = GALLERY_FILE_DATA_OFFSET
+        pks = np.frombuffer(buffer, np.int64, count, offset) if count else np.empty(0, np.int64)
+        offset += count * 8
+        owners = np.frombuffer(buffer, np.int64, rows, offset) if rows else np.empty(0, np.int64)
+        offset += rows * 8
+        sq_norms = np.frombuffer(buffer, dtype, rows, offset) if rows else np.empty(0, dtype)
+        offset += rows * dtype.itemsize
+        encodings = np.frombuffer(buffer, dtype, rows * dimension, offset) if rows else np.empty(0, dtype)
+        offset += rows * dimension * dtype.itemsize
+        side_table = json.loads(buffer[offset:offset + side_table_length])
+
+        return cls(
+            pks, side_table['employee_ids'], side_table['names'], side_table['departments'],
+            encodings.reshape(rows, dimension), owners=owners, sq_norms=sq_norms, generation=generation,
+            department_ids=side_table['department_ids'], sites=side_table['sites']
+        )
+
+    def to_file(self, path, generation):
+        """Atomically replace `path` with this gallery so readers never see a partial file"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        side_table = json.dumps({
+            'employee_ids': self.employee_ids,
+            'names': self.names,
+            'departments': self.departments,
+            'department_ids': self.department_ids.tolist(),
+            'sites': self.sites,
+        }).encode()
+        header = GALLERY_FILE_HEADER.pack(
+            GALLERY_FILE_MAGIC, GALLERY_FILE_VERSION, self.encodings.dtype.str.encode(),
+            self.encodings.shape[1], generation, len(self), len(self.owners), len(side_table)
+        )
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.face_gallery')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header.ljust(GALLERY_FILE_DATA_OFFSET, b'\0'))
+                f.write(self.employee_pks.tobytes())
+                f.write(self.owners.tobytes())
+                f.write(np.ascontiguousarray(self.sq_norms, dtype=self.encodings.dtype).tobytes())
+                f.write(self.encodings.tobytes())
+                f.write(side_table)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.generation = generation
+
+    def __len__(self):
+        return len(self.employee_ids)
+
+    def position_of(self, employee_pk):
+        """Side-table position of an employee, or None if it is not in the gallery"""
+        if self.positions is None:
+            # Built on first use; the gallery is replaced, never mutated, when employees change
+            self.positions = {int(pk): position for position, pk in enumerate(self.employee_pks)}
+        return self.positions.get(employee_pk)
+
+    def template_rows(self, positions):
+        """Template row numbers of the employees at the given side-table positions"""
+        ends = np.append(self.starts[1:], len(self.owners))
+        if not len(positions):
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(self.starts[position], ends[position]) for position in positions])
+
+    def subset(self, positions):
+        """New gallery holding only the employees at the given (ascending) side-table positions"""
+        positions = np.asarray(positions, dtype=np.int64)
+        rows = self.template_rows(positions)
+        # Owners renumbered to the subset's own side table
+        owners = np.searchsorted(positions, self.owners[rows])
+        return FaceGallery(
+            self.employee_pks[positions], [self.employee_ids[i] for i in positions], [self.names[i] for i in positions],
+            [self.departments[i] for i in positions], self.encodings[rows], owners=owners,
+            sq_norms=self.sq_norms[rows], generation=self.generation,
+            department_ids=self.department_ids[positions], sites=[self.sites[i] for i in positions]
+        )
+
+    def partition(self, department_id=None, site=None):
+        """Gallery of the employees in one department and/or site, derived on first use and kept"""
+        key = (department_id, site or None)
+        partition = self.partitions.get(key)
+        if partition is None:
+            mask = np.ones(len(self), dtype=bool)
+            if department_id is not None:
+                mask &= self.department_ids == department_id
+            if site:
+                mask &= np.array([employee_site == site for employee_site in self.sites], dtype=bool)
+            partition = self.partitions[key] = self.subset(np.flatnonzero(mask))
+        return partition
+
+    def with_employee_moved(self, employee_pk, department_id, department, site):
+        """Copy of this gallery with one employee in another department/site, sharing the template arrays.
+
+        Returns None if the employee is not in the gallery.
+        """
+        position = self.position_of(employee_pk)
+        if position is None:
+            return None
+        moved = copy.copy(self)
+        moved.departments = list(self.departments)
+        moved.departments[position] = department
+        moved.department_ids = self.department_ids.copy()
+        moved.department_ids[position] = department_id if department_id is not None else -1
+        moved.sites = list(self.sites)
+        moved.sites[position] = site
+        # Only the partitions the employee leaves or joins are derived again
+        moved.partitions = {
+            key: partition for key, partition in self.partitions.items()
+            if partition.position_of(employee_pk) is None and not moved.in_partition(position, *key)
+        }
+        return moved
+
+    def in_partition(self, position, department_id, site):
+        if department_id is not None and self.department_ids[position] != department_id:
+            return False
+        return not site or self.sites[position] == site
+
+    def template_distances(self, encoding):
+        """Euclidean distance from `encoding` to every template row with one matrix-vector product"""
+        query = np.asarray(encoding, dtype=self.encodings.dtype)
+        squared = self.sq_norms - 2.0 * (self.encodings @ query) + query @ query
+        np.maximum(squared, 0.0, out=squared)
+        return np.sqrt(squared, out=squared)
+
+    def distances(self, encoding):
+        """Distance from `encoding` to each employee's closest template"""
+        distances = self.template_distances(encoding)
+        if self.single_template or not len(distances):
+            return distances
+        return np.minimum.reduceat(distances, self.starts)
+
+    def distance_matrix(self, encodings):
+        """Distances from each query encoding (rows) to each employee's closest template (columns) with one GEMM"""
+        queries = np.asarray(encodings, dtype=self.encodings.dtype).reshape(-1, self.encodings.shape[1])
+        query_sq_norms = np.einsum('ij,ij->i', queries, queries)
+        squared = self.sq_norms[None, :] - 2.0 * (queries @ self.encodings.T) + query_sq_norms[:, None]
+        np.maximum(squared, 0.0, out=squared)
+        distances = np.sqrt(squared, out=squared)
+        if self.single_template or not distances.size:
+            return distances
+        return np.minimum.reduceat(distances, self.starts, axis=1)
+
+    def get_match(self, index, distance):
+        return FaceMatch(
+            employee_pk=int(self.employee_pks[index]),
+            employee_id=self.employee_ids[index],
+            name=self.names[index],
+            department=self.departments[index],
+            distance=float(distance),
+        )
+
+    def search(self, encoding, k):
+        """Return (employee indices, distances) of the k closest employees, through the index when present"""
+        if self.index is not None:
+            # Fetch enough templates that k distinct employees survive deduplication
+            rows, distances = self.index.search(encoding, k * self.max_templates)
+            if len(rows):
+                # Rows come sorted by distance, so each employee's first row is its closest template
+                owners = self.owners[rows]
+                _, first = np.unique(owners, return_index=True)
+                first = np.sort(first)[:k]
+                return owners[first], distances[first]
+        distances = self.distances(encoding)
+        k = min(k, len(distances))
+        rows = np.argpartition(distances, k - 1)[:k]
+        rows = rows[np.argsort(distances[rows])]
+        return rows, distances[rows]
+
+    def template_separation(self, position):
+        """Distance from each template of the employee at `position` to the closest template of anyone else.
+
+        One pass over the gallery per employee, kept for the life of this gallery
+        (which is replaced, never mutated, when templates change).
+        """
+        separation = self.separations.get(position)
+        if separation is None:
+            rows = self.template_rows([position])
+            squared = (self.sq_norms[:, None] - 2.0 * (self.encodings @ self.encodings[rows].T)
+                       + self.sq_norms[rows][None, :])
+            squared[rows] = np.inf
+            separation = np.sqrt(np.maximum(squared.min(axis=0, initial=np.inf), 0.0))
+            self.separations[position] = separation
+        return separation
+
+    def candidate_match(self, encoding, employee_pks):
+        """Return the closest FaceMatch among the given employees if no one else in the gallery can be closer.
+
+        By the triangle inequality every other employee is at least
+        `separation - distance` from the query, where `separation` is how far the
+        matched template lies from anyone else's; a match with 2 * distance below
+        that is the gallery's best match without searching it. Returns None when
+        that does not hold or none of the employees is in the gallery.
+        """
+        positions = [position for position in map(self.position_of, employee_pks) if position is not None]
+        if not positions:
+            return None
+        rows = self.template_rows(positions)
+
+        query = np.asarray(encoding, dtype=self.encodings.dtype)
+        squared = self.sq_norms[rows] - 2.0 * (self.encodings[rows] @ query) + query @ query
+        best = int(np.argmin(squared))
+        distance = np.sqrt(max(float(squared[best]), 0.0))
+        position = int(self.owners[rows[best]])
+        if 2.0 * distance >= self.template_separation(position)[rows[best] - self.starts[position]]:
+            return None
+        return self.get_match(position, distance)
+
+    def best_match(self, encoding):
+        """Return the closest FaceMatch, or None when the gallery is empty"""
+        if not len(self):
+            return None
+        rows, distances = self.search(encoding, 1)
+        return self.get_match(rows[0], distances[0])
+
+    def best_matches(self, encodings):
+        """Return the closest FaceMatch for each query encoding (None for all if the gallery is empty)"""
+        if not len(self):
+            return [None] * len(encodings)
+        if self.index is not None:
+            return [self.best_match(encoding) for encoding in encodings]
+        distances = self.distance_matrix(encodings)
+        best = np.argmin(distances, axis=1)
+        return [self.get_match(index, row[index]) for index, row in zip(best, distances)]
+
+    def assign_matches(self, encodings, exclude=()):
+        """One-to-one FaceMatch per query encoding (faces of one frame) from a single distance matrix.
+
+        Pairs are taken closest first, so two queries never get the same
+        employee; a query left without an employee (more faces than employees,
+        or all of them in `exclude`, a set of employee pks) gets None.
+        """
+        matches = [None] * len(encodings)
+        if not len(self) or not len(encodings):
+            return matches
+        claimed = {position for position in map(self.position_of, exclude) if position is not None}
+        distances = self.distance_matrix(encodings)
+        # Other queries claim at most len(encodings) - 1 employees and `exclude` the rest, so each
+        # query's len(encodings) + len(claimed) closest employees are the only ones it can end up with
+        k = min(len(encodings) + len(claimed), len(self))
+        columns = np.argpartition(distances, k - 1, axis=1)[:, :k].ravel()
+        queries = np.repeat(np.arange(len(encodings)), k)
+        pair_distances = distances[queries, columns]
+
+        for pair in np.argsort(pair_distances, kind='stable'):
+            query, column = queries[pair], columns[pair]
+            if matches[query] is None and column not in claimed:
+                matches[query] = self.get_match(column, pair_distances[pair])
+                claimed.add(column)
+        return matches
+
+    def top_k(self, encoding, k=5):
+        """Return the k closest FaceMatch entries ordered by distance"""
+        if not len(self):
+            return []
+        rows, distances = self.search(encoding, k)
+        return [self.get_match(row, distance) for row, distance in zip(rows, distances)]
+
+
+def read_gallery_generation(path):
+    """Generation stored in a gallery file header, or 0 if there is no valid file"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(GALLERY_FILE_HEADER_PREFIX.size)
+        magic, _, _, _, generation = GALLERY_FILE_HEADER_PREFIX.unpack(header)
+    except (OSError, struct.error):
+        return 0
+    return generation if magic == GALLERY_FILE_MAGIC else 0
+
+
+def export_gallery_file(path=None):
+    """Write the database gallery to the shared file at the current generation, unless the file already has it.
+
+    Exporters hold an exclusive lock on `path`.lock and read the generation
+    before the gallery, so the file never claims a generation newer than its
+    contents and concurrent exporters write each generation once. Returns the
+    gallery written, or None when the file was already current.
+    """
+    path = path or settings.FACE_GALLERY_FILE
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f'{path}.lock', 'a') as lock:
+        if fcntl is not None:
+            # Released when the lock file is closed
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        generation = CacheGeneration.read(GENERATION_NAME)
+        if not generation:
+            # Generation 0 is what a missing file reads as; start counting so the two differ
+            generation = CacheGeneration.bump(GENERATION_NAME)
+        if read_gallery_generation(path) >= generation:
+            return None
+        gallery = FaceGallery.from_database()
+        gallery.to_file(path, generation)
+        return gallery
+
+
+def _prepare(gallery):
+    # Brute force is faster than probing an index for small galleries
+    if getattr(settings, 'FACE_ANN_ENABLED', False) and len(gallery) >= getattr(settings, 'FACE_ANN_MIN_GALLERY', 5000):
+        gallery.build_index(
+            recall_target=getattr(settings, 'FACE_ANN_RECALL_TARGET', 0.99),
+            n_lists=getattr(settings, 'FACE_ANN_LISTS', None),
+        )
+    return gallery
+
+
+_lock = threading.Lock()
+_gallery = None
+_built_version = -1
+_version = 0
+_mapped = None
+_mapped_key = None
+_generation = None
+_generation_checked = 0.0
+
+
+def invalidate_gallery():
+    """Mark the gallery stale in every process.
+
+    A shared gallery file is not written here: `manage.py export_face_gallery`
+    rewrites it for the new generation, and until then workers use a gallery
+    built from the database.
+    """
+    global _version, _generation
+    with _lock:
+        _version += 1
+    try:
+        generation = CacheGeneration.bump(GENERATION_NAME)
+        with _lock:
+            _generation = generation
+    except Exception:
+        logger.exception('Không thể cập nhật phiên bản thư viện khuôn mặt')
+
+
+def move_employee(employee_pk, department_id, department, site):
+    """Move one employee to another department/site partition without rebuilding this process's gallery.
+
+    Other processes rebuild on the generation bump; with a shared gallery file this is a plain
+    `invalidate_gallery`, and the exporter rewrites the file.
+    """
+    global _gallery, _built_version, _version, _generation
+    if getattr(settings, 'FACE_GALLERY_FILE', None):
+        invalidate_gallery()
+        return
+
+    with _lock:
+        gallery = _gallery if _built_version == _version else None
+        moved = gallery.with_employee_moved(employee_pk, department_id, department, site) if gallery else None
+        # A new version also discards any rebuild that read the database before the move
+        _version += 1
+        if moved is not None:
+            _gallery = moved
+            _built_version = _version
+        previous = _generation
+    try:
+        generation = CacheGeneration.bump(GENERATION_NAME)
+        with _lock:
+            # A jump of more than one means another process changed the gallery too
+            if previous is None or generation != previous + 1:
+                _version += 1
+            _generation = generation
+    except Exception:
+        logger.exception('Không thể cập nhật phiên bản thư viện khuôn mặt')
+
+
+def _get_mapped_gallery(path):
+    """The shared file's gallery, or None while the file is missing, unreadable or older than the generation"""
+    global _mapped, _mapped_key
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    # Exporters always replace the file, so a new inode or mtime means a new generation
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        gallery = _mapped if _mapped_key == key else None
+    if gallery is None:
+        try:
+            gallery = _prepare(FaceGallery.from_file(path))
+        except ValueError:
+            # Written by an older release in a format this one cannot map, until the exporter replaces it
+            return None
+        with _lock:
+            _mapped, _mapped_key = gallery, key
+    with _lock:
+        if _generation is not None and gallery.generation < _generation:
+            return None
+    return gallery
+
+
+def _sync_generation():
+    """Treat a generation bumped by another process (web or encoding worker) as an invalidation"""
+    global _version, _generation, _generation_checked
+    now = time.monotonic()
+    if now - _generation_checked < getattr(settings, 'FACE_GALLERY_GENERATION_TTL', 1.0):
+        return
+    _generation_checked = now
+    generation = CacheGeneration.read(GENERATION_NAME)
+    with _lock:
+        if generation != _generation:
+            if _generation is not None:
+                _version += 1
+            _generation = generation
+
+
+def get_gallery():
+    """Return the process-wide gallery, rebuilding or remapping it when it has changed"""
+    global _gallery, _built_version
+    _sync_generation()
+    path = getattr(settings, 'FACE_GALLERY_FILE', None)
+    if path:
+        gallery = _get_mapped_gallery(path)
+        if gallery is not None:
+            with _lock:
+                # Drop the private fallback once the shared file has caught up
+                _gallery = None
+            return gallery
+
+    with _lock:
+        if _gallery is not None and _built_version == _version:
+            return _gallery
+        version = _version
+    gallery = _prepare(FaceGallery.from_database())
+    with _lock:
+        # Keep the newer gallery if another thread finished first
+        if _built_version <= version:
+            _gallery = gallery
+            _built_version = version
+        return _gallery
@@ -0,0 +1,109 @@
+"""Approximate nearest-neighbour index over face encodings (IVF / k-means lists)."""
+import numpy as np
+
+CHUNK_SIZE = 8192
+
+
+def _squared_distances(rows, row_sq_norms, points):
+    """Squared euclidean distances between every row and every point"""
+    point_sq_norms = np.einsum('ij,ij->i', points, points)
+    squared = row_sq_norms[:, None] - 2.0 * (rows @ points.T) + point_sq_norms[None, :]
+    return np.maximum(squared, 0.0, out=squared)
+
+
+def _nearest(rows, row_sq_norms, points, chunk_size=CHUNK_SIZE):
+    """Index of the nearest point for every row, computed in bounded chunks"""
+    nearest = np.empty(len(rows), dtype=np.int64)
+    for start in range(0, len(rows), chunk_size):
+        stop = start + chunk_size
+        squared = _squared_distances(rows[start:stop], row_sq_norms[start:stop], points)
+        nearest[start:stop] = np.argmin(squared, axis=1)
+    return nearest
+
+
+class IVFIndex:
+    """Inverted-file index: encodings are bucketed by their nearest k-means centroid.
+
+    A query only scans the `nprobe` closest buckets and the candidates are
+    re-ranked with exact distances, so results are identical to brute force
+    whenever the true neighbour falls in a probed bucket. `nprobe` is picked
+    at build time as the smallest value reaching `recall_target` on noisy
+    copies of gallery rows.
+    """
+
+    def __init__(self, encodings, sq_norms, n_lists=None, recall_target=0.99,
+                 calibration_noise=0.03, iterations=10, seed=0):
+        self.encodings = encodings
+        self.sq_norms = sq_norms
+        self.recall_target = recall_target
+        rng = np.random.default_rng(seed)
+
+        count = len(encodings)
+        if n_lists is None:
+            n_lists = int(np.sqrt(count))
+        self.n_lists = max(1, min(n_lists, count))
+
+        self.centroids = self._train(rng, iterations)
+        self.centroid_sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        assignments = _nearest(encodings, sq_norms, self.centroids)
+
+        # Rows grouped by bucket: bucket b owns order[offsets[b]:offsets[b + 1]]
+        self.order = np.argsort(assignments, kind='stable')
+        self.offsets = np.zeros(self.n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=self.n_lists), out=self.offsets[1:])
+
+        self.nprobe = self._calibrate(rng, calibration_noise)
+
+    def _train(self, rng, iterations):
+        # Lloyd's k-means on a bounded sample keeps the build time flat for large galleries
+        sample_size = min(len(self.encodings), self.n_lists * 64)
+        sample = self.encodings[rng.choice(len(self.encodings), sample_size, replace=False)]
+        sample_sq_norms = np.einsum('ij,ij->i', sample, sample)
+        centroids = sample[rng.choice(sample_size, self.n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = _nearest(sample, sample_sq_norms, centroids)
+            counts = np.bincount(assignments, minlength=self.n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        return centroids
+
+    def _calibrate(self, rng, noise, sample_size=200):
+        sample_size = min(sample_size, len(self.encodings))
+        rows = rng.choice(len(self.encodings), sample_size, replace=False)
+        queries = self.encodings[rows] + rng.normal(0.0, noise, (sample_size, self.encodings.shape[1]))
+        query_sq_norms = np.einsum('ij,ij->i', queries, queries)
+
+        exact = _nearest(queries, query_sq_norms, self.encodings, chunk_size=16)
+        query_buckets = np.argsort(_squared_distances(queries, query_sq_norms, self.centroids), axis=1)
+        row_buckets = np.empty(len(self.encodings), dtype=np.int64)
+        for bucket in range(self.n_lists):
+            row_buckets[self.order[self.offsets[bucket]:self.offsets[bucket + 1]]] = bucket
+
+        # Rank of the bucket holding each query's true neighbour = probes needed to find it
+        needed = np.argmax(query_buckets == row_buckets[exact][:, None], axis=1) + 1
+        return int(min(self.n_lists, np.ceil(np.quantile(needed, self.recall_target))))
+
+    def candidates(self, query):
+        """Gallery row indices stored in the buckets closest to `query`"""
+        squared = self.centroid_sq_norms - 2.0 * (self.centroids @ query)
+        if self.nprobe < self.n_lists:
+            probes = np.argpartition(squared, self.nprobe - 1)[:self.nprobe]
+        else:
+            probes = np.arange(self.n_lists)
+        return np.concatenate([self.order[self.offsets[b]:self.offsets[b + 1]] for b in probes])
+
+    def search(self, query, k=1):
+        """Return (row indices, distances) of the k nearest candidates after exact re-ranking"""
+        query = np.asarray(query, dtype=self.encodings.dtype)
+        rows = self.candidates(query)
+        if not len(rows):
+            return rows, np.empty(0)
+        squared = self.sq_norms[rows] - 2.0 * (self.encodings[rows] @ query) + query @ query
+        np.maximum(squared, 0.0, out=squared)
+        k = min(k, len(rows))
+        best = np.argpartition(squared, k - 1)[:k]
+        best = best[np.argsort(squared[best])]
+        return rows[best], np.sqrt(squared[best])
@@ -0,0 +1,137 @@
+"""Background face encoding: bulk result writes and the DB-backed job queue.
+
+`save_encodings` is shared by the encoding worker (`manage.py
+process_encoding_jobs`) and `manage.py reencode_faces`.
+"""
+import hashlib
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .face_cache import GENERATION_NAME
+from .face_codec import decode_encoding, encode_encoding
+from .models import CacheGeneration, EncodingJob, Employee, FaceTemplate
+
+
+def save_encodings(encoded, source='regenerate'):
+    """Store (employee, image name, image hash, encoding, face location) results in one transaction.
+
+    Each employee's template for that image is replaced or created with the
+    image hash, then the employee's primary encoding (the newest template),
+    centroid, spread and version are refreshed. Bulk writes send no signals,
+    so the face cache generation is bumped here; callers invalidate the
+    gallery once per batch.
+    """
+    if not encoded:
+        return
+    templates = defaultdict(list)
+    for template in FaceTemplate.objects.filter(
+        employee_id__in={employee.pk for employee, *_ in encoded}
+    ).order_by('captured_at', 'pk'):
+        templates[template.employee_id].append(template)
+
+    updated, created, employees = {}, [], {}
+    for employee, image, digest, encoding, (top, right, bottom, left) in encoded:
+        # One instance per employee, so several results for it accumulate
+        employee = employees.setdefault(employee.pk, employee)
+        own = templates[employee.pk]
+        template = next((t for t in own if t.image.name == image), None)
+        if template is None:
+            template = FaceTemplate(employee_id=employee.pk, image=image, source=source)
+            own.append(template)
+            created.append(template)
+        elif template.pk:
+            updated[template.pk] = template
+        template.encoding = encode_encoding(encoding)
+        template.face_size = max(bottom - top, right - left)
+        template.image_hash = digest
+
+    for employee in employees.values():
+        own = templates[employee.pk]
+        # Oldest first, new templates last: single-encoding readers keep using the newest one
+        employee.face_encoding = own[-1].encoding
+        employee.face_centroid, employee.face_spread = Employee.face_statistics(
+            np.vstack([decode_encoding(t.encoding) for t in own])
+        )
+        employee.face_encoding_version += 1
+
+    with transaction.atomic():
+        FaceTemplate.objects.bulk_update(list(updated.values()), ['encoding', 'face_size', 'image_hash'])
+        FaceTemplate.objects.bulk_create(created)
+        Employee.objects.bulk_update(list(employees.values()), [
+            'face_encoding', 'face_centroid', 'face_spread', 'face_encoding_version'
+        ])
+        CacheGeneration.bump(GENERATION_NAME)
+
+
+def claim_jobs(batch_size):
+    """Mark up to `batch_size` queued jobs as running and return them, oldest first"""
+    with transaction.atomic():
+        # Concurrent workers skip each other's rows (a no-op on SQLite, which locks the whole database)
+        pks = list(
+            EncodingJob.objects.select_for_update(skip_locked=True)
+            .filter(status='queued').order_by('created_at', 'pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        EncodingJob.objects.filter(pk__in=pks).update(
+            status='running', started_at=timezone.now(), attempts=F('attempts') + 1
+        )
+    return list(EncodingJob.objects.filter(pk__in=pks).select_related('employee').order_by('created_at', 'pk'))
+
+
+def requeue_stale_jobs(older_than):
+    """Put jobs left running by a worker that died back in the queue and return how many"""
+    return EncodingJob.objects.filter(
+        status='running', started_at__lt=timezone.now() - timedelta(seconds=older_than)
+    ).update(status='queued')
+
+
+def run_jobs(jobs, encode_batch, max_attempts=3):
+    """Encode the images of claimed jobs with `encode_batch` and record the outcome of each job.
+
+    `encode_batch` takes a list of image bytes and returns one (locations,
+    encodings, error) tuple per image, like `detect_and_encode_batch`.
+    Returns the number of jobs that produced an encoding.
+    """
+    outcomes = {}
+    pending = []
+    for job in jobs:
+        try:
+            with default_storage.open(job.image, 'rb') as image_file:
+                image_bytes = image_file.read()
+        except (OSError, ValueError) as e:
+            outcomes[job.pk] = ('failed', f'Không đọc được ảnh: {e}')
+            continue
+        pending.append((job, image_bytes))
+
+    try:
+        results = encode_batch([image_bytes for _, image_bytes in pending])
+    except Exception as e:
+        # The whole batch failed (e.g. a crashed pool): retry the jobs until they run out of attempts
+        for job, _ in pending:
+            outcomes[job.pk] = ('queued' if job.attempts < max_attempts else 'failed', str(e))
+        results = []
+
+    encoded = []
+    for (job, image_bytes), (locations, encodings, error) in zip(pending, results):
+        if error:
+            outcomes[job.pk] = ('failed', f'{error[0]}: {error[1]}')
+        elif not encodings:
+            outcomes[job.pk] = ('failed', 'Không phát hiện khuôn mặt trong ảnh')
+        else:
+            digest = hashlib.sha256(image_bytes).hexdigest()
+            encoded.append((job.employee, job.image, digest, encodings[0], locations[0]))
+            outcomes[job.pk] = ('done', '')
+    save_encodings(encoded, source='upload')
+
+    finished = timezone.now()
+    for job in jobs:
+        job.status, job.error = outcomes[job.pk]
+        job.finished_at = finished if job.status != 'queued' else None
+    EncodingJob.objects.bulk_update(jobs, ['status', 'error', 'finished_at'])
+    return len(encoded)
@@ -0,0 +1,173 @@
+"""Per-stage latency histograms and error counters for the kiosk recognition pipeline.
+
+Views time each stage with `stage_timer` (or the `timed` decorator) on the
+monotonic clock and count every kiosk error by its `error_type`. Values live
+in this worker process only; `render_metrics` formats them in the Prometheus
+text exposition format for the staff-only metrics view. With
+FACE_METRICS_ENABLED = False timers and counters return immediately.
+"""
+import bisect
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+
+# Upper bounds in seconds; HOG detection on a pool process is typically 50-500 ms
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Counter name: (label name, help text)
+COUNTERS = {
+    'face_recognition_errors_total': ('error_type', 'Kiosk recognition responses that failed, by error_type.'),
+    'face_recognition_candidate_lookups_total': ('result', 'Kiosk short-list searches, by hit or miss.'),
+    'face_recognition_partition_searches_total': (
+        'result', 'Scoped kiosk searches: hit in the partition, miss, or fallback to the whole gallery.'
+    ),
+    'face_recognition_debounced_scans_total': (
+        'reason', 'Kiosk scans answered with an earlier response before recognition (frame) or after recognizing '
+                  'an employee just recognized there (repeat), or not counted as check-out (cooldown).'
+    ),
+}
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; not thread-safe on its own"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        # One slot per bucket plus one for values above the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, observations at or below it) pairs, ending with '+Inf'"""
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """Stage histograms and error counters of one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.counters = {name: {} for name in COUNTERS}
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, counter, label):
+        with self._lock:
+            values = self.counters[counter]
+            values[label] = values.get(label, 0) + 1
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format (version 0.0.4)"""
+        lines = [
+            '# HELP face_recognition_stage_seconds Latency of each kiosk recognition stage.',
+            '# TYPE face_recognition_stage_seconds histogram',
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self.stages.items()):
+                for bound, count in histogram.cumulative():
+                    lines.append(f'face_recognition_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'face_recognition_stage_seconds_sum{{stage="{stage}"}} {histogram.sum!r}')
+                lines.append(f'face_recognition_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+            for counter, (label_name, help_text) in COUNTERS.items():
+                lines += [f'# HELP {counter} {help_text}', f'# TYPE {counter} counter']
+                for label, count in sorted(self.counters[counter].items()):
+                    lines.append(f'{counter}{{{label_name}="{label}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics():
+    return _registry
+
+
+def metrics_enabled():
+    return getattr(settings, 'FACE_METRICS_ENABLED', True)
+
+
+def observe_stage(stage, seconds):
+    if metrics_enabled():
+        _registry.observe_stage(stage, seconds)
+
+
+def observe_timings(timings):
+    """Record a {stage: seconds} mapping measured elsewhere, e.g. inside a recognition pool process"""
+    if metrics_enabled():
+        for stage, seconds in timings.items():
+            _registry.observe_stage(stage, seconds)
+
+
+def count_error(error_type):
+    if metrics_enabled():
+        _registry.increment('face_recognition_errors_total', error_type)
+
+
+def count_candidate_lookup(result):
+    if metrics_enabled():
+        _registry.increment('face_recognition_candidate_lookups_total', result)
+
+
+def count_partition_search(result):
+    if metrics_enabled():
+        _registry.increment('face_recognition_partition_searches_total', result)
+
+
+def count_debounced_scan(reason):
+    if metrics_enabled():
+        _registry.increment('face_recognition_debounced_scans_total', reason)
+
+
+@contextmanager
+def stage_timer(stage):
+    """Record the time spent in the block under `stage`, whether or not it raises"""
+    if not metrics_enabled():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _registry.observe_stage(stage, time.perf_counter() - started)
+
+
+def timed(stage):
+    """Decorator recording a view's whole latency under `stage`; works for sync and async views"""
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                with stage_timer(stage):
+                    return await view(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_metrics():
+    return _registry.render()
@@ -0,0 +1,224 @@
+"""Single-decode, two-stage preprocessing for uploaded face images.
+
+An upload is decoded once into an RGB array (JPEG draft mode lets libjpeg
+shrink oversized photos while decoding), HOG detection runs on a small copy
+of that array, and encodings are computed on the full-resolution crop around
+each face box scaled back up.
+
+Optionally, an OpenCV Haar cascade first looks for face candidates on a tiny
+grayscale copy: frames without any are rejected before dlib runs, and HOG only
+searches the region around the candidates.
+"""
+import io
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .face_engine import get_engine
+
+# Landmarks and the aligned face chip sample a little outside the detector box
+CROP_MARGIN = 0.5
+
+# Bundled with opencv-python; the profile cascade catches half-turned faces the frontal one misses
+HAAR_CASCADES = ('haarcascade_frontalface_default.xml', 'haarcascade_profileface.xml')
+# Context kept around Haar candidates for HOG, as a fraction of the box size
+HINT_MARGIN = 0.5
+
+_cascades = None
+
+
+def decode_image(image_bytes, max_size=None):
+    """Decode image bytes straight into an RGB uint8 array no larger than `max_size`"""
+    if max_size is None:
+        max_size = getattr(settings, 'FACE_IMAGE_MAX_SIZE', (1600, 1600))
+
+    img = Image.open(io.BytesIO(image_bytes))
+    # JPEG only: decode at the smallest 1/2, 1/4 or 1/8 scale still covering max_size
+    img.draft('RGB', max_size)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    if img.width > max_size[0] or img.height > max_size[1]:
+        img.thumbnail(max_size, Image.Resampling.BILINEAR)
+    return np.asarray(img)
+
+
+def detection_copy(image, max_size=None):
+    """Return (downscaled copy for detection, scale factor from full image to copy)"""
+    if max_size is None:
+        max_size = getattr(settings, 'FACE_DETECT_MAX_SIZE', (320, 240))
+
+    height, width = image.shape[:2]
+    scale = min(max_size[0] / width, max_size[1] / height, 1.0)
+    if scale == 1.0:
+        return image, scale
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    small = Image.fromarray(image).resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return np.asarray(small), scale
+
+
+def detect_faces(image, model='hog', upsample=1, max_size=None):
+    """Detect on a downscaled copy and return (top, right, bottom, left) boxes in full-image pixels"""
+    small, scale = detection_copy(image, max_size)
+    locations = get_engine().detect(small, upsample=upsample, model=model)
+
+    height, width = image.shape[:2]
+    return [
+        (
+            max(0, int(top / scale)),
+            min(width, int(round(right / scale))),
+            min(height, int(round(bottom / scale))),
+            max(0, int(left / scale)),
+        )
+        for top, right, bottom, left in locations
+    ]
+
+
+def encode_faces(image, locations):
+    """Encode each face on a full-resolution crop around its box"""
+    height, width = image.shape[:2]
+    crops, boxes = [], []
+    for top, right, bottom, left in locations:
+        margin = int(max(bottom - top, right - left) * CROP_MARGIN)
+        crop_top, crop_left = max(0, top - margin), max(0, left - margin)
+        crops.append(np.ascontiguousarray(image[crop_top:min(height, bottom + margin), crop_left:min(width, right + margin)]))
+        boxes.append([(top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)])
+    return [encoding for encodings in get_engine().batch_encode(crops, boxes) for encoding in encodings]
+
+
+def _get_cascades():
+    global _cascades
+    if _cascades is None:
+        import cv2
+        _cascades = [cv2.CascadeClassifier(cv2.data.haarcascades + name) for name in HAAR_CASCADES]
+    return _cascades
+
+
+def haar_candidates(image, max_size=None):
+    """Return (top, right, bottom, left) face candidate boxes in full-image pixels from the Haar cascades"""
+    import cv2
+
+    if max_size is None:
+        max_size = getattr(settings, 'FACE_HAAR_MAX_SIZE', (240, 180))
+    small, scale = detection_copy(image, max_size)
+    gray = cv2.equalizeHist(cv2.cvtColor(small, cv2.COLOR_RGB2GRAY))
+
+    for cascade in _get_cascades():
+        boxes = cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=3, minSize=(20, 20))
+        if len(boxes):
+            return [
+                (int(y / scale), int(round((x + w) / scale)), int(round((y + h) / scale)), int(x / scale))
+                for x, y, w, h in boxes
+            ]
+    return []
+
+
+def detect_faces_near(image, hints, model='hog', upsample=1, max_size=None):
+    """`detect_faces` restricted to the region around the hint boxes, in full-image pixels"""
+    height, width = image.shape[:2]
+    margins = [int(max(bottom - top, right - left) * HINT_MARGIN) for top, right, bottom, left in hints]
+    region_top = max(0, min(top - margin for (top, _, _, _), margin in zip(hints, margins)))
+    region_left = max(0, min(left - margin for (_, _, _, left), margin in zip(hints, margins)))
+    region_bottom = min(height, max(bottom + margin for (_, _, bottom, _), margin in zip(hints, margins)))
+    region_right = min(width, max(right + margin for (_, right, _, _), margin in zip(hints, margins)))
+
+    if max_size is None:
+        max_size = getattr(settings, 'FACE_DETECT_MAX_SIZE', (320, 240))
+    # Same scale as a full-frame detection, so HOG work shrinks with the region's area
+    scale = min(max_size[0] / width, max_size[1] / height, 1.0)
+    region_size = (
+        max(1, int(np.ceil((region_right - region_left) * scale))),
+        max(1, int(np.ceil((region_bottom - region_top) * scale))),
+    )
+    region = np.ascontiguousarray(image[region_top:region_bottom, region_left:region_right])
+    return [
+        (top + region_top, right + region_left, bottom + region_top, left + region_left)
+        for top, right, bottom, left in detect_faces(region, model=model, upsample=upsample, max_size=region_size)
+    ]
+
+
+def validate_chip_box(image, box, size=None, min_face=None):
+    """Check a client-supplied (top, right, bottom, left) face box on a face chip and return it as ints.
+
+    The chip must be `size` x `size` pixels and the box must lie inside it and
+    span at least `min_face` of the chip; raises ValueError otherwise.
+    """
+    if size is None:
+        size = getattr(settings, 'FACE_CHIP_SIZE', 160)
+    if min_face is None:
+        min_face = getattr(settings, 'FACE_CHIP_MIN_FACE', 0.4)
+
+    height, width = image.shape[:2]
+    if (width, height) != (size, size):
+        raise ValueError(f'Face chip is {width}x{height}, expected {size}x{size}')
+    try:
+        top, right, bottom, left = (int(value) for value in box)
+    except (TypeError, ValueError):
+        raise ValueError('Face box must be four integers: top, right, bottom, left')
+    if not (0 <= top < bottom <= height and 0 <= left < right <= width):
+        raise ValueError('Face box lies outside the chip')
+    if max(bottom - top, right - left) < min_face * size:
+        raise ValueError('Face box is too small for the chip')
+    return top, right, bottom, left
+
+
+def frame_hash(image_bytes, hash_size=16):
+    """Difference hash of a frame as an int of hash_size**2 bits, or None if it cannot be decoded.
+
+    Decoded in JPEG draft mode at the smallest scale, so it costs a fraction
+    of a full decode; near-identical frames differ in only a few bits.
+    """
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        img.draft('L', (hash_size * 4, hash_size * 4))
+        img = img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    except Exception:
+        return None
+    pixels = np.asarray(img, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+# Side of the square the face is resized to before measuring sharpness, so faces of any size compare
+QUALITY_CROP_SIZE = 128
+# Face size (pixels) from which a face counts as large enough for a full-quality encoding
+QUALITY_FULL_FACE = 200
+# Yaw (nose offset from the eye midpoint, in eye distances) and roll (degrees) at which a face scores 0
+QUALITY_MAX_YAW = 0.5
+QUALITY_MAX_ROLL = 30.0
+
+
+def face_quality(image, location):
+    """Cheap quality measures of one detected face, without an encoding.
+
+    sharpness is the variance of the Laplacian of the face crop; yaw and roll
+    come from the engine's 5-point landmarks.
+    """
+    import cv2
+
+    top, right, bottom, left = location
+    gray = cv2.cvtColor(np.ascontiguousarray(image[top:bottom, left:right]), cv2.COLOR_RGB2GRAY)
+    gray = cv2.resize(gray, (QUALITY_CROP_SIZE, QUALITY_CROP_SIZE), interpolation=cv2.INTER_AREA)
+    quality = {
+        'sharpness': float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        'face_size': max(bottom - top, right - left),
+        'yaw': 0.0,
+        'roll': 0.0,
+    }
+
+    landmarks = get_engine().landmarks(image, location)
+    if landmarks:
+        left_eye = np.mean(landmarks['left_eye'], axis=0)
+        right_eye = np.mean(landmarks['right_eye'], axis=0)
+        nose = np.asarray(landmarks['nose_tip'][0], dtype=float)
+        eye_distance = max(float(np.linalg.norm(right_eye - left_eye)), 1.0)
+        quality['yaw'] = float((nose[0] - (left_eye[0] + right_eye[0]) / 2) / eye_distance)
+        quality['roll'] = float(np.degrees(np.arctan2(right_eye[1] - left_eye[1], right_eye[0] - left_eye[0])))
+    return quality
+
+
+def quality_score(quality):
+    """Single ranking score for `face_quality` measures; higher is better, 0 for unusable poses"""
+    pose = max(0.0, 1.0 - abs(quality['yaw']) / QUALITY_MAX_YAW) * max(0.0, 1.0 - abs(quality['roll']) / QUALITY_MAX_ROLL)
+    size = min(1.0, quality['face_size'] / QUALITY_FULL_FACE)
+    return float(np.log1p(quality['sharpness']) * size * pose)
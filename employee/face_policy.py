@@ -0,0 +1,116 @@
+"""Face detection parameters chosen per image from its size, the call site and a latency budget.
+
+Each call site ('kiosk', 'enrollment') has an entry in FACE_DETECT_POLICY:
+the detection latency `budget` in seconds, the smallest face it should find
+(`min_face`, as a fraction of the image's longer side) and the `models` it may
+use. Detection time is predicted from the pixels dlib scans, with per-model
+costs measured on this host by `manage.py calibrate_face_detection` (stored in
+FACE_DETECT_CALIBRATION) or the defaults below. The cheapest candidate that
+finds `min_face` within budget wins; failing that, the finest one within
+budget, and failing that, the cheapest one.
+"""
+import json
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+
+# `max_size` bounds the detection copy like FACE_DETECT_MAX_SIZE
+DetectionParams = namedtuple('DetectionParams', 'model upsample max_size')
+
+# seconds = overhead + per_megapixel * megapixels scanned (after upsampling); one recent x86 core
+DEFAULT_COSTS = {
+    'hog': {'overhead': 0.002, 'per_megapixel': 0.12},
+    'cnn': {'overhead': 0.02, 'per_megapixel': 4.0},
+}
+
+# Both dlib detectors find faces down to about 80x80 pixels of the image they scan
+DETECTOR_MIN_FACE = 80
+
+# Candidate longer sides of the detection copy, in pixels, and upsample counts
+DETECT_SIZES = (160, 240, 320, 480, 640, 800, 1024, 1280, 1600)
+UPSAMPLES = (0, 1, 2)
+
+# 0.125 of a 640x480 kiosk frame is what the former fixed 320x240 copy with one upsample found;
+# the policy reaches it at the same cost by scanning the frame itself without upsampling
+DEFAULT_POLICY = {
+    'kiosk': {'budget': 0.15, 'min_face': 0.125, 'models': ('hog',)},
+    'enrollment': {'budget': 1.0, 'min_face': 0.08, 'models': ('hog',)},
+}
+
+_costs = None
+_costs_lock = threading.Lock()
+
+
+def site_policy(site):
+    policy = dict(DEFAULT_POLICY.get(site, DEFAULT_POLICY['kiosk']))
+    policy.update(getattr(settings, 'FACE_DETECT_POLICY', {}).get(site, {}))
+    return policy
+
+
+def detection_costs():
+    """Per-model cost coefficients: the calibration file merged over DEFAULT_COSTS, read once per process"""
+    global _costs
+    with _costs_lock:
+        if _costs is None:
+            costs = {model: dict(cost) for model, cost in DEFAULT_COSTS.items()}
+            path = getattr(settings, 'FACE_DETECT_CALIBRATION', None)
+            try:
+                with open(path) as f:
+                    for model, cost in json.load(f).items():
+                        costs.setdefault(model, {}).update(cost)
+            except (TypeError, OSError, ValueError):
+                pass
+            _costs = costs
+        return _costs
+
+
+def reset_detection_costs():
+    """Re-read the calibration file on next use"""
+    global _costs
+    with _costs_lock:
+        _costs = None
+
+
+def predict_seconds(model, width, height, upsample, costs=None):
+    """Predicted detection time for a `width` x `height` detection copy"""
+    cost = (costs or detection_costs())[model]
+    return cost['overhead'] + cost['per_megapixel'] * width * height * 4 ** upsample / 1e6
+
+
+def candidates(width, height, models):
+    """(params, copy width, copy height, smallest findable face as a fraction of the longer side) per option"""
+    long_side = max(width, height)
+    seen = set()
+    for model in models:
+        for size in DETECT_SIZES:
+            scale = min(size / long_side, 1.0)
+            copy_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            for upsample in UPSAMPLES:
+                if (model, copy_size, upsample) in seen:
+                    continue
+                seen.add((model, copy_size, upsample))
+                min_face = DETECTOR_MIN_FACE / (2 ** upsample * max(copy_size))
+                yield DetectionParams(model, upsample, (size, size)), copy_size[0], copy_size[1], min_face
+
+
+def detection_params(site, width, height, budget=None, costs=None):
+    """DetectionParams for a `width` x `height` image detected at call site `site`"""
+    policy = site_policy(site)
+    if budget is None:
+        budget = policy['budget']
+    if costs is None:
+        costs = detection_costs()
+
+    options = [
+        (predict_seconds(params.model, copy_width, copy_height, params.upsample, costs), min_face, params)
+        for params, copy_width, copy_height, min_face in candidates(width, height, policy['models'])
+    ]
+    affordable = [option for option in options if option[0] <= budget]
+    adequate = [option for option in affordable if option[1] <= policy['min_face']]
+    if adequate:
+        # Cheapest; on a tie, fewest upsamples, since a larger copy has real detail rather than interpolated
+        return min(adequate, key=lambda option: (option[0], option[2].upsample))[2]
+    if affordable:
+        return min(affordable, key=lambda option: (option[1], option[0]))[2]
+    return min(options, key=lambda option: option[0])[2]
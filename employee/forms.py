@@ -73,12 +73,13 @@ class EmployeeForm(forms.ModelForm):
     class Meta:
         model = Employee
         fields = [
-            'department', 'position', 'phone_number',
+            'department', 'site', 'position', 'phone_number',
             'address', 'joining_date', 'base_salary', 'hourly_rate',
             'overtime_rate', 'standard_work_hours', 'face_image', 'is_active'
         ]
         widgets = {
             'joining_date': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
+            'site': forms.TextInput(attrs={'class': 'form-control'}),
             'phone_number': forms.TextInput(attrs={'class': 'form-control'}),
             'address': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
             'base_salary': forms.NumberInput(attrs={'class': 'form-control'}),
@@ -87,6 +88,7 @@ class EmployeeForm(forms.ModelForm):
             'standard_work_hours': forms.NumberInput(attrs={'class': 'form-control', 'min': '1', 'max': '24'}),
         }
         labels = {
+            'site': 'Địa điểm',
             'phone_number': 'Số điện thoại',
             'address': 'Địa chỉ',
             'joining_date': 'Ngày vào làm',
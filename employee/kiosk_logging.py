@@ -0,0 +1,112 @@
+"""Low-overhead logging for the kiosk recognition hot path.
+
+`QueuedHandler` puts records on an in-memory queue and a listener thread
+formats and writes them, so a request thread never waits on the log file.
+`kiosk_logger` wraps a logger so that records below WARNING are only created
+for requests picked by `sampled_logging` (FACE_LOG_SAMPLE_RATE); warnings
+and errors are always logged. Messages use %-style arguments, which are only
+formatted when a record is actually emitted.
+"""
+import atexit
+import contextvars
+import inspect
+import logging
+import os
+import queue
+import random
+from functools import wraps
+from logging.handlers import QueueListener
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Whether the current request was picked for detail (below WARNING) logging
+_detail_logged = contextvars.ContextVar('kiosk_detail_logged', default=True)
+
+
+class QueuedHandler(logging.Handler):
+    """Handler that passes records to a `target` handler (a class path) on a background thread.
+
+    Extra keyword arguments build the target handler, e.g. in LOGGING:
+    {'class': 'employee.kiosk_logging.QueuedHandler', 'target': 'logging.FileHandler', 'filename': ...}
+    Records are formatted on the listener thread, so log arguments should not be mutated afterwards.
+    """
+
+    def __init__(self, target='logging.StreamHandler', **kwargs):
+        super().__init__()
+        self.queue = queue.SimpleQueue()
+        self.target = import_string(target)(**kwargs)
+        self.listener = None
+        self._start_listener()
+        # A forked worker does not inherit the listener thread
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.close)
+
+    def _after_fork(self):
+        self.queue = queue.SimpleQueue()
+        self._start_listener()
+
+    def _start_listener(self):
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def emit(self, record):
+        self.queue.put_nowait(record)
+
+    def close(self):
+        if self.listener is not None:
+            # Writes the records still queued before returning
+            self.listener.stop()
+            self.listener = None
+        self.target.close()
+        super().close()
+
+
+class SampledLogger(logging.LoggerAdapter):
+    """Logger that skips below-WARNING records outside requests picked for detail logging"""
+
+    def __init__(self, logger):
+        super().__init__(logger, {})
+
+    def isEnabledFor(self, level):
+        if level < logging.WARNING and not _detail_logged.get():
+            return False
+        return self.logger.isEnabledFor(level)
+
+    def process(self, msg, kwargs):
+        return msg, kwargs
+
+
+def kiosk_logger(name):
+    return SampledLogger(logging.getLogger(name))
+
+
+def sample_request():
+    """Decide whether the current request logs its details; returns a token for `_detail_logged.reset`"""
+    rate = getattr(settings, 'FACE_LOG_SAMPLE_RATE', 1.0)
+    return _detail_logged.set(rate >= 1.0 or random.random() < rate)
+
+
+def sampled_logging(view):
+    """Decorator picking each call of a sync or async view for detail logging at FACE_LOG_SAMPLE_RATE"""
+    if inspect.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(*args, **kwargs):
+            token = sample_request()
+            try:
+                return await view(*args, **kwargs)
+            finally:
+                _detail_logged.reset(token)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = sample_request()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _detail_logged.reset(token)
+    return wrapper
@@ -0,0 +1,141 @@
+import asyncio
+import io
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, AsyncClient
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from PIL import Image
+
+from employee import views
+from employee.models import Employee
+
+BENCH_PREFIX = 'kiosk_bench_'
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the WSGI and ASGI kiosk recognition paths under concurrent load, on a throwaway test database '
+        'created and dropped by the command. The face engine is replaced by a stub that waits --engine-ms, '
+        'standing in for a recognition pool task.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=50, help='Kiosks sending requests at the same time')
+        parser.add_argument('--wsgi-threads', type=int, default=4, help='Request threads of the WSGI worker')
+        parser.add_argument('--engine-ms', type=float, default=150.0)
+        parser.add_argument('--employees', type=int, default=50)
+
+    def handle(self, *args, **options):
+        # Fixtures and attendance rows go to a test database, never to the configured one
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.benchmark(options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def benchmark(self, options):
+        rng = np.random.default_rng(0)
+        encodings = rng.normal(0.0, 0.07, (options['employees'], 128))
+        staff = self.create_fixtures(encodings)
+
+        def stub_detect_and_encode_timed(image_bytes, **kwargs):
+            time.sleep(options['engine_ms'] / 1000)
+            return [(10, 110, 110, 10)], [encodings[random.randrange(len(encodings))]], {}
+
+        buffer = io.BytesIO()
+        Image.fromarray(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)).save(buffer, 'JPEG')
+        frame = buffer.getvalue()
+
+        # Employees are matched again and again, so debouncing and the check-out cooldown are off
+        with override_settings(FACE_POOL_SIZE=0, FACE_SCAN_FRAME_TTL=0, FACE_SCAN_DEBOUNCE_TTL=0,
+                               FACE_SCAN_COOLDOWN=0), \
+                mock.patch.object(views, 'detect_and_encode_timed', stub_detect_and_encode_timed):
+            self.report('WSGI', *self.run_wsgi(staff, frame, options))
+            self.report('ASGI', *self.run_asgi(staff, frame, options))
+
+    def create_fixtures(self, encodings):
+        staff = User.objects.create_user(f'{BENCH_PREFIX}staff', is_staff=True)
+        for i, encoding in enumerate(encodings):
+            user = User.objects.create_user(f'{BENCH_PREFIX}{i}', first_name='Bench', last_name=str(i))
+            employee = Employee(
+                user=user, position='developer', phone_number='0', address='-', joining_date='2024-01-01',
+                face_image='face_images/capture.jpg'
+            )
+            employee.add_face_template(encoding)
+        return staff
+
+    def run_wsgi(self, staff, frame, options):
+        # Kiosks beyond --wsgi-threads queue for a request thread, as behind a sync worker
+        request_threads = threading.Semaphore(options['wsgi_threads'])
+        latencies, failures = [], []
+        remaining = iter(range(options['requests']))
+        lock = threading.Lock()
+
+        def kiosk():
+            client = Client()
+            client.force_login(staff)
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        break
+                started = time.perf_counter()
+                with request_threads:
+                    response = client.post('/employee/process-auto-attendance/', {'face_image': self.upload(frame)})
+                latencies.append(time.perf_counter() - started)
+                failures.append(not response.json()['success'])
+            connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            for _ in range(options['concurrency']):
+                pool.submit(kiosk)
+        return time.perf_counter() - started, latencies, failures
+
+    def run_asgi(self, staff, frame, options):
+        latencies, failures = [], []
+
+        async def kiosk(client, remaining):
+            for _ in remaining:
+                started = time.perf_counter()
+                response = await client.post('/employee/async/process-auto-attendance/', {'face_image': self.upload(frame)})
+                latencies.append(time.perf_counter() - started)
+                failures.append(not response.json()['success'])
+
+        async def main():
+            # Inline engine calls run via asyncio.to_thread; size its pool like a recognition pool queue
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=options['concurrency']))
+            client = AsyncClient()
+            await client.aforce_login(staff)
+            remaining = iter(range(options['requests']))
+            started = time.perf_counter()
+            await asyncio.gather(*(kiosk(client, remaining) for _ in range(options['concurrency'])))
+            elapsed = time.perf_counter() - started
+            # The ORM's connection lives in the thread-sensitive sync thread; close it so the test DB can be dropped
+            await sync_to_async(connections.close_all)()
+            return elapsed
+
+        return asyncio.run(main()), latencies, failures
+
+    def upload(self, frame):
+        return SimpleUploadedFile('capture.jpg', frame, 'image/jpeg')
+
+    def report(self, name, elapsed, latencies, failures):
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        self.stdout.write(
+            f'{name}: {len(latencies)} requests in {elapsed:.2f}s '
+            f'({len(latencies) / elapsed:.1f} req/s), p50 {p50:.0f}ms, p95 {p95:.0f}ms, {sum(failures)} failed'
+        )
@@ -0,0 +1,52 @@
+import glob
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from employee.face_executor import select_burst_frame
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures burst enrollment: time to pick a frame when only the top-k quality-ranked frames are '
+        'encoded against encoding every frame, and which frame each choice keeps'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', default=os.path.join(settings.MEDIA_ROOT, 'face_images'),
+                            help='Directory of .jpg frames used as one burst')
+        parser.add_argument('--frames', type=int, default=getattr(settings, 'FACE_BURST_MAX_FRAMES', 10))
+        parser.add_argument('--top-k', type=int, default=getattr(settings, 'FACE_BURST_TOP_K', 3))
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        paths = sorted(glob.glob(os.path.join(options['images'], '*.jpg')))[:options['frames']]
+        if len(paths) < 2:
+            raise CommandError(f"Need at least two .jpg images in {options['images']}")
+        burst = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                burst.append(f.read())
+
+        # The first call loads the dlib models
+        select_burst_frame(burst[:1], top_k=1)
+
+        for name, top_k in ((f'top {options["top_k"]}', options['top_k']), ('every frame', len(burst))):
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                selected = select_burst_frame(burst, top_k=top_k)
+                timings.append(time.perf_counter() - started)
+            if selected is None:
+                raise CommandError('No frame shows exactly one face')
+            index, _, _, scores = selected
+            self.stdout.write(
+                f'{name:>12}: {np.median(timings) * 1000:.0f} ms for {len(burst)} frames '
+                f'(median of {options["repeat"]}), keeps {os.path.basename(paths[index])}'
+            )
+
+        for path, score in zip(paths, scores):
+            self.stdout.write(f'{os.path.basename(path)}: ' + ('no single face' if score is None else f'{score:.2f}'))
@@ -0,0 +1,61 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from employee.face_gallery import FaceGallery
+
+
+def synthetic_gallery(rng, size, dimension=128):
+    """Clustered pseudo-encodings with dlib-like inter/intra identity distances"""
+    centers = rng.normal(0.0, 0.05, (max(1, size // 400), dimension))
+    owners = rng.integers(0, len(centers), size)
+    return centers[owners] + rng.normal(0.0, 0.044, (size, dimension))
+
+
+class Command(BaseCommand):
+    help = 'Compares recall and latency of the approximate face index against exact search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000])
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--recall-target', type=float, default=0.99)
+        parser.add_argument('--noise', type=float, default=0.025, help='Per-dimension noise added to each probe')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        self.stdout.write(
+            f"{'size':>8} {'build s':>8} {'lists':>6} {'nprobe':>6} {'recall':>7} "
+            f"{'exact p50':>10} {'exact p95':>10} {'ann p50':>9} {'ann p95':>9} {'speedup':>8}"
+        )
+
+        for size in options['sizes']:
+            encodings = synthetic_gallery(rng, size)
+            gallery = FaceGallery(range(size), [''] * size, [''] * size, [''] * size, encodings)
+
+            started = time.perf_counter()
+            index = gallery.build_index(recall_target=options['recall_target'])
+            build_time = time.perf_counter() - started
+
+            targets = rng.integers(0, size, options['queries'])
+            queries = encodings[targets] + rng.normal(0.0, options['noise'], (len(targets), encodings.shape[1]))
+
+            exact_times, ann_times, hits = [], [], 0
+            for query in queries:
+                started = time.perf_counter()
+                exact = int(np.argmin(gallery.distances(query)))
+                exact_times.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                rows, _ = index.search(query, 1)
+                ann_times.append(time.perf_counter() - started)
+
+                hits += int(len(rows) > 0 and rows[0] == exact)
+
+            exact_p50, exact_p95 = np.percentile(exact_times, [50, 95]) * 1000
+            ann_p50, ann_p95 = np.percentile(ann_times, [50, 95]) * 1000
+            self.stdout.write(
+                f'{size:>8} {build_time:>8.2f} {index.n_lists:>6} {index.nprobe:>6} {hits / len(queries):>7.3f} '
+                f'{exact_p50:>8.3f}ms {exact_p95:>8.3f}ms {ann_p50:>7.3f}ms {ann_p95:>7.3f}ms {exact_p50 / ann_p50:>7.1f}x'
+            )
@@ -0,0 +1,94 @@
+import glob
+import io
+import itertools
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from employee.face_engine import get_engine
+from employee.face_executor import detect_and_encode
+
+
+def legacy_detect_and_encode(image_bytes):
+    """The pre-pipeline path: resize and re-encode to JPEG, decode again, detect and encode full frame"""
+    engine = get_engine()
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.thumbnail((640, 480), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=85, optimize=True)
+    buffer.seek(0)
+
+    image = np.asarray(Image.open(buffer).convert('RGB'))
+    locations = engine.detect(image, model='hog')
+    if not locations:
+        return [], []
+    return locations, engine.encode(image, locations[:1])
+
+
+class Command(BaseCommand):
+    help = 'Compares latency and match decisions of the legacy and two-stage recognition pipelines on stored face images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', default=os.path.join(settings.MEDIA_ROOT, 'face_images'))
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--tolerance', type=float, default=0.6)
+
+    def handle(self, *args, **options):
+        paths = sorted(glob.glob(os.path.join(options['images'], '*.jpg')))
+        if not paths:
+            raise CommandError(f"No .jpg images in {options['images']}")
+        frames = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                frames.append(f.read())
+
+        pipelines = (
+            ('legacy', legacy_detect_and_encode),
+            ('two-stage', lambda frame: detect_and_encode(frame, model='hog', max_faces=1)),
+        )
+        encodings = {}
+        for name, fn in pipelines:
+            # First pass loads the dlib models
+            fn(frames[0])
+            timings, found = [], {}
+            for i, frame in enumerate(frames):
+                runs = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    _, face_encodings = fn(frame)
+                    runs.append(time.perf_counter() - started)
+                timings.append(np.median(runs))
+                if face_encodings:
+                    found[i] = face_encodings[0]
+            encodings[name] = found
+            p50, p95 = np.percentile(timings, [50, 95]) * 1000
+            self.stdout.write(
+                f'{name:>9}: p50 {p50:.1f}ms, p95 {p95:.1f}ms, faces found in {len(found)}/{len(frames)} images'
+            )
+
+        legacy, two_stage = encodings['legacy'], encodings['two-stage']
+        both = sorted(set(legacy) & set(two_stage))
+        if both:
+            drift = [np.linalg.norm(legacy[i] - two_stage[i]) for i in both]
+            self.stdout.write(f'Encoding drift between pipelines: mean {np.mean(drift):.4f}, max {np.max(drift):.4f}')
+
+        # Same-person decisions over every pair of images, as the kiosk would make them
+        tolerance = options['tolerance']
+        agree = total = 0
+        for a, b in itertools.combinations(both, 2):
+            total += 1
+            agree += (
+                (np.linalg.norm(legacy[a] - legacy[b]) <= tolerance)
+                == (np.linalg.norm(two_stage[a] - two_stage[b]) <= tolerance)
+            )
+        if total:
+            self.stdout.write(f'Match decisions agreeing at tolerance {tolerance}: {agree}/{total} image pairs')
+        missed = [os.path.basename(paths[i]) for i in sorted(set(legacy) - set(two_stage))]
+        if missed:
+            self.stdout.write(self.style.WARNING(f'Faces missed only by the two-stage pipeline: {", ".join(missed)}'))
@@ -0,0 +1,87 @@
+import glob
+import io
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageFilter
+
+from employee.face_executor import detect_and_encode
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the Haar pre-filter: latency of rejecting faceless frames, latency on face frames, '
+        'and how many sample images with a dlib-detectable face it wrongly rejects'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', default=os.path.join(settings.MEDIA_ROOT, 'face_images'))
+        parser.add_argument('--empty-images', help='Directory of faceless frames; synthetic frames are used if omitted')
+        parser.add_argument('--empty-frames', type=int, default=20, help='Synthetic faceless frames')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        faces = self.load(options['images'])
+        if not faces:
+            raise CommandError(f"No .jpg images in {options['images']}")
+        empty = self.load(options['empty_images']) if options['empty_images'] else self.synthetic_frames(options)
+
+        # First calls load the dlib models and the cascades
+        detect_and_encode(faces[0], max_faces=1)
+        detect_and_encode(faces[0], max_faces=1, prefilter=True)
+
+        for name, frames in (('faceless', empty), ('face', faces)):
+            for prefilter in (False, True):
+                per_frame = self.time_frames(frames, prefilter, options['repeat'])
+                self.stdout.write(
+                    f'{name:>8} frames, prefilter {"on " if prefilter else "off"}: '
+                    f'{per_frame:.1f} ms/frame (median of {options["repeat"]} runs, {len(frames)} frames)'
+                )
+
+        detected = rejected = 0
+        for path, frame in zip(self.paths(options['images']), faces):
+            if not detect_and_encode(frame, max_faces=1)[0]:
+                continue
+            detected += 1
+            if not detect_and_encode(frame, max_faces=1, prefilter=True)[0]:
+                rejected += 1
+                self.stdout.write(f'False reject: {os.path.basename(path)}')
+        rate = rejected / detected * 100 if detected else 0.0
+        self.stdout.write(f'False rejects: {rejected} of {detected} images with a dlib face ({rate:.1f}%)')
+
+        rejected_empty = sum(not detect_and_encode(frame, max_faces=1, prefilter=True)[0] for frame in empty)
+        self.stdout.write(f'Faceless frames rejected: {rejected_empty} of {len(empty)}')
+
+    def paths(self, directory):
+        return sorted(glob.glob(os.path.join(directory, '*.jpg')))
+
+    def load(self, directory):
+        frames = []
+        for path in self.paths(directory):
+            with open(path, 'rb') as f:
+                frames.append(f.read())
+        return frames
+
+    def synthetic_frames(self, options):
+        """640x480 JPEGs of blurred noise, standing in for an empty kiosk scene"""
+        rng = np.random.default_rng(0)
+        frames = []
+        for _ in range(options['empty_frames']):
+            noise = rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)
+            image = Image.fromarray(noise).filter(ImageFilter.GaussianBlur(8))
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG')
+            frames.append(buffer.getvalue())
+        return frames
+
+    def time_frames(self, frames, prefilter, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for frame in frames:
+                detect_and_encode(frame, max_faces=1, prefilter=prefilter)
+            timings.append(time.perf_counter() - started)
+        return np.median(timings) / len(frames) * 1000
@@ -0,0 +1,87 @@
+import glob
+import os
+import time
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from employee.face_gallery import FaceGallery
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares per-frame cost of N single kiosk requests against one batch request of N frames, timed through '
+        'the HTTP endpoints (session auth, multipart upload, recognition, matching) on a throwaway test database. '
+        'Frames are matched against a synthetic gallery, so no attendance is recorded.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', default=os.path.join(settings.MEDIA_ROOT, 'face_images'))
+        parser.add_argument('--frames', type=int, default=8, help='Frames per batch')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--gallery-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        paths = sorted(glob.glob(os.path.join(options['images'], '*.jpg')))
+        if not paths:
+            raise CommandError(f"No .jpg images in {options['images']}")
+        frames = []
+        for i in range(options['frames']):
+            with open(paths[i % len(paths)], 'rb') as f:
+                frames.append(f.read())
+
+        # The staff login goes to a test database, never to the configured one
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.benchmark(frames, options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def benchmark(self, frames, options):
+        size = options['gallery_size']
+        rng = np.random.default_rng(0)
+        gallery = FaceGallery(range(size), [''] * size, [''] * size, [''] * size, rng.normal(0.0, 0.07, (size, 128)))
+        client = Client()
+        client.force_login(User.objects.create_user('kiosk_bench_staff', is_staff=True))
+
+        def upload(frame):
+            return SimpleUploadedFile('capture.jpg', frame, 'image/jpeg')
+
+        def single():
+            for frame in frames:
+                response = client.post(reverse('employee:process_auto_attendance'), {'face_image': upload(frame)})
+                response.json()
+
+        def batched():
+            response = client.post(
+                reverse('employee:process_auto_attendance_batch'), {'face_images': [upload(frame) for frame in frames]}
+            )
+            response.json()
+
+        # Every request repeats the same frames, so debouncing is off
+        with override_settings(FACE_SCAN_FRAME_TTL=0, FACE_SCAN_DEBOUNCE_TTL=0), \
+                mock.patch('employee.face_gallery.get_gallery', return_value=gallery):
+            # First run of each loads models and warms the pool
+            single()
+            batched()
+            for name, fn in (('single', single), ('batch', batched)):
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    fn()
+                    timings.append(time.perf_counter() - started)
+                per_frame = np.median(timings) / len(frames) * 1000
+                self.stdout.write(
+                    f'{name:>6}: {per_frame:.2f} ms/frame (median of {options["repeat"]} runs, {len(frames)} frames)'
+                )
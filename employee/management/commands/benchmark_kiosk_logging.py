@@ -0,0 +1,100 @@
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from employee.kiosk_logging import QueuedHandler, kiosk_logger, sampled_logging
+
+VERBOSE_FORMAT = '{levelname} {asctime} {module} {process:d} {thread:d} {message}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the logging cost per kiosk recognition request: eager f-strings on synchronous file and '
+        'console handlers against lazy, sampled records on QueuedHandler'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000)
+        parser.add_argument('--threads', type=int, default=8, help='Request threads logging at the same time')
+        parser.add_argument('--sample-rate', type=float, default=0.1)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory, open(os.devnull, 'w') as console:
+            sync_logger = self.build_logger('bench_sync', [
+                logging.FileHandler(os.path.join(directory, 'sync.log')),
+                logging.StreamHandler(console),
+            ])
+            queued_logger = self.build_logger('bench_queued', [
+                QueuedHandler(target='logging.FileHandler', filename=os.path.join(directory, 'queued.log')),
+                QueuedHandler(target='logging.StreamHandler', stream=console),
+            ])
+
+            self.report('sync, eager', self.run(self.eager_request, sync_logger, options))
+            with override_settings(FACE_LOG_SAMPLE_RATE=1.0):
+                self.report('queued, lazy', self.run(self.lazy_request, kiosk_logger(queued_logger.name), options))
+            with override_settings(FACE_LOG_SAMPLE_RATE=options['sample_rate']):
+                self.report(
+                    f'queued, lazy, sampled {options["sample_rate"]:g}',
+                    self.run(self.lazy_request, kiosk_logger(queued_logger.name), options)
+                )
+
+            started = time.perf_counter()
+            for handler in queued_logger.handlers:
+                handler.close()
+            self.stdout.write(f'Queued records drained in {(time.perf_counter() - started) * 1000:.0f}ms after the run')
+            sync_logger.handlers[0].close()
+
+    def build_logger(self, name, handlers):
+        logger = logging.getLogger(f'employee.{name}')
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        for handler in handlers:
+            handler.setFormatter(logging.Formatter(VERBOSE_FORMAT, style='{'))
+            logger.addHandler(handler)
+        return logger
+
+    def eager_request(self, logger, request_id):
+        # Log lines of one successful process_auto_attendance request before kiosk_logging
+        logger.info("=== Bắt đầu quá trình nhận diện khuôn mặt ===")
+        logger.info(f"Phương thức yêu cầu: {'POST'}")
+        logger.info(f"File trong yêu cầu: {dict.fromkeys(['face_image']).keys()}")
+        logger.info(f"Loại file ảnh: {'image/jpeg'}")
+        logger.info(f"Kích thước file: {48213}")
+        logger.info("Bước 1-3: Giải mã ảnh, phát hiện và mã hóa khuôn mặt")
+        logger.info(f"Số khuôn mặt phát hiện được: {1}")
+        logger.info(f"Vị trí khuôn mặt: {(112, 388, 336, 164)}")
+        logger.info("Tạo mã hóa khuôn mặt thành công")
+        logger.info(f"Xử lý chấm công thành công cho nhân viên {request_id}")
+
+    @sampled_logging
+    def lazy_request(self, logger, request_id):
+        logger.info("=== Bắt đầu quá trình nhận diện khuôn mặt ===")
+        logger.info("Phương thức yêu cầu: %s", 'POST')
+        logger.info("File trong yêu cầu: %s", ['face_image'])
+        logger.info("Loại file ảnh: %s", 'image/jpeg')
+        logger.info("Kích thước file: %s", 48213)
+        logger.info("Bước 1-3: Giải mã ảnh, phát hiện và mã hóa khuôn mặt")
+        logger.info("Số khuôn mặt phát hiện được: %d", 1)
+        logger.info("Vị trí khuôn mặt: %s", (112, 388, 336, 164))
+        logger.info("Tạo mã hóa khuôn mặt thành công")
+        logger.info("Xử lý chấm công thành công cho nhân viên %s", request_id)
+
+    def run(self, log_request, logger, options):
+        def request(request_id):
+            started = time.perf_counter()
+            log_request(logger, request_id)
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            return list(pool.map(request, range(options['requests'])))
+
+    def report(self, name, latencies):
+        mean = np.mean(latencies) * 1e6
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1e6
+        self.stdout.write(f'{name:>28}: mean {mean:.1f}µs, p50 {p50:.1f}µs, p99 {p99:.1f}µs per request')
@@ -0,0 +1,88 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Modules that should only load on the first recognition, export or benchmark call
+HEAVY_MODULES = ('numpy', 'PIL', 'openpyxl', 'cv2', 'face_recognition', 'dlib')
+
+# Runs in a fresh interpreter: loads the WSGI application and the URLconf (which imports every view
+# module), as a web worker does before its first request, and reports its peak RSS
+WORKER_PROBE = '''
+import json, resource, sys
+from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
+get_wsgi_application()
+get_resolver().url_patterns
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    'rss_kib': rss // 1024 if sys.platform == 'darwin' else rss,
+    'heavy_modules': sorted(name for name in %r if name in sys.modules),
+}))
+''' % (HEAVY_MODULES,)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures startup cost in fresh processes: median `manage.py check` wall time and the peak RSS of '
+        'a process that loads the WSGI application and URLconf, optionally against a saved baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='`manage.py check` runs; the median is kept')
+        parser.add_argument('--save-baseline', metavar='PATH', help='Write the measurements to this JSON file')
+        parser.add_argument('--baseline', metavar='PATH', help='Compare against measurements saved earlier')
+        parser.add_argument('--max-regression', type=float, default=0.10,
+                            help='Largest allowed increase over the baseline, as a fraction (default 0.10)')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'mysite.settings'))
+        cwd = str(settings.BASE_DIR)
+
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            self.run('manage.py check', [sys.executable, 'manage.py', 'check'], cwd, env)
+            timings.append(time.perf_counter() - started)
+        worker = json.loads(self.run('worker probe', [sys.executable, '-c', WORKER_PROBE], cwd, env))
+
+        result = {
+            'check_seconds': statistics.median(timings),
+            'worker_rss_kib': worker['rss_kib'],
+            'heavy_modules': worker['heavy_modules'],
+        }
+        self.stdout.write(
+            f'manage.py check: {result["check_seconds"] * 1000:.0f} ms (median of {options["repeat"]})'
+        )
+        self.stdout.write(f'worker RSS after loading URLconf: {result["worker_rss_kib"] / 1024:.1f} MiB')
+        self.stdout.write('heavy modules loaded at startup: ' + (', '.join(result['heavy_modules']) or 'none'))
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(result, f, indent=2)
+            self.stdout.write(f'Wrote {options["save_baseline"]}')
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = []
+            for key in ('check_seconds', 'worker_rss_kib'):
+                change = result[key] / baseline[key] - 1
+                self.stdout.write(f'{key}: {baseline[key]:.3f} -> {result[key]:.3f} ({change:+.1%})')
+                if change > options['max_regression']:
+                    regressions.append(f'{key} {change:+.1%}')
+            if regressions:
+                raise CommandError(
+                    f'Startup regressed by more than {options["max_regression"]:.0%}: ' + ', '.join(regressions)
+                )
+
+    def run(self, name, command, cwd, env):
+        completed = subprocess.run(command, cwd=cwd, env=env, capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(f'{name} failed:\n{completed.stderr}')
+        return completed.stdout
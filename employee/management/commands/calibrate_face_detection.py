@@ -0,0 +1,102 @@
+import glob
+import json
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from employee.face_engine import get_engine
+from employee.face_pipeline import decode_image, detection_copy
+from employee.face_policy import (
+    DEFAULT_POLICY, detection_costs, detection_params, predict_seconds, reset_detection_costs
+)
+
+# Detection copy sizes timed per model; the CNN detector on a CPU is too slow for large copies
+CALIBRATION_SIZES = {
+    'hog': (160, 240, 320, 480, 640, 800),
+    'cnn': (160, 240, 320),
+}
+# Image sizes the resulting policy is shown for: a kiosk frame and a downscaled phone photo
+PREVIEW_SIZES = ((640, 480), (1600, 1200))
+
+
+class Command(BaseCommand):
+    help = (
+        'Times FACE_ENGINE face detection on this CPU at several detection sizes and upsample counts, fits '
+        'the per-model cost the detection policy predicts with and writes it to FACE_DETECT_CALIBRATION'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', nargs='+', choices=sorted(CALIBRATION_SIZES), default=['hog'])
+        parser.add_argument('--images', default=os.path.join(settings.MEDIA_ROOT, 'face_images'),
+                            help='A .jpg from this directory is timed; a synthetic frame is used if there is none')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement; the median is kept')
+        parser.add_argument('--output', default=getattr(settings, 'FACE_DETECT_CALIBRATION', None))
+        parser.add_argument('--dry-run', action='store_true', help='Print the costs without writing them')
+
+    def handle(self, *args, **options):
+        if not options['output'] and not options['dry_run']:
+            raise CommandError('Set FACE_DETECT_CALIBRATION or pass --output')
+
+        image = self.sample_image(options['images'])
+        engine = get_engine()
+        engine.warm_up()
+
+        costs = {}
+        for model in options['models']:
+            megapixels, seconds = [], []
+            for size in CALIBRATION_SIZES[model]:
+                small, _ = detection_copy(image, (size, size))
+                for upsample in (0, 1):
+                    elapsed = self.time_detection(engine, small, upsample, model, options['repeat'])
+                    scanned = small.shape[0] * small.shape[1] * 4 ** upsample / 1e6
+                    megapixels.append(scanned)
+                    seconds.append(elapsed)
+                    self.stdout.write(
+                        f'{model} {small.shape[1]}x{small.shape[0]} upsample {upsample}: '
+                        f'{elapsed * 1000:.1f} ms ({scanned:.2f} MP scanned)'
+                    )
+            per_megapixel, overhead = np.polyfit(megapixels, seconds, 1)
+            costs[model] = {'overhead': max(float(overhead), 0.0), 'per_megapixel': float(per_megapixel)}
+            self.stdout.write(
+                f'{model}: {costs[model]["overhead"] * 1000:.1f} ms + {per_megapixel * 1000:.1f} ms per megapixel'
+            )
+
+        if not options['dry_run']:
+            with open(options['output'], 'w') as f:
+                json.dump(costs, f, indent=2)
+            reset_detection_costs()
+            self.stdout.write(f'Wrote {options["output"]}; restart the web and pool processes to use it')
+
+        # What the policy picks with the measured costs
+        costs = {**detection_costs(), **costs}
+        for site in DEFAULT_POLICY:
+            for width, height in PREVIEW_SIZES:
+                params = detection_params(site, width, height, costs=costs)
+                scale = min(params.max_size[0] / width, params.max_size[1] / height, 1.0)
+                predicted = predict_seconds(
+                    params.model, round(width * scale), round(height * scale), params.upsample, costs
+                )
+                self.stdout.write(
+                    f'{site:>10} {width}x{height}: {params.model}, detect at {round(width * scale)}x'
+                    f'{round(height * scale)}, upsample {params.upsample}, predicted {predicted * 1000:.0f} ms'
+                )
+
+    def sample_image(self, directory):
+        paths = sorted(glob.glob(os.path.join(directory, '*.jpg')))
+        if paths:
+            with open(paths[0], 'rb') as f:
+                return decode_image(f.read())
+        # HOG and CNN cost depends on the pixels scanned, hardly on their content
+        rng = np.random.default_rng(0)
+        return rng.integers(0, 255, (1200, 1600, 3), dtype=np.uint8)
+
+    def time_detection(self, engine, image, upsample, model, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            engine.detect(image, upsample=upsample, model=model)
+            timings.append(time.perf_counter() - started)
+        return float(np.median(timings))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from employee.face_codec import DTYPE_CODES, convert_encodings
+from employee.face_cache import GENERATION_NAME
+from employee.face_gallery import invalidate_gallery
+from employee.models import CacheGeneration, Employee, FaceTemplate
+
+
+class Command(BaseCommand):
+    help = (
+        'Rewrites stored face encodings in the compact versioned format. '
+        'Batches commit separately; re-running skips rows that are already converted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dtype', choices=sorted(DTYPE_CODES), default=None,
+                            help='Defaults to settings.FACE_ENCODING_DTYPE')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--start-pk', type=int, default=0, help='Resume templates after this primary key')
+
+    def handle(self, *args, **options):
+        def progress(converted, last_pk):
+            self.stdout.write(f'  {converted} converted, up to pk {last_pk}')
+
+        converted, _ = convert_encodings(
+            Employee, ['face_encoding'], options['dtype'], batch_size=options['batch_size'], progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(f'Employees: {converted} encodings converted'))
+
+        converted, last_pk = convert_encodings(
+            FaceTemplate, ['encoding'], options['dtype'], batch_size=options['batch_size'],
+            start_pk=options['start_pk'], progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(f'Face templates: {converted} encodings converted (last pk {last_pk})'))
+
+        # bulk_update sends no post_save signals
+        invalidate_gallery()
+        CacheGeneration.bump(GENERATION_NAME)
@@ -0,0 +1,48 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from employee.face_gallery import export_gallery_file, read_gallery_generation
+
+
+class Command(BaseCommand):
+    help = (
+        'Exports enrolled face encodings to the memory-mapped gallery file shared by workers. '
+        'Run with --watch next to the web workers: they only bump the gallery generation, '
+        'and use a gallery built from the database until the file catches up.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Defaults to settings.FACE_GALLERY_FILE')
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep rewriting the file whenever the generation changes')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between generation checks')
+
+    def handle(self, *args, **options):
+        path = options['path'] or getattr(settings, 'FACE_GALLERY_FILE', None)
+        if not path:
+            raise CommandError('Set FACE_GALLERY_FILE or pass --path')
+
+        try:
+            while True:
+                close_old_connections()
+                self.export(path, report_current=not options['watch'] or options['verbosity'] >= 2)
+                if not options['watch']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def export(self, path, report_current):
+        gallery = export_gallery_file(path)
+        if gallery is None:
+            if report_current:
+                self.stdout.write(f'{path} is current (generation {read_gallery_generation(path)})')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {len(gallery)} faces to {path} '
+            f'(generation {gallery.generation}, {os.path.getsize(path)} bytes)'
+        ))
@@ -0,0 +1,68 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from employee.face_executor import detect_and_encode_batch
+from employee.face_gallery import invalidate_gallery
+from employee.face_jobs import claim_jobs, requeue_stale_jobs, run_jobs
+
+
+class Command(BaseCommand):
+    help = 'Encodes newly uploaded face images queued as EncodingJob rows, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=32)
+        parser.add_argument('--workers', type=int, default=1, help='Detection processes; 0 encodes in this process')
+        parser.add_argument('--task-size', type=int, default=4, help='Images sent to a detection process per task')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--max-attempts', type=int, default=3)
+        parser.add_argument('--stale-after', type=float, default=600.0,
+                            help='Seconds after which a running job is assumed orphaned and queued again')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        encode = partial(detect_and_encode_batch, site='enrollment', max_faces=1)
+        pool = None
+        if options['workers']:
+            pool = ProcessPoolExecutor(max_workers=options['workers'], mp_context=multiprocessing.get_context('spawn'))
+
+        def encode_batch(images):
+            if pool is None:
+                return encode(images)
+            task_size = options['task_size']
+            tasks = [images[i:i + task_size] for i in range(0, len(images), task_size)]
+            return [result for chunk in pool.map(encode, tasks) for result in chunk]
+
+        requeued = requeue_stale_jobs(options['stale_after'])
+        if requeued:
+            self.stdout.write(f'Queued {requeued} orphaned job(s) again')
+
+        try:
+            while True:
+                close_old_connections()
+                jobs = claim_jobs(options['batch_size'])
+                if not jobs:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                started = time.perf_counter()
+                encoded = run_jobs(jobs, encode_batch, max_attempts=options['max_attempts'])
+                if encoded:
+                    # One gallery version bump per batch; web workers rebuild on their next lookup
+                    invalidate_gallery()
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'{len(jobs)} job(s): {encoded} encoded, {len(jobs) - encoded} not encoded '
+                    f'in {elapsed:.2f}s ({len(jobs) / elapsed:.1f} images/s)'
+                )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from employee.face_executor import detect_and_encode_batch
+from employee.face_gallery import invalidate_gallery
+from employee.face_jobs import save_encodings
+from employee.models import Employee, FaceTemplate
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-detects and re-encodes every stored image of employees' face templates, and face images not yet "
+        'encoded into a template, on a process pool. Images whose hash has not changed since their template was '
+        'encoded are skipped and progress is checkpointed, so a killed run resumes where it stopped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--employee', nargs='+', dest='employee_ids', help='Employee codes (EMP001 ...)')
+        parser.add_argument('--department', help='Department name')
+        parser.add_argument('--include-inactive', action='store_true')
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--batch-size', type=int, default=200, help='Employees written per bulk_update')
+        parser.add_argument('--task-size', type=int, default=8, help='Images sent to a worker per task')
+        parser.add_argument('--model', choices=['hog', 'cnn'],
+                            help='Detection model; with neither --model nor --upsample the enrollment policy decides')
+        parser.add_argument('--upsample', type=int)
+        parser.add_argument('--force', action='store_true', help='Re-encode even when the image hash is unchanged')
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, '.reencode_faces.json'))
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+
+    def handle(self, *args, **options):
+        queryset = Employee.objects.filter(
+            Q(face_templates__image__gt='') | ~Q(face_image='')
+        ).distinct().order_by('pk').only(
+            'pk', 'employee_id', 'face_image', 'face_encoding', 'face_encoding_version', 'face_centroid', 'face_spread'
+        )
+        if not options['include_inactive']:
+            queryset = queryset.filter(is_active=True)
+        if options['employee_ids']:
+            queryset = queryset.filter(employee_id__in=options['employee_ids'])
+        if options['department']:
+            queryset = queryset.filter(department__name=options['department'])
+
+        # A checkpoint only applies to a run over the same selection
+        signature = {
+            'employee_ids': sorted(options['employee_ids'] or []),
+            'department': options['department'],
+            'include_inactive': options['include_inactive'],
+        }
+        last_pk = 0 if options['restart'] else self.load_checkpoint(options['checkpoint'], signature)
+        if last_pk:
+            self.stdout.write(f'Resuming after employee pk {last_pk}')
+
+        total = queryset.filter(pk__gt=last_pk).count()
+        counts = defaultdict(int)
+        if options['model'] is None and options['upsample'] is None:
+            encode = partial(detect_and_encode_batch, site='enrollment', max_faces=1)
+        else:
+            encode = partial(
+                detect_and_encode_batch, model=options['model'] or 'hog',
+                upsample=1 if options['upsample'] is None else options['upsample'], max_faces=1
+            )
+        pool = ProcessPoolExecutor(max_workers=options['workers'], mp_context=multiprocessing.get_context('spawn'))
+        started = time.perf_counter()
+        try:
+            while True:
+                employees = list(queryset.filter(pk__gt=last_pk)[:options['batch_size']])
+                if not employees:
+                    break
+
+                templates = defaultdict(dict)
+                for pk, image, image_hash in FaceTemplate.objects.filter(
+                    employee__in=employees
+                ).exclude(image='').values_list('employee_id', 'image', 'image_hash'):
+                    templates[pk][image] = image_hash
+                # Templates without a stored image cannot be re-encoded, so they are only reported
+                counts['no_image'] += FaceTemplate.objects.filter(employee__in=employees, image='').count()
+
+                pending = []
+                for employee in employees:
+                    hashes = templates[employee.pk]
+                    images = list(hashes)
+                    # A face image stored before templates existed is encoded into a new template
+                    if employee.face_image and employee.face_image.name not in hashes:
+                        images.append(employee.face_image.name)
+                    for image in images:
+                        try:
+                            with default_storage.open(image, 'rb') as image_file:
+                                image_bytes = image_file.read()
+                        except (OSError, ValueError) as e:
+                            counts['missing'] += 1
+                            self.stderr.write(f'{employee.employee_id}: cannot read {image} ({e})')
+                            continue
+                        digest = hashlib.sha256(image_bytes).hexdigest()
+                        if not options['force'] and hashes.get(image) == digest:
+                            counts['skipped'] += 1
+                            continue
+                        pending.append((employee, image, digest, image_bytes))
+
+                task_size = options['task_size']
+                tasks = [
+                    [image_bytes for *_, image_bytes in pending[i:i + task_size]]
+                    for i in range(0, len(pending), task_size)
+                ]
+                results = [result for chunk in pool.map(encode, tasks) for result in chunk]
+
+                encoded = []
+                for (employee, image, digest, _), (locations, encodings, error) in zip(pending, results):
+                    if error:
+                        counts['failed'] += 1
+                        self.stderr.write(f'{employee.employee_id}: {image}: {error[0]} ({error[1]})')
+                    elif not encodings:
+                        counts['no_face'] += 1
+                        self.stderr.write(f'{employee.employee_id}: {image}: no face detected')
+                    else:
+                        encoded.append((employee, image, digest, encodings[0], locations[0]))
+                save_encodings(encoded)
+
+                counts['encoded'] += len(encoded)
+                counts['processed'] += len(pending)
+                counts['employees'] += len(employees)
+                last_pk = employees[-1].pk
+                self.save_checkpoint(options['checkpoint'], signature, last_pk)
+
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'{counts["employees"]}/{total} employees, {counts["encoded"]} images encoded, '
+                    f'{counts["processed"] / elapsed:.1f} images/s'
+                )
+        finally:
+            pool.shutdown(cancel_futures=True)
+            # bulk_update sends no signals
+            if counts['encoded']:
+                invalidate_gallery()
+
+        if os.path.exists(options['checkpoint']):
+            os.unlink(options['checkpoint'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Encoded {counts["encoded"]}, unchanged {counts["skipped"]}, no face {counts["no_face"]}, '
+            f'failed {counts["failed"]}, missing image {counts["missing"]}, '
+            f'templates without an image {counts["no_image"]} in {elapsed:.1f}s '
+            f'({counts["processed"] / elapsed if elapsed else 0:.1f} images/s)'
+        ))
+
+    def load_checkpoint(self, path, signature):
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if checkpoint.get('signature') != signature:
+            raise CommandError(f'{path} belongs to a run with different filters; pass --restart to discard it')
+        return checkpoint['last_pk']
+
+    def save_checkpoint(self, path, signature, last_pk):
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.reencode_faces')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'signature': signature, 'last_pk': last_pk}, f)
+        os.replace(temp_path, path)
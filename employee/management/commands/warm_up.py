@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from employee.warmup import STEPS, warm_up
+
+
+class Command(BaseCommand):
+    help = (
+        'Loads the face models (and the recognition pool), builds the gallery, resolves the URLconf and '
+        'compiles the kiosk templates, timing each step cold and again warm. Caches are per process: web '
+        'workers warm themselves with FACE_WARM_UP_ON_START or the gunicorn post_worker_init hook'
+    )
+
+    def add_arguments(self, parser):
+        names = [name for name, _ in STEPS]
+        parser.add_argument('--steps', nargs='+', choices=names, default=names)
+
+    def handle(self, *args, **options):
+        cold = warm_up(options['steps'])
+        # A second pass is what a request pays once warmed up
+        warm = warm_up(options['steps'])
+        for name, seconds in cold.items():
+            self.stdout.write(f'{name:>9}: {seconds * 1000:8.1f} ms cold, {warm[name] * 1000:6.1f} ms warm')
+        self.stdout.write(f'{"total":>9}: {sum(cold.values()) * 1000:8.1f} ms cold, '
+                          f'{sum(warm.values()) * 1000:6.1f} ms warm')
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.2 on 2026-10-17 16:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_face_encodings(apps, schema_editor):
+    """Turn each existing single encoding into the employee's first template"""
+    Employee = apps.get_model('employee', 'Employee')
+    FaceTemplate = apps.get_model('employee', 'FaceTemplate')
+
+    templates = []
+    for employee in Employee.objects.filter(face_encoding__isnull=False).only('pk', 'face_image', 'face_encoding'):
+        if not employee.face_encoding:
+            continue
+        templates.append(FaceTemplate(
+            employee_id=employee.pk, encoding=employee.face_encoding, image=employee.face_image.name, source='migrated'
+        ))
+        # A single template is its own centroid
+        Employee.objects.filter(pk=employee.pk).update(face_centroid=employee.face_encoding, face_spread=0.0)
+    FaceTemplate.objects.bulk_create(templates, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employee', '0005_alter_employee_base_salary_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='face_centroid',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Tâm mã hóa khuôn mặt'),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='face_spread',
+            field=models.FloatField(blank=True, null=True, verbose_name='Độ phân tán mẫu khuôn mặt'),
+        ),
+        migrations.CreateModel(
+            name='FaceTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('encoding', models.BinaryField(verbose_name='Mã hóa khuôn mặt')),
+                ('image', models.ImageField(blank=True, upload_to='face_templates/', verbose_name='Ảnh chụp')),
+                ('source', models.CharField(choices=[('self', 'Nhân viên tự đăng ký'), ('admin', 'Quản trị viên đăng ký'), ('regenerate', 'Tạo lại từ ảnh đã lưu'), ('migrated', 'Chuyển từ mã hóa cũ')], default='self', max_length=20, verbose_name='Nguồn')),
+                ('face_size', models.PositiveIntegerField(blank=True, null=True, verbose_name='Kích thước khuôn mặt (px)')),
+                ('captured_at', models.DateTimeField(auto_now_add=True, verbose_name='Thời gian chụp')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='face_templates', to='employee.employee', verbose_name='Nhân viên')),
+            ],
+            options={
+                'verbose_name': 'Mẫu Khuôn Mặt',
+                'verbose_name_plural': 'Mẫu Khuôn Mặt',
+                'ordering': ['employee', 'captured_at'],
+            },
+        ),
+        migrations.RunPython(copy_face_encodings, migrations.RunPython.noop),
+    ]
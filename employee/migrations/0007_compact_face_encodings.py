@@ -0,0 +1,51 @@
+from django.db import migrations, transaction
+
+BATCH_SIZE = 500
+
+
+def to_float32(apps, schema_editor):
+    """Rewrite legacy float64 blobs as versioned float32; safe to re-run after an interruption"""
+    # Imported here so that loading the migration graph (every migrate) does not import NumPy
+    from employee.face_codec import convert_encodings
+
+    Employee = apps.get_model('employee', 'Employee')
+    FaceTemplate = apps.get_model('employee', 'FaceTemplate')
+    convert_encodings(Employee, ['face_encoding', 'face_centroid'], 'float32', batch_size=BATCH_SIZE)
+    convert_encodings(FaceTemplate, ['encoding'], 'float32', batch_size=BATCH_SIZE)
+
+
+def to_legacy(apps, schema_editor):
+    """Restore raw float64 blobs for code that predates the versioned format"""
+    import numpy as np
+    from employee.face_codec import decode_encoding, is_legacy
+
+    for model, fields in (
+        (apps.get_model('employee', 'Employee'), ['face_encoding', 'face_centroid']),
+        (apps.get_model('employee', 'FaceTemplate'), ['encoding']),
+    ):
+        last_pk = 0
+        while True:
+            rows = list(model.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', *fields)[:BATCH_SIZE])
+            if not rows:
+                break
+            for row in rows:
+                for field in fields:
+                    value = getattr(row, field)
+                    if value and not is_legacy(value):
+                        setattr(row, field, decode_encoding(value, np.float64).tobytes())
+            with transaction.atomic():
+                model.objects.bulk_update(rows, fields)
+            last_pk = rows[-1].pk
+
+
+class Migration(migrations.Migration):
+    # Batches commit one by one so a large table is never locked in a single transaction
+    atomic = False
+
+    dependencies = [
+        ('employee', '0006_face_templates'),
+    ]
+
+    operations = [
+        migrations.RunPython(to_float32, to_legacy),
+    ]
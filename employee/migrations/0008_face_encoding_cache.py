@@ -0,0 +1,26 @@
+# Generated by Django 5.0.2 on 2026-10-17 16:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employee', '0007_compact_face_encodings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='face_encoding_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Phiên bản mã hóa khuôn mặt'),
+        ),
+    ]
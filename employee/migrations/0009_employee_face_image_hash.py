@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-17 16:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employee', '0008_face_encoding_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='face_image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Mã băm ảnh khuôn mặt'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.2 on 2026-10-17 16:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employee', '0009_employee_face_image_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='facetemplate',
+            name='source',
+            field=models.CharField(choices=[('self', 'Nhân viên tự đăng ký'), ('admin', 'Quản trị viên đăng ký'), ('regenerate', 'Tạo lại từ ảnh đã lưu'), ('upload', 'Ảnh hồ sơ tải lên'), ('migrated', 'Chuyển từ mã hóa cũ')], default='self', max_length=20, verbose_name='Nguồn'),
+        ),
+        migrations.CreateModel(
+            name='EncodingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.CharField(max_length=255, verbose_name='Ảnh')),
+                ('status', models.CharField(choices=[('queued', 'Đang chờ'), ('running', 'Đang xử lý'), ('done', 'Hoàn thành'), ('failed', 'Thất bại')], default='queued', max_length=20, verbose_name='Trạng thái')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Số lần thử')),
+                ('error', models.TextField(blank=True, verbose_name='Lỗi')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Thời gian tạo')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Bắt đầu')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Kết thúc')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='encoding_jobs', to='employee.employee', verbose_name='Nhân viên')),
+            ],
+            options={
+                'verbose_name': 'Tác Vụ Mã Hóa Khuôn Mặt',
+                'verbose_name_plural': 'Tác Vụ Mã Hóa Khuôn Mặt',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='employee_en_status_c1fb65_idx')],
+            },
+        ),
+    ]
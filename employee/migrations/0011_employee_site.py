@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-17 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employee', '0010_encoding_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='site',
+            field=models.CharField(blank=True, db_index=True, max_length=50, verbose_name='Địa điểm'),
+        ),
+    ]
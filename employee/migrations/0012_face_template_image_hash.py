@@ -0,0 +1,33 @@
+# Generated by Django 5.0.2 on 2026-10-17 18:40
+
+from django.db import migrations, models
+
+
+def copy_face_image_hashes(apps, schema_editor):
+    """Keep the hash of each employee's face image on the template encoded from it"""
+    Employee = apps.get_model('employee', 'Employee')
+    FaceTemplate = apps.get_model('employee', 'FaceTemplate')
+    for pk, face_image, face_image_hash in (
+        Employee.objects.exclude(face_image_hash='').values_list('pk', 'face_image', 'face_image_hash').iterator()
+    ):
+        FaceTemplate.objects.filter(employee_id=pk, image=face_image).update(image_hash=face_image_hash)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employee', '0011_employee_site'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facetemplate',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Mã băm ảnh'),
+        ),
+        migrations.RunPython(copy_face_image_hashes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='employee',
+            name='face_image_hash',
+        ),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import datetime, time, timedelta
@@ -33,11 +34,18 @@ class Employee(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name='Người dùng')
     employee_id = models.CharField(max_length=10, unique=True, editable=False, verbose_name='Mã nhân viên')
     department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True, verbose_name='Phòng ban')
+    # Building or floor whose kiosks this employee normally uses; scopes kiosk face matching
+    site = models.CharField(max_length=50, blank=True, db_index=True, verbose_name='Địa điểm')
     position = models.CharField(max_length=100, choices=POSITION_CHOICES, verbose_name='Chức vụ')
     phone_number = models.CharField(max_length=15, verbose_name='Số điện thoại')
     address = models.TextField(verbose_name='Địa chỉ')
     face_image = models.ImageField(upload_to='face_images/', verbose_name='Ảnh khuôn mặt')
     face_encoding = models.BinaryField(null=True, blank=True, verbose_name='Mã hóa khuôn mặt')
+    # Mean of the face templates and the largest template distance from it
+    face_centroid = models.BinaryField(null=True, blank=True, verbose_name='Tâm mã hóa khuôn mặt')
+    face_spread = models.FloatField(null=True, blank=True, verbose_name='Độ phân tán mẫu khuôn mặt')
+    # Incremented whenever the templates change; part of the face encoding cache key
+    face_encoding_version = models.PositiveIntegerField(default=0, editable=False, verbose_name='Phiên bản mã hóa khuôn mặt')
     joining_date = models.DateField(verbose_name='Ngày vào làm')
     is_active = models.BooleanField(default=True, verbose_name='Đang làm việc')
     
@@ -51,12 +59,41 @@ class Employee(models.Model):
         verbose_name = 'Nhân Viên'
         verbose_name_plural = 'Nhân Viên'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets post_save handlers tell whether a new face image was assigned
+        if 'face_image' in field_names:
+            instance._loaded_face_image = values[field_names.index('face_image')]
+        # Lets the face cache skip saves that leave the encodings alone
+        if 'face_encoding_version' in field_names:
+            instance._loaded_face_encoding_version = values[field_names.index('face_encoding_version')]
+        # Lets the gallery tell a department/site move from other changes
+        if {'department_id', 'site', 'is_active'} <= set(field_names):
+            instance._loaded_gallery_state = instance.gallery_state
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.employee_id:
             # Generate employee ID only for new employees
             self.employee_id = self.generate_employee_id()
         super().save(*args, **kwargs)
 
+    @property
+    def gallery_state(self):
+        """Employee fields held by the face gallery besides its templates and user name"""
+        return self.department_id, self.site, self.is_active
+
+    @property
+    def face_image_changed(self):
+        """True once a face image other than the one loaded from the database has been saved"""
+        return bool(self.face_image) and self.face_image.name != getattr(self, '_loaded_face_image', None)
+
+    @property
+    def face_encoding_changed(self):
+        """True once a face_encoding_version other than the one loaded from the database has been saved"""
+        return self.face_encoding_version != getattr(self, '_loaded_face_encoding_version', None)
+
     @staticmethod
     def generate_employee_id():
         prefix = 'EMP'
@@ -79,6 +116,85 @@ class Employee(models.Model):
 
     def __str__(self):
         return f"{self.user.get_full_name()} ({self.employee_id})"
+
+    def get_face_templates(self):
+        """Template encodings as a matrix, falling back to the single legacy encoding"""
+        # Imported on use so that loading the models (every manage.py command) does not import NumPy
+        import numpy as np
+        from .face_codec import decode_encoding
+
+        encodings = [decode_encoding(e) for e in self.face_templates.values_list('encoding', flat=True)]
+        if not encodings and self.face_encoding:
+            encodings.append(decode_encoding(self.face_encoding))
+        return np.vstack(encodings) if encodings else np.empty((0, 128), dtype=np.float32)
+
+    def update_face_statistics(self):
+        """Recompute the template centroid and spread and bump the encoding version (not saved)"""
+        self.face_encoding_version += 1
+        self.face_centroid, self.face_spread = self.face_statistics(self.get_face_templates())
+
+    def refresh_face_encoding(self):
+        """Point the primary encoding at the newest remaining template (None without templates) and
+        recompute the statistics (not saved)"""
+        self.face_encoding = (
+            self.face_templates.order_by('-captured_at', '-pk').values_list('encoding', flat=True).first()
+        )
+        self.update_face_statistics()
+
+    @staticmethod
+    def face_statistics(templates):
+        """Return (encoded centroid, spread) of a template matrix, or (None, None) if it is empty"""
+        if not len(templates):
+            return None, None
+        import numpy as np
+        from .face_codec import encode_encoding
+
+        centroid = templates.mean(axis=0)
+        return encode_encoding(centroid, 'float32'), float(np.linalg.norm(templates - centroid, axis=1).max())
+
+    def centroid_distance(self, encoding):
+        """Distance from `encoding` to the template centroid, or None without templates"""
+        if not self.face_centroid:
+            return None
+        import numpy as np
+        from .face_codec import decode_encoding
+
+        return float(np.linalg.norm(decode_encoding(self.face_centroid) - encoding))
+
+    def add_face_template(self, encoding, image=None, source='self', face_size=None, replace=False):
+        """Store a face template and refresh the primary encoding, centroid and spread.
+
+        `replace` drops the earlier templates first; otherwise only the newest
+        FACE_MAX_TEMPLATES are kept. Without `image` the template points at the
+        employee's current face image.
+        """
+        from .face_codec import encode_encoding
+
+        with transaction.atomic():
+            if self.pk is None or image is None:
+                # Also stores a newly assigned face image so the template can refer to its final name
+                self.save()
+            if image is None:
+                image = self.face_image.name
+            if replace:
+                self.face_templates.all().delete()
+            template = FaceTemplate.objects.create(
+                employee=self,
+                encoding=encode_encoding(encoding),
+                image=image,
+                source=source,
+                face_size=face_size,
+            )
+            limit = getattr(settings, 'FACE_MAX_TEMPLATES', 10)
+            stale = list(self.face_templates.order_by('-captured_at', '-pk').values_list('pk', flat=True)[limit:])
+            if stale:
+                FaceTemplate.objects.filter(pk__in=stale).delete()
+
+            # Single-encoding readers keep working with the newest template
+            self.face_encoding = template.encoding
+            self.update_face_statistics()
+            self.save()
+        return template
     
     def calculate_monthly_salary(self, year, month):
         # Get all attendance records for the specified month
@@ -129,6 +245,88 @@ class Employee(models.Model):
             'overtime_hours': overtime_hours
         }
 
+class FaceTemplate(models.Model):
+    SOURCE_CHOICES = [
+        ('self', 'Nhân viên tự đăng ký'),
+        ('admin', 'Quản trị viên đăng ký'),
+        ('regenerate', 'Tạo lại từ ảnh đã lưu'),
+        ('upload', 'Ảnh hồ sơ tải lên'),
+        ('migrated', 'Chuyển từ mã hóa cũ'),
+    ]
+
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='face_templates', verbose_name='Nhân viên')
+    encoding = models.BinaryField(verbose_name='Mã hóa khuôn mặt')
+    image = models.ImageField(upload_to='face_templates/', blank=True, verbose_name='Ảnh chụp')
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='self', verbose_name='Nguồn')
+    face_size = models.PositiveIntegerField(null=True, blank=True, verbose_name='Kích thước khuôn mặt (px)')
+    # SHA-256 of the image file this encoding was last computed from by the encoding worker or reencode_faces
+    image_hash = models.CharField(max_length=64, blank=True, editable=False, verbose_name='Mã băm ảnh')
+    captured_at = models.DateTimeField(auto_now_add=True, verbose_name='Thời gian chụp')
+
+    class Meta:
+        ordering = ['employee', 'captured_at']
+        verbose_name = 'Mẫu Khuôn Mặt'
+        verbose_name_plural = 'Mẫu Khuôn Mặt'
+
+    def __str__(self):
+        return f"{self.employee} - {self.captured_at.strftime('%Y-%m-%d %H:%M')}"
+
+class EncodingJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Đang chờ'),
+        ('running', 'Đang xử lý'),
+        ('done', 'Hoàn thành'),
+        ('failed', 'Thất bại'),
+    ]
+
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='encoding_jobs', verbose_name='Nhân viên')
+    image = models.CharField(max_length=255, verbose_name='Ảnh')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', verbose_name='Trạng thái')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Số lần thử')
+    error = models.TextField(blank=True, verbose_name='Lỗi')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Thời gian tạo')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Bắt đầu')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Kết thúc')
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+        verbose_name = 'Tác Vụ Mã Hóa Khuôn Mặt'
+        verbose_name_plural = 'Tác Vụ Mã Hóa Khuôn Mặt'
+
+    def __str__(self):
+        return f"{self.employee} - {self.get_status_display()}"
+
+    @classmethod
+    def enqueue(cls, employee_pk, image):
+        """Queue encoding of `image` unless it is already encoded or waiting"""
+        if FaceTemplate.objects.filter(employee_id=employee_pk, image=image).exists():
+            return None
+        if cls.objects.filter(employee_id=employee_pk, image=image, status__in=['queued', 'running']).exists():
+            return None
+        return cls.objects.create(employee_id=employee_pk, image=image)
+
+class CacheGeneration(models.Model):
+    """Counter bumped whenever data cached by every worker process changes"""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    @classmethod
+    def read(cls, name):
+        return cls.objects.filter(name=name).values_list('value', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls, name):
+        """Increment the counter and return its new value"""
+        if not cls.objects.filter(name=name).update(value=models.F('value') + 1):
+            generation, created = cls.objects.get_or_create(name=name, defaults={'value': 1})
+            if not created:
+                cls.objects.filter(name=name).update(value=models.F('value') + 1)
+        return cls.read(name)
+
 class Attendance(models.Model):
     STATUS_CHOICES = [
         ('present', 'Có mặt'),
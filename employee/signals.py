@@ -0,0 +1,113 @@
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .face_cache import invalidate_employee
+from .models import Employee, Department, FaceTemplate, EncodingJob
+
+
+def on_commit_once(func, *args):
+    """`transaction.on_commit(func(*args))`, unless the same call already waits for this transaction.
+
+    Saving or deleting several templates in one transaction (add_face_template,
+    an admin inline) then bumps the generations and rewrites the gallery file once.
+    """
+    key = (func, args)
+    connection = transaction.get_connection()
+    if any(getattr(callback, 'once_key', None) == key for _, callback, _ in connection.run_on_commit):
+        return
+    callback = partial(func, *args)
+    callback.once_key = key
+    transaction.on_commit(callback)
+
+
+# face_gallery imports NumPy; the receivers load it only when a change is committed
+def invalidate_gallery():
+    from .face_gallery import invalidate_gallery
+    invalidate_gallery()
+
+
+def move_employee(employee_pk, department_id, department, site):
+    from .face_gallery import move_employee
+    move_employee(employee_pk, department_id, department, site)
+
+
+@receiver(post_delete, sender=Employee)
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+@receiver(post_save, sender=FaceTemplate)
+@receiver(post_delete, sender=FaceTemplate)
+def refresh_face_gallery(sender, **kwargs):
+    """Rebuild the face gallery once the change is committed"""
+    on_commit_once(invalidate_gallery)
+
+
+@receiver(post_save, sender=Employee)
+def refresh_face_gallery_on_employee_change(sender, instance, created, **kwargs):
+    """Rebuild the gallery for new or (de)activated employees; move partitions for department/site changes"""
+    loaded = getattr(instance, '_loaded_gallery_state', None)
+    state = instance._loaded_gallery_state = instance.gallery_state
+    if created or loaded is None or loaded[2] != state[2]:
+        on_commit_once(invalidate_gallery)
+    elif loaded[:2] != state[:2]:
+        employee_pk, department_id, site = instance.pk, instance.department_id, instance.site
+        department = instance.department.name if instance.department else ''
+        on_commit_once(move_employee, employee_pk, department_id, department, site)
+
+
+@receiver(post_save, sender=Employee)
+def refresh_face_encoding_cache(sender, instance, created, **kwargs):
+    """Drop the employee's cached templates in every process when a save changed their encodings"""
+    # Saves that leave face_encoding_version alone (salary, department, ...) cannot make an entry stale
+    if created or not instance.face_encoding_changed:
+        return
+    instance._loaded_face_encoding_version = instance.face_encoding_version
+    on_commit_once(invalidate_employee, instance.pk)
+
+
+@receiver(post_delete, sender=Employee)
+def refresh_face_encoding_cache_on_delete(sender, instance, **kwargs):
+    on_commit_once(invalidate_employee, instance.pk)
+
+
+@receiver(post_save, sender=FaceTemplate)
+@receiver(post_delete, sender=FaceTemplate)
+def refresh_face_encoding_cache_on_template_change(sender, instance, **kwargs):
+    on_commit_once(invalidate_employee, instance.employee_id)
+
+
+@receiver(post_save, sender=Employee)
+def enqueue_face_encoding(sender, instance, raw=False, **kwargs):
+    """Queue a newly saved face image for the encoding worker instead of encoding it in the request"""
+    if raw or not instance.face_image_changed:
+        return
+    employee_pk, image = instance.pk, instance.face_image.name
+    instance._loaded_face_image = image
+    # Enrollment views encode synchronously; their template exists by commit time and no job is queued
+    transaction.on_commit(lambda: EncodingJob.enqueue(employee_pk, image))
+
+
+def user_name(user):
+    """(first_name, last_name) as set on the instance, or None if either is deferred"""
+    names = (user.__dict__.get('first_name'), user.__dict__.get('last_name'))
+    return None if None in names else names
+
+
+@receiver(post_init, sender=User)
+def remember_user_name(sender, instance, **kwargs):
+    # Lets the gallery skip user saves that leave the name alone (last_login, password, ...)
+    instance._loaded_gallery_name = user_name(instance)
+
+
+@receiver(post_save, sender=User)
+def refresh_face_gallery_on_user_change(sender, instance, created, update_fields=None, **kwargs):
+    # The gallery holds only the user's name; a new user has no employee in it yet
+    loaded = getattr(instance, '_loaded_gallery_name', None)
+    name = instance._loaded_gallery_name = user_name(instance)
+    if created or (update_fields is not None and not {'first_name', 'last_name'} & set(update_fields)):
+        return
+    if loaded is None or name is None or loaded != name:
+        on_commit_once(invalidate_gallery)
@@ -1,3 +1,1500 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import inspect
+import io
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import face_debounce
+from .face_cache import (
+    GENERATION_NAME as FACE_CACHE_GENERATION, FaceEncodingCache, get_employee_templates, get_face_cache,
+)
+from .face_candidates import CandidateCache, match_for_kiosk, remember_match
+from .face_codec import DLIB_RESNET_V1, decode_encoding, encode_encoding, encoding_info, needs_conversion
+from .face_engine import DlibEngine, HashEngine, get_engine
+from .face_executor import (
+    RecognitionBusy, RecognitionExecutor, RecognitionTimeout, detect_and_encode, pool_size, run_recognition_batch,
+    select_burst_frame,
+)
+from .face_gallery import (
+    GENERATION_NAME as GALLERY_GENERATION, FaceGallery, export_gallery_file, get_gallery, invalidate_gallery,
+    read_gallery_generation,
+)
+from .face_index import IVFIndex
+from .face_jobs import claim_jobs, requeue_stale_jobs, run_jobs
+from .face_metrics import Histogram, MetricsRegistry, stage_timer, timed
+from .face_pipeline import (
+    decode_image, detect_faces, detect_faces_near, detection_copy, encode_faces, face_quality, frame_hash,
+    haar_candidates, quality_score, validate_chip_box,
+)
+from .face_policy import DEFAULT_COSTS, detection_costs, detection_params, predict_seconds, reset_detection_costs
+from .kiosk_logging import QueuedHandler, kiosk_logger, sampled_logging
+from .management.commands.benchmark_startup import WORKER_PROBE
+from .models import Attendance, CacheGeneration, Department, Employee, EncodingJob, FaceTemplate
+from .signals import on_commit_once
+from .warmup import safe_warm_up, warm_up, warm_up_on_start
+
+
+def random_encodings(rng, count, dimension=128):
+    encodings = rng.normal(size=(count, dimension))
+    # dlib descriptors have roughly unit length
+    return encodings / np.linalg.norm(encodings, axis=1, keepdims=True)
+
+
+def make_gallery(encodings, owners=None, **kwargs):
+    count = len(encodings) if owners is None else max(owners, default=-1) + 1
+    return FaceGallery(
+        np.arange(1, count + 1), [f'E{i:03d}' for i in range(count)], [f'Name {i}' for i in range(count)],
+        [f'Dept {i % 2}' for i in range(count)], encodings, owners=owners, **kwargs
+    )
+
+
+def jpeg_upload(name='frame.jpg', seed=0, size=(320, 240)):
+    pixels = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+def create_employee(username, encoding=None, department=None, **fields):
+    user = User.objects.create_user(username, password='pw', first_name=username.title(), last_name='Test')
+    employee = Employee.objects.create(
+        user=user, department=department, position='developer', phone_number='0900000000', address='-',
+        joining_date=date.today(), **fields
+    )
+    if encoding is not None:
+        employee.add_face_template(encoding)
+    return employee
+
+
+def recognizing(*encodings):
+    """Patch face_recognition so every frame shows one face per encoding"""
+    locations = [(40, 120 + 60 * i, 120, 60 + 60 * i) for i in range(len(encodings))]
+    # Each face is encoded on its own crop, in box order
+    next_encoding = itertools.cycle([np.asarray(encoding) for encoding in encodings]).__next__
+    return mock.patch.multiple(
+        'face_recognition',
+        face_locations=mock.Mock(return_value=locations),
+        face_encodings=mock.Mock(side_effect=lambda image, boxes: [next_encoding() for _ in boxes]),
+    )
+
+
+def recognizing_frames(*encodings):
+    """Patch face_recognition so consecutive frames show one face each, with the given encodings"""
+    return mock.patch.multiple(
+        'face_recognition',
+        face_locations=mock.Mock(return_value=[(40, 180, 120, 100)]),
+        face_encodings=mock.Mock(side_effect=[[np.asarray(encoding)] for encoding in encodings]),
+    )
+
+
+class FaceGalleryTests(SimpleTestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(1)
+        self.encodings = random_encodings(self.rng, 50)
+
+    def test_best_match_is_closest_employee(self):
+        gallery = make_gallery(self.encodings)
+        query = self.encodings[7] + 0.01
+        match = gallery.best_match(query)
+        self.assertEqual((match.employee_pk, match.employee_id, match.name), (8, 'E007', 'Name 7'))
+        self.assertAlmostEqual(match.distance, float(np.linalg.norm(self.encodings[7] - query)), places=6)
+
+    def test_top_k_matches_brute_force(self):
+        gallery = make_gallery(self.encodings)
+        query = random_encodings(self.rng, 1)[0]
+        expected = np.argsort(np.linalg.norm(self.encodings - query, axis=1))[:5] + 1
+        matches = gallery.top_k(query, 5)
+        self.assertEqual([match.employee_pk for match in matches], list(expected))
+
+    def test_best_matches_agree_with_best_match(self):
+        gallery = make_gallery(self.encodings)
+        queries = self.encodings[[3, 3, 40]] + self.rng.normal(scale=0.01, size=(3, 128))
+        for match, query in zip(gallery.best_matches(queries), queries):
+            expected = gallery.best_match(query)
+            self.assertEqual(match.employee_pk, expected.employee_pk)
+            self.assertAlmostEqual(match.distance, expected.distance, places=5)
+
+    def test_templates_reduce_to_each_employees_closest(self):
+        gallery = make_gallery(self.encodings[:5], owners=[0, 0, 1, 1, 2])
+        query = self.encodings[3] + 0.01
+        self.assertEqual(len(gallery), 3)
+        self.assertEqual(gallery.best_match(query).employee_pk, 2)
+        expected = [min(np.linalg.norm(self.encodings[rows] - query, axis=1)) for rows in ([0, 1], [2, 3], [4])]
+        np.testing.assert_allclose(gallery.distances(query), expected, atol=1e-5)
+        self.assertEqual(sorted(match.employee_pk for match in gallery.top_k(query, 5)), [1, 2, 3])
+        matches = gallery.best_matches([query, self.encodings[0]])
+        self.assertEqual([match.employee_pk for match in matches], [2, 1])
+
+    def test_assign_matches_is_one_to_one(self):
+        gallery = make_gallery(self.encodings[:3])
+        # Both faces are closest to employee 1; the closer one keeps it
+        queries = [self.encodings[0] + 0.02, self.encodings[0] + 0.01, self.encodings[2]]
+        matches = gallery.assign_matches(queries)
+        self.assertEqual(matches[1].employee_pk, 1)
+        self.assertIn(matches[0].employee_pk, (2, 3))
+        self.assertEqual(len({match.employee_pk for match in matches}), 3)
+
+    def test_assign_matches_skips_excluded_employees(self):
+        gallery = make_gallery(self.encodings[:4])
+        query = self.encodings[0] + 0.01
+        closest = np.argsort(np.linalg.norm(self.encodings[:4] - query, axis=1)) + 1
+        [match] = gallery.assign_matches([query], exclude={int(closest[0]), int(closest[1])})
+        self.assertEqual(match.employee_pk, closest[2])
+
+    def test_assign_matches_leaves_extra_faces_unmatched(self):
+        gallery = make_gallery(self.encodings[:2])
+        matches = gallery.assign_matches(self.encodings[[1, 0, 1]])
+        self.assertEqual([match and match.employee_pk for match in matches][:2], [2, 1])
+        self.assertIsNone(matches[2])
+
+    def test_empty_gallery_matches_no_one(self):
+        gallery = make_gallery(np.empty((0, 128)))
+        self.assertEqual(len(gallery), 0)
+        self.assertIsNone(gallery.best_match(self.encodings[0]))
+        self.assertEqual(gallery.best_matches(self.encodings[:2]), [None, None])
+        self.assertEqual(gallery.assign_matches(self.encodings[:2]), [None, None])
+        self.assertEqual(gallery.top_k(self.encodings[0], 3), [])
+        # A partition no one belongs to is empty too
+        partition = make_gallery(self.encodings[:2], department_ids=[10, 10]).partition(30)
+        self.assertEqual(len(partition), 0)
+        self.assertIsNone(partition.best_match(self.encodings[0]))
+
+    def test_gallery_file_round_trip(self):
+        gallery = make_gallery(self.encodings)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'gallery.bin')
+            gallery.to_file(path, 4)
+            self.assertEqual(read_gallery_generation(path), 4)
+            loaded = FaceGallery.from_file(path)
+            self.assertEqual(loaded.generation, 4)
+            self.assertEqual((loaded.employee_ids, loaded.names), (gallery.employee_ids, gallery.names))
+            np.testing.assert_array_equal(loaded.encodings, gallery.encodings)
+            self.assertEqual(loaded.best_match(self.encodings[9]).employee_pk, 10)
+
+    def test_missing_or_foreign_file_has_generation_zero(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'gallery.bin')
+            self.assertEqual(read_gallery_generation(path), 0)
+            with open(path, 'wb') as f:
+                f.write(b'not a gallery' * 10)
+            self.assertEqual(read_gallery_generation(path), 0)
+
+
+class GalleryPartitionTests(SimpleTestCase):
+    def setUp(self):
+        self.encodings = random_encodings(np.random.default_rng(9), 6)
+        # Employees 1-3 each have two templates; departments 10, 10, 20 and sites HN, HCM, HN
+        self.gallery = make_gallery(
+            self.encodings, owners=[0, 0, 1, 1, 2, 2], department_ids=[10, 10, 20], sites=['HN', 'HCM', 'HN']
+        )
+
+    def test_partitions_by_department_and_site(self):
+        self.assertEqual(list(self.gallery.partition(10).employee_pks), [1, 2])
+        self.assertEqual(list(self.gallery.partition(site='HN').employee_pks), [1, 3])
+        partition = self.gallery.partition(10, 'HN')
+        self.assertEqual(list(partition.employee_pks), [1])
+        np.testing.assert_array_equal(partition.encodings, self.gallery.encodings[:2])
+        self.assertIs(self.gallery.partition(10, 'HN'), partition)
+
+    def test_partition_search_stays_in_the_partition(self):
+        match = self.gallery.partition(20).best_match(self.encodings[3])
+        self.assertEqual(match.employee_pk, 3)
+
+    def test_moving_an_employee_only_rederives_affected_partitions(self):
+        kept, left, joined = self.gallery.partition(site='HCM'), self.gallery.partition(10), self.gallery.partition(20)
+        moved = self.gallery.with_employee_moved(1, 20, 'Sales', 'HN')
+        self.assertEqual(list(moved.partition(20).employee_pks), [1, 3])
+        self.assertEqual(list(moved.partition(10).employee_pks), [2])
+        self.assertIs(moved.partition(site='HCM'), kept)
+        self.assertEqual((list(left.employee_pks), list(joined.employee_pks)), ([1, 2], [3]))
+        self.assertEqual((moved.departments[0], self.gallery.departments[0]), ('Sales', 'Dept 0'))
+        self.assertIs(moved.encodings, self.gallery.encodings)
+        self.assertIsNone(self.gallery.with_employee_moved(99, 20, 'Sales', 'HN'))
+
+    @mock.patch('employee.face_metrics._registry', new_callable=MetricsRegistry)
+    def test_scoped_kiosks_fall_back_to_the_whole_gallery(self, registry):
+        self.assertEqual(match_for_kiosk(self.gallery, self.encodings[4], None, (10, '')).employee_pk, 3)
+        self.assertEqual(match_for_kiosk(self.gallery, self.encodings[0], None, (10, '')).employee_pk, 1)
+        with override_settings(FACE_PARTITION_FALLBACK=False):
+            self.assertNotEqual(match_for_kiosk(self.gallery, self.encodings[4], None, (10, '')).employee_pk, 3)
+        self.assertEqual(
+            registry.counters['face_recognition_partition_searches_total'], {'fallback': 1, 'hit': 1, 'miss': 1}
+        )
+
+    @mock.patch('employee.face_candidates._cache', None)
+    def test_scoped_short_lists_stay_in_the_partition(self):
+        remember_match('kiosk', 1)
+        remember_match('kiosk', 3)
+        with mock.patch.object(self.gallery, 'best_match') as best_match:
+            self.assertEqual(match_for_kiosk(self.gallery, self.encodings[0] + 0.001, 'kiosk', (10, '')).employee_pk, 1)
+        best_match.assert_not_called()
+        # Employee 3 is on the short list but outside department 10
+        with override_settings(FACE_PARTITION_FALLBACK=False):
+            match = match_for_kiosk(self.gallery, self.encodings[4] + 0.001, 'kiosk', (10, ''))
+        self.assertNotEqual(match.employee_pk, 3)
+
+
+@mock.patch('employee.face_candidates._cache', None)
+class KioskCandidateTests(SimpleTestCase):
+    def setUp(self):
+        self.encodings = random_encodings(np.random.default_rng(8), 20)
+        self.gallery = make_gallery(self.encodings)
+
+    def test_short_lists_are_bounded_per_kiosk(self):
+        cache = CandidateCache(size=2, max_kiosks=2)
+        for pk in (1, 2, 1, 3):
+            cache.add('a', pk)
+        self.assertEqual(cache.get('a'), [1, 3])
+        cache.add('b', 4)
+        cache.add('c', 5)
+        self.assertEqual((cache.get('a'), cache.get('c')), ([], [5]))
+
+    def test_candidate_match_only_considers_the_candidates(self):
+        self.assertEqual(self.gallery.candidate_match(self.encodings[2] + 0.001, [3, 4, 999]).employee_pk, 3)
+        self.assertIsNone(self.gallery.candidate_match(self.encodings[0], [999]))
+
+    def test_candidate_match_is_confirmed_only_when_no_one_else_can_be_closer(self):
+        # Employee 21 looks like employee 3
+        lookalike = self.encodings[2] + 0.3 * random_encodings(np.random.default_rng(9), 1)[0]
+        gallery = make_gallery(np.vstack([self.encodings, lookalike]))
+        self.assertEqual(gallery.candidate_match(self.encodings[2] + 0.001, [3]).employee_pk, 3)
+        # A scan between the two is not settled by whichever of them is on the short list
+        query = self.encodings[2] + 0.4 * (lookalike - self.encodings[2])
+        self.assertIsNone(gallery.candidate_match(query, [21]))
+        self.assertEqual(gallery.best_match(query).employee_pk, 3)
+        # Unrelated employees are far from everyone, so a close scan of one of them is confirmed
+        self.assertEqual(gallery.candidate_match(self.encodings[9] + 0.001, [10]).employee_pk, 10)
+
+    @mock.patch('employee.face_metrics._registry', new_callable=MetricsRegistry)
+    def test_close_candidates_skip_the_gallery(self, registry):
+        remember_match('kiosk', 3)
+        with mock.patch.object(self.gallery, 'best_match') as best_match:
+            self.assertEqual(match_for_kiosk(self.gallery, self.encodings[2] + 0.001, 'kiosk').employee_pk, 3)
+        best_match.assert_not_called()
+        self.assertEqual(registry.counters['face_recognition_candidate_lookups_total'], {'hit': 1})
+
+    @mock.patch('employee.face_metrics._registry', new_callable=MetricsRegistry)
+    def test_distant_candidates_fall_through_to_the_gallery(self, registry):
+        remember_match('kiosk', 3)
+        self.assertEqual(match_for_kiosk(self.gallery, self.encodings[5], 'kiosk').employee_pk, 6)
+        # Another kiosk has its own list
+        self.assertEqual(match_for_kiosk(self.gallery, self.encodings[2], 'other').employee_pk, 3)
+        self.assertEqual(registry.counters['face_recognition_candidate_lookups_total'], {'miss': 1})
+
+
+@mock.patch('employee.face_debounce._frames', None)
+@mock.patch('employee.face_debounce._scans', None)
+class FaceDebounceTests(SimpleTestCase):
+    def test_repeats_are_keyed_on_the_kiosk_and_employee(self):
+        face_debounce.remember_result('kiosk-1', 7, {'success': True, 'action': 'check_in'})
+        self.assertEqual(face_debounce.recent_result('kiosk-1', 7),
+                         {'success': True, 'action': 'check_in', 'repeated': True})
+        self.assertIsNone(face_debounce.recent_result('kiosk-1', 8))
+        self.assertIsNone(face_debounce.recent_result('kiosk-2', 7))
+
+    def test_failures_and_anonymous_kiosks_are_not_remembered(self):
+        face_debounce.remember_result('kiosk-1', 7, {'success': False}, digest=1)
+        face_debounce.remember_result(None, 7, {'success': True}, digest=1)
+        self.assertIsNone(face_debounce.recent_result('kiosk-1', 7))
+        self.assertIsNone(face_debounce.recent_result(None, 7))
+        self.assertIsNone(face_debounce.get_recent_frames().get('kiosk-1', 1, 0, time.monotonic()))
+
+    def test_recent_scans_expire_and_are_bounded(self):
+        scans = face_debounce.RecentScans(max_kiosks=2, per_kiosk=2)
+        now = time.monotonic()
+        scans.add('a', 1, 'first', now + 5)
+        self.assertEqual(scans.get('a', 1, now), 'first')
+        self.assertIsNone(scans.get('a', 1, now + 5))
+        for pk in (1, 2, 3):
+            scans.add('a', pk, f'a{pk}', now + 5)
+        self.assertIsNone(scans.get('a', 1, now))
+        scans.add('b', 1, 'b1', now + 5)
+        scans.add('c', 1, 'c1', now + 5)
+        self.assertIsNone(scans.get('a', 2, now))
+        self.assertEqual(scans.get('c', 1, now), 'c1')
+
+    def test_recent_frames_match_only_within_the_distance(self):
+        frames = face_debounce.RecentFrames(max_kiosks=2, per_kiosk=2)
+        now = time.monotonic()
+        frames.add('a', 0b1111, 'first', now + 2)
+        self.assertEqual(frames.get('a', 0b1011, 1, now), 'first')
+        self.assertIsNone(frames.get('a', 0b0000, 3, now))
+        self.assertIsNone(frames.get('b', 0b1111, 0, now))
+        self.assertIsNone(frames.get('a', 0b1111, 0, now + 2))
+
+    @override_settings(FACE_SCAN_FRAME_TTL=0, FACE_SCAN_DEBOUNCE_TTL=0)
+    def test_disabled(self):
+        face_debounce.remember_result('kiosk-1', 7, {'success': True}, digest=1)
+        self.assertIsNone(face_debounce.recent_result('kiosk-1', 7))
+        self.assertEqual(face_debounce.recent_frame('kiosk-1', jpeg_upload().read()), (None, None))
+
+    def test_cooldown(self):
+        self.assertTrue(face_debounce.in_cooldown(timezone.now() - timedelta(seconds=10)))
+        self.assertFalse(face_debounce.in_cooldown(timezone.now() - timedelta(seconds=90)))
+        self.assertFalse(face_debounce.in_cooldown(None))
+
+
+class FaceCodecTests(SimpleTestCase):
+    def setUp(self):
+        self.encoding = random_encodings(np.random.default_rng(3), 1)[0]
+
+    def test_float32_round_trip(self):
+        data = encode_encoding(self.encoding, 'float32')
+        self.assertEqual(len(data), 16 + 128 * 4)
+        self.assertEqual(encoding_info(data), ('float32', 128, DLIB_RESNET_V1))
+        np.testing.assert_array_equal(decode_encoding(data), self.encoding.astype(np.float32))
+
+    def test_int8_is_within_half_a_quantization_step(self):
+        data = encode_encoding(self.encoding, 'int8')
+        self.assertEqual(len(data), 16 + 128)
+        step = np.abs(self.encoding).max() / 127
+        self.assertLessEqual(np.abs(decode_encoding(data) - self.encoding).max(), step / 2 + 1e-6)
+
+    def test_legacy_float64_blobs_are_read(self):
+        data = self.encoding.tobytes()
+        self.assertEqual(encoding_info(data), ('float64', 128, DLIB_RESNET_V1))
+        np.testing.assert_allclose(decode_encoding(data), self.encoding, atol=1e-6)
+        self.assertTrue(needs_conversion(data, 'float32'))
+        self.assertFalse(needs_conversion(encode_encoding(self.encoding, 'float32'), 'float32'))
+        self.assertTrue(needs_conversion(encode_encoding(self.encoding, 'float32'), 'int8'))
+        self.assertFalse(needs_conversion(None, 'float32'))
+
+    def test_unsupported_dtype(self):
+        with self.assertRaises(ValueError):
+            encode_encoding(self.encoding, 'float16')
+
+
+class FaceEncodingCacheTests(SimpleTestCase):
+    def test_least_recently_used_entries_are_evicted_by_size(self):
+        cache = FaceEncodingCache(max_bytes=3 * 1024)
+        for key in range(3):
+            cache.put((key, 0), np.zeros(128))
+        cache.get((0, 0))
+        cache.put((3, 0), np.zeros(128))
+        self.assertIsNone(cache.get((1, 0)))
+        self.assertIsNotNone(cache.get((0, 0)))
+        stats = cache.stats()
+        self.assertEqual((stats['entries'], stats['bytes'], stats['evictions']), (3, 3072, 1))
+
+    def test_oversized_entries_are_not_cached(self):
+        cache = FaceEncodingCache(max_bytes=512)
+        cache.put((1, 0), np.zeros(128))
+        self.assertIsNone(cache.get((1, 0)))
+
+    def test_invalidate_drops_every_version(self):
+        cache = FaceEncodingCache(max_bytes=8 * 1024)
+        for key in [(1, 0), (1, 1), (2, 0)]:
+            cache.put(key, np.zeros(16))
+        cache.invalidate(1)
+        self.assertEqual((cache.get((1, 0)), cache.get((1, 1))), (None, None))
+        self.assertIsNotNone(cache.get((2, 0)))
+
+
+class CacheGenerationTests(TestCase):
+    def test_bump_creates_and_increments(self):
+        self.assertEqual(CacheGeneration.read('test'), 0)
+        CacheGeneration.bump('test')
+        CacheGeneration.bump('test')
+        self.assertEqual(CacheGeneration.read('test'), 2)
+
+    def test_cache_clears_when_another_process_bumps_the_generation(self):
+        cache = FaceEncodingCache(max_bytes=8 * 1024)
+        cache.sync_generation(ttl=0)
+        cache.put((1, 0), np.zeros(16))
+        cache.sync_generation(ttl=0)
+        self.assertIsNotNone(cache.get((1, 0)))
+        CacheGeneration.bump(FACE_CACHE_GENERATION)
+        cache.sync_generation(ttl=60)
+        self.assertIsNotNone(cache.get((1, 0)))
+        cache._generation_checked = 0.0
+        cache.sync_generation(ttl=60)
+        self.assertIsNone(cache.get((1, 0)))
+
+    def test_only_saves_that_change_encodings_invalidate(self):
+        employee = Employee.objects.get(pk=create_employee('anna', np.zeros(128)).pk)
+        with mock.patch('employee.signals.invalidate_employee') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                employee.base_salary = 1000
+                employee.save()
+            invalidate.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                employee.update_face_statistics()
+                employee.save()
+            invalidate.assert_called_once_with(employee.pk)
+
+    def test_new_templates_are_never_served_stale(self):
+        # Primary keys are reused between tests, so start from an empty process-wide cache
+        get_face_cache().clear()
+        encodings = random_encodings(np.random.default_rng(4), 2)
+        employee = create_employee('anna', encodings[0])
+        np.testing.assert_allclose(get_employee_templates(employee), encodings[:1], atol=1e-6)
+        with self.captureOnCommitCallbacks(execute=True):
+            employee.add_face_template(encodings[1], replace=True)
+        np.testing.assert_allclose(get_employee_templates(employee), encodings[1:], atol=1e-6)
+
+
+class FaceMetricsTests(SimpleTestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram(buckets=(0.01, 0.1))
+        for value in (0.005, 0.01, 0.05, 3.0):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.cumulative()), [(0.01, 2), (0.1, 3), ('+Inf', 4)])
+        self.assertEqual((histogram.count, histogram.sum), (4, 3.065))
+
+    def test_render_uses_the_prometheus_text_format(self):
+        registry = MetricsRegistry()
+        registry.observe_stage('match', 0.002)
+        registry.increment('face_recognition_errors_total', 'low_confidence')
+        lines = registry.render().splitlines()
+        self.assertIn('face_recognition_stage_seconds_bucket{stage="match",le="0.0025"} 1', lines)
+        self.assertIn('face_recognition_stage_seconds_bucket{stage="match",le="+Inf"} 1', lines)
+        self.assertIn('face_recognition_errors_total{error_type="low_confidence"} 1', lines)
+
+    @mock.patch('employee.face_metrics._registry', new_callable=MetricsRegistry)
+    def test_timed_records_sync_views_that_raise(self, registry):
+        @timed('view')
+        def view():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            view()
+        self.assertEqual(registry.stages['view'].count, 1)
+
+    @mock.patch('employee.face_metrics._registry', new_callable=MetricsRegistry)
+    async def test_timed_awaits_async_views(self, registry):
+        @timed('view')
+        async def view():
+            await asyncio.sleep(0.01)
+            return 'done'
+
+        self.assertTrue(inspect.iscoroutinefunction(view))
+        self.assertEqual(await view(), 'done')
+        self.assertGreaterEqual(registry.stages['view'].sum, 0.01)
+
+    @override_settings(FACE_METRICS_ENABLED=False)
+    @mock.patch('employee.face_metrics._registry', new_callable=MetricsRegistry)
+    def test_disabled_metrics_record_nothing(self, registry):
+        with stage_timer('match'):
+            pass
+        self.assertEqual(registry.stages, {})
+
+
+class KioskLoggingTests(SimpleTestCase):
+    def setUp(self):
+        self.logger = kiosk_logger('employee.tests.kiosk')
+
+    def logged(self, view):
+        with self.assertLogs('employee.tests.kiosk', level='DEBUG') as logs:
+            view()
+        return [record.levelname for record in logs.records]
+
+    def test_unsampled_requests_log_only_warnings(self):
+        @sampled_logging
+        def view():
+            self.logger.info('matched %s', 'E001')
+            self.logger.warning('low confidence')
+
+        with override_settings(FACE_LOG_SAMPLE_RATE=0.0):
+            self.assertEqual(self.logged(view), ['WARNING'])
+        with override_settings(FACE_LOG_SAMPLE_RATE=1.0):
+            self.assertEqual(self.logged(view), ['INFO', 'WARNING'])
+        # Outside a sampled view every record is logged
+        self.assertEqual(self.logged(lambda: self.logger.debug('startup')), ['DEBUG'])
+
+    @override_settings(FACE_LOG_SAMPLE_RATE=0.0)
+    async def test_async_views_are_sampled(self):
+        @sampled_logging
+        async def view():
+            return self.logger.isEnabledFor(logging.INFO)
+
+        self.assertTrue(inspect.iscoroutinefunction(view))
+        self.assertFalse(await view())
+
+    def test_employee_loggers_write_through_queued_handlers(self):
+        handlers = logging.getLogger('employee').handlers
+        self.assertEqual(len(handlers), 2)
+        self.assertTrue(all(isinstance(handler, QueuedHandler) for handler in handlers))
+
+    def test_queued_handler_writes_on_the_listener_thread(self):
+        stream = io.StringIO()
+        handler = QueuedHandler(target='logging.StreamHandler', stream=stream)
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        handler.handle(logging.makeLogRecord({'msg': 'matched %s', 'args': ('E001',), 'levelname': 'INFO'}))
+        handler.close()
+        self.assertEqual(stream.getvalue(), 'INFO matched E001\n')
+
+
+class IVFIndexTests(SimpleTestCase):
+    def test_recall_against_brute_force(self):
+        rng = np.random.default_rng(3)
+        # Clustered, as real galleries are, so the buckets mean something
+        centres = random_encodings(rng, 40)
+        encodings = centres[rng.integers(0, 40, 4000)] + rng.normal(scale=0.05, size=(4000, 128))
+        sq_norms = np.einsum('ij,ij->i', encodings, encodings)
+        index = IVFIndex(encodings, sq_norms, recall_target=0.95)
+        self.assertTrue(1 <= index.nprobe <= index.n_lists)
+
+        queries = encodings[rng.integers(0, 4000, 200)] + rng.normal(scale=0.03, size=(200, 128))
+        exact = [np.argmin(np.linalg.norm(encodings - query, axis=1)) for query in queries]
+        found = [index.search(query, 1)[0] for query in queries]
+        recall = np.mean([len(rows) > 0 and rows[0] == row for rows, row in zip(found, exact)])
+        self.assertGreaterEqual(recall, 0.9)
+
+    def test_search_returns_sorted_exact_distances(self):
+        encodings = random_encodings(np.random.default_rng(4), 500)
+        index = IVFIndex(encodings, np.einsum('ij,ij->i', encodings, encodings), n_lists=8)
+        rows, distances = index.search(encodings[42], 3)
+        self.assertEqual(rows[0], 42)
+        self.assertTrue(np.all(np.diff(distances) >= 0))
+        np.testing.assert_allclose(distances, np.linalg.norm(encodings[rows] - encodings[42], axis=1), atol=1e-6)
+
+    def test_gallery_search_through_index(self):
+        encodings = random_encodings(np.random.default_rng(5), 500)
+        gallery = make_gallery(encodings)
+        gallery.build_index(n_lists=8)
+        self.assertEqual(gallery.best_match(encodings[123]).employee_pk, 124)
+
+
+class FacePipelineTests(SimpleTestCase):
+    def encoded(self, size, mode='RGB', fmt='JPEG'):
+        buffer = io.BytesIO()
+        Image.new(mode, size, 128).save(buffer, fmt)
+        return buffer.getvalue()
+
+    def test_decode_image_bounds_size_and_converts_to_rgb(self):
+        image = decode_image(self.encoded((4000, 3000)), max_size=(1600, 1600))
+        self.assertEqual((image.shape, image.dtype), ((1200, 1600, 3), np.uint8))
+        image = decode_image(self.encoded((200, 100), mode='L', fmt='PNG'))
+        self.assertEqual(image.shape, (100, 200, 3))
+
+    def test_detection_copy(self):
+        image = np.zeros((960, 1280, 3), dtype=np.uint8)
+        small, scale = detection_copy(image, (320, 240))
+        self.assertEqual((small.shape, scale), ((240, 320, 3), 0.25))
+        self.assertIs(detection_copy(image, (2000, 2000))[0], image)
+
+    def test_detect_faces_returns_full_image_boxes(self):
+        image = np.zeros((960, 1280, 3), dtype=np.uint8)
+        with mock.patch('face_recognition.face_locations', return_value=[(10, 60, 60, 10)]) as face_locations:
+            self.assertEqual(detect_faces(image, max_size=(320, 240)), [(40, 240, 240, 40)])
+        self.assertEqual(face_locations.call_args[0][0].shape, (240, 320, 3))
+
+    def test_encode_faces_encodes_a_crop_around_each_box(self):
+        image = np.zeros((960, 1280, 3), dtype=np.uint8)
+        with mock.patch('face_recognition.face_encodings', return_value=[np.zeros(128)]) as face_encodings:
+            encode_faces(image, [(400, 600, 600, 400)])
+        crop, boxes = face_encodings.call_args[0]
+        # 50% of the box size on every side
+        self.assertEqual((crop.shape, boxes), ((400, 400, 3), [(100, 300, 300, 100)]))
+
+    def test_detect_faces_near_searches_around_the_hints(self):
+        image = np.zeros((960, 1280, 3), dtype=np.uint8)
+        with mock.patch('face_recognition.face_locations', return_value=[(10, 60, 60, 10)]) as face_locations:
+            boxes = detect_faces_near(image, [(400, 600, 600, 400)], max_size=(320, 240))
+        # The 400x400 region around the hint at the full-frame detection scale
+        self.assertEqual(face_locations.call_args[0][0].shape, (100, 100, 3))
+        self.assertEqual(boxes, [(340, 540, 540, 340)])
+
+    def test_frame_hash_tells_a_resent_frame_from_the_next_person(self):
+        def scene(seed):
+            # Smooth like a camera frame, unlike per-pixel noise
+            coarse = np.random.default_rng(seed).integers(0, 256, (12, 16, 3), dtype=np.uint8)
+            return np.asarray(Image.fromarray(coarse).resize((320, 240), Image.Resampling.BILINEAR))
+
+        pixels = scene(0)
+        # Sensor noise between two frames of the same scene
+        noisy = np.clip(pixels + np.random.default_rng(1).integers(-3, 4, pixels.shape), 0, 255).astype(np.uint8)
+        # Someone else standing in the same spot in front of the same background
+        other = pixels.copy()
+        other[60:180, 110:210] = scene(2)[60:180, 110:210]
+        hashes = []
+        for frame in (pixels, noisy, other):
+            buffer = io.BytesIO()
+            Image.fromarray(frame).save(buffer, 'JPEG')
+            hashes.append(frame_hash(buffer.getvalue()))
+        self.assertLessEqual((hashes[0] ^ hashes[1]).bit_count(), settings.FACE_SCAN_HASH_DISTANCE)
+        self.assertGreater((hashes[0] ^ hashes[2]).bit_count(), 4 * settings.FACE_SCAN_HASH_DISTANCE)
+        self.assertIsNone(frame_hash(b'not an image'))
+
+    def test_validate_chip_box(self):
+        chip = np.zeros((160, 160, 3), dtype=np.uint8)
+        self.assertEqual(validate_chip_box(chip, ['20', '140', '140', '20']), (20, 140, 140, 20))
+        for image, box in [
+            (np.zeros((240, 320, 3), dtype=np.uint8), (20, 140, 140, 20)),
+            (chip, (20, 170, 140, 20)),
+            (chip, (140, 140, 20, 20)),
+            (chip, (60, 100, 100, 60)),
+            (chip, ('top', 140, 140, 20)),
+            (chip, ('',)),
+        ]:
+            with self.assertRaises(ValueError):
+                validate_chip_box(image, box, size=160, min_face=0.4)
+
+    def test_prefilter_rejects_frames_without_candidates_before_dlib(self):
+        timings = {}
+        with mock.patch('face_recognition.face_locations') as face_locations:
+            self.assertEqual(detect_and_encode(self.encoded((640, 480)), prefilter=True, timings=timings), ([], []))
+        face_locations.assert_not_called()
+        self.assertIn('prefilter', timings)
+        self.assertEqual(haar_candidates(np.full((480, 640, 3), 128, dtype=np.uint8)), [])
+
+
+class StartupTests(SimpleTestCase):
+    def test_web_workers_start_without_heavy_modules(self):
+        probe = subprocess.run(
+            [sys.executable, '-c', WORKER_PROBE], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+        )
+        self.assertEqual(json.loads(probe.stdout)['heavy_modules'], [])
+
+
+class FaceEngineTests(SimpleTestCase):
+    def setUp(self):
+        self.frame = np.random.default_rng(0).integers(0, 256, (240, 320, 3), dtype=np.uint8)
+
+    def test_hash_engine_is_deterministic(self):
+        engine = HashEngine()
+        locations = engine.detect(self.frame)
+        self.assertEqual(locations, [(60, 220, 180, 100)])
+        first, = engine.encode(self.frame, locations)
+        np.testing.assert_array_equal(engine.encode(self.frame.copy(), locations)[0], first)
+        other = np.random.default_rng(1).integers(0, 256, self.frame.shape, dtype=np.uint8)
+        self.assertGreater(engine.distance([first], engine.encode(other, locations)[0])[0], 0.6)
+        self.assertEqual(engine.detect(np.full_like(self.frame, 128)), [])
+
+    def test_pipeline_uses_the_configured_engine(self):
+        with override_settings(FACE_ENGINE='employee.face_engine.HashEngine'):
+            self.assertIsInstance(get_engine(), HashEngine)
+            self.assertIs(get_engine(), get_engine())
+            with mock.patch('face_recognition.face_locations') as face_locations:
+                self.assertEqual(detect_faces(self.frame, max_size=(320, 240)), [(60, 220, 180, 100)])
+            face_locations.assert_not_called()
+        self.assertIsInstance(get_engine(), DlibEngine)
+
+
+@override_settings(FACE_DETECT_POLICY={}, FACE_DETECT_CALIBRATION=None)
+class BurstEnrollmentTests(SimpleTestCase):
+    box = (40, 180, 120, 100)
+
+    def frame(self, pixels):
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_quality_score_prefers_sharp_large_frontal_faces(self):
+        frontal = {'sharpness': 100.0, 'face_size': 200, 'yaw': 0.0, 'roll': 0.0}
+        self.assertGreater(quality_score(frontal), quality_score(dict(frontal, sharpness=10.0)))
+        self.assertGreater(quality_score(frontal), quality_score(dict(frontal, face_size=100)))
+        self.assertGreater(quality_score(frontal), quality_score(dict(frontal, roll=15.0)))
+        self.assertEqual(quality_score(dict(frontal, yaw=0.5)), 0.0)
+
+    def test_face_quality_measures_sharpness_and_pose(self):
+        sharp = np.random.default_rng(0).integers(0, 256, (240, 320, 3), dtype=np.uint8)
+        flat = np.full_like(sharp, 128)
+        landmarks = {'left_eye': [(110, 60), (120, 60)], 'right_eye': [(150, 70), (160, 70)], 'nose_tip': [(145, 90)]}
+        with mock.patch('face_recognition.face_landmarks', return_value=[landmarks]):
+            quality = face_quality(sharp, self.box)
+        self.assertEqual(quality['face_size'], 80)
+        self.assertAlmostEqual(quality['yaw'], 10 / np.hypot(40, 10))
+        self.assertAlmostEqual(quality['roll'], np.degrees(np.arctan2(10, 40)))
+        with mock.patch('face_recognition.face_landmarks', return_value=[]):
+            self.assertEqual(face_quality(flat, self.box)['sharpness'], 0.0)
+            self.assertGreater(face_quality(sharp, self.box)['sharpness'], 0.0)
+
+    def test_best_frame_is_picked_and_only_top_frames_are_encoded(self):
+        sharp = np.random.default_rng(0).integers(0, 256, (240, 320, 3), dtype=np.uint8)
+        frames = [self.frame(sharp), self.frame(np.full_like(sharp, 128)), self.frame(sharp)]
+        encoding = np.zeros(128)
+        with mock.patch('face_recognition.face_locations', side_effect=[[], [self.box], [self.box]]), \
+                mock.patch('face_recognition.face_landmarks', return_value=[]), \
+                mock.patch('face_recognition.face_encodings', return_value=[encoding]) as face_encodings:
+            index, location, selected, scores = select_burst_frame(frames, top_k=1)
+        self.assertEqual((index, location), (2, self.box))
+        self.assertIs(selected, encoding)
+        self.assertIsNone(scores[0])
+        self.assertGreater(scores[2], scores[1])
+        face_encodings.assert_called_once()
+
+    def test_burst_without_a_single_face(self):
+        with mock.patch('face_recognition.face_locations', return_value=[]):
+            self.assertIsNone(select_burst_frame([self.frame(np.zeros((240, 320, 3), dtype=np.uint8)), b'junk']))
+
+
+@override_settings(FACE_DETECT_POLICY={}, FACE_DETECT_CALIBRATION=None)
+class DetectionPolicyTests(SimpleTestCase):
+    def test_kiosk_frames_are_scanned_without_upsampling(self):
+        self.assertEqual(detection_params('kiosk', 640, 480, costs=DEFAULT_COSTS), ('hog', 0, (640, 640)))
+
+    def test_predicted_cost_grows_with_upsampling(self):
+        self.assertAlmostEqual(predict_seconds('hog', 1000, 1000, 1, DEFAULT_COSTS), 0.002 + 0.12 * 4)
+
+    def test_tight_budgets_fall_back_to_the_cheapest_option(self):
+        params = detection_params('kiosk', 640, 480, budget=0, costs=DEFAULT_COSTS)
+        self.assertEqual((params.upsample, params.max_size), (0, (160, 160)))
+
+    def test_sites_may_allow_other_models(self):
+        with override_settings(FACE_DETECT_POLICY={'kiosk': {'models': ('cnn',)}}):
+            self.assertEqual(detection_params('kiosk', 640, 480, budget=10, costs=DEFAULT_COSTS).model, 'cnn')
+
+    def test_calibration_file_overrides_default_costs(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump({'hog': {'per_megapixel': 1.0}}, f)
+            f.flush()
+            with override_settings(FACE_DETECT_CALIBRATION=f.name):
+                reset_detection_costs()
+                self.addCleanup(reset_detection_costs)
+                self.assertEqual(detection_costs()['hog'], {'overhead': 0.002, 'per_megapixel': 1.0})
+
+
+class RecognitionExecutorTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = RecognitionExecutor(workers=1, queue_depth=0, timeout=5.0)
+        self.addCleanup(self.executor.shutdown)
+        self.executor.warm_up(wait=True)
+
+    def test_runs_tasks_in_a_child_process(self):
+        self.assertNotEqual(self.executor.run(os.getpid), os.getpid())
+
+    def test_timeout_and_busy(self):
+        with self.assertRaises(RecognitionTimeout):
+            self.executor.run(time.sleep, 1.0, timeout=0.1)
+        # The timed-out task keeps its process, and no queue slot is left
+        with self.assertRaises(RecognitionBusy):
+            self.executor.run(os.getpid)
+        time.sleep(1.0)
+        self.assertNotEqual(self.executor.run(os.getpid), os.getpid())
+
+
+class RecognitionPoolSizeTests(SimpleTestCase):
+    @mock.patch('os.cpu_count', return_value=8)
+    def test_default_pool_shares_the_cpus_between_web_workers(self, cpu_count):
+        for web_workers, size in ((1, 8), (4, 2), (16, 1)):
+            with override_settings(FACE_POOL_SIZE=None, WEB_CONCURRENCY=web_workers):
+                self.assertEqual(pool_size(), size)
+        with override_settings(FACE_POOL_SIZE=0, WEB_CONCURRENCY=4):
+            self.assertEqual(pool_size(), 0)
+
+
+class RecognitionBatchTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = mock.Mock(workers=2, timeout=5.0)
+        self.executor.submit.side_effect = self.submit
+        self.futures = []
+        patcher = mock.patch('employee.face_executor.get_recognition_executor', return_value=self.executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit(self, fn, images, **kwargs):
+        future = Future()
+        future.set_result([(image, kwargs['site'], None) for image in images])
+        self.futures.append(future)
+        return future
+
+    def test_frames_are_split_across_the_pool_processes(self):
+        results = run_recognition_batch([b'a', b'b', b'c'], site='kiosk')
+        self.assertEqual(results, [(b'a', 'kiosk', None), (b'b', 'kiosk', None), (b'c', 'kiosk', None)])
+        self.assertEqual([call.args[1] for call in self.executor.submit.call_args_list], [[b'a', b'b'], [b'c']])
+
+    def test_queued_chunks_are_cancelled_when_the_pool_is_busy(self):
+        queued = Future()
+        self.executor.submit.side_effect = [queued, RecognitionBusy('busy')]
+        with self.assertRaises(RecognitionBusy):
+            run_recognition_batch([b'a', b'b'], site='kiosk')
+        self.assertTrue(queued.cancelled())
+
+    def test_chunks_share_one_deadline(self):
+        self.executor.timeout = 0.05
+        self.executor.submit.side_effect = lambda *args, **kwargs: Future()
+        with self.assertRaises(RecognitionTimeout):
+            run_recognition_batch([b'a', b'b'], site='kiosk')
+
+    def test_inline_without_a_pool(self):
+        with mock.patch('employee.face_executor.get_recognition_executor', return_value=None), \
+                mock.patch('employee.face_executor.detect_and_encode_batch', return_value=[]) as batch:
+            run_recognition_batch([b'a'], site='kiosk')
+        batch.assert_called_once_with([b'a'], site='kiosk')
+
+
+class GalleryInvalidationTests(TransactionTestCase):
+    # Changes are really committed, so on_commit callbacks run as in production
+    def setUp(self):
+        invalidate_gallery()
+        self.encodings = random_encodings(np.random.default_rng(2), 2)
+        self.department = Department.objects.create(name='R&D')
+        self.employee = create_employee('anna', self.encodings[0], self.department)
+
+    def test_gallery_holds_active_employees_with_a_face(self):
+        create_employee('bob', self.encodings[1], is_active=False)
+        create_employee('carol')
+        gallery = get_gallery()
+        self.assertEqual(list(gallery.employee_pks), [self.employee.pk])
+        self.assertEqual((gallery.names[0], gallery.departments[0]), ('Anna Test', 'R&D'))
+
+    @override_settings(FACE_ANN_ENABLED=True, FACE_ANN_MIN_GALLERY=2)
+    def test_large_galleries_get_an_index(self):
+        self.assertIsNone(get_gallery().index)
+        with transaction.atomic():
+            create_employee('bob', self.encodings[1])
+        self.assertIsNotNone(get_gallery().index)
+
+    def test_committed_changes_rebuild_the_gallery(self):
+        other = create_employee('bob', self.encodings[1])
+        self.assertEqual(len(get_gallery()), 2)
+        with transaction.atomic():
+            self.employee.is_active = False
+            self.employee.save()
+        self.assertEqual(list(get_gallery().employee_pks), [other.pk])
+
+    def test_renaming_a_department_rebuilds_the_gallery(self):
+        get_gallery()
+        with transaction.atomic():
+            self.department.name = 'Research'
+            self.department.save()
+        self.assertEqual(get_gallery().departments, ['Research'])
+
+    def test_shared_gallery_file_is_rewritten_by_the_exporter(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(FACE_GALLERY_FILE=os.path.join(directory, 'gallery.bin')):
+            path = settings.FACE_GALLERY_FILE
+            # Until the exporter writes the file, the gallery comes from the database
+            self.assertEqual(get_gallery().employee_ids, [self.employee.employee_id])
+            self.assertFalse(os.path.exists(path))
+            call_command('export_face_gallery', stdout=io.StringIO())
+            generation = read_gallery_generation(path)
+            self.assertEqual(generation, CacheGeneration.read(GALLERY_GENERATION))
+            self.assertEqual(get_gallery().generation, generation)
+            # The file already holds this generation, so another exporter leaves it alone
+            self.assertIsNone(export_gallery_file(path))
+
+            with transaction.atomic():
+                other = create_employee('bob', self.encodings[1])
+            self.assertEqual(read_gallery_generation(path), generation)
+            self.assertEqual(get_gallery().employee_ids, [self.employee.employee_id, other.employee_id])
+            export_gallery_file(path)
+            gallery = get_gallery()
+            self.assertEqual(gallery.generation, CacheGeneration.read(GALLERY_GENERATION))
+            self.assertEqual(gallery.employee_ids, [self.employee.employee_id, other.employee_id])
+        invalidate_gallery()
+
+    def test_logins_keep_the_gallery(self):
+        gallery = get_gallery()
+        with mock.patch('employee.signals.invalidate_gallery') as invalidate:
+            self.client.login(username='anna', password='pw')
+        invalidate.assert_not_called()
+        self.assertIs(get_gallery(), gallery)
+
+
+class OnCommitOnceTests(TestCase):
+    def test_same_call_is_queued_once_per_transaction(self):
+        func = mock.Mock()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            on_commit_once(func, 1)
+            on_commit_once(func, 1)
+            on_commit_once(func, 2)
+        self.assertEqual(len(callbacks), 2)
+        self.assertEqual(func.call_args_list, [mock.call(1), mock.call(2)])
+
+    def test_replacing_templates_invalidates_once(self):
+        encodings = random_encodings(np.random.default_rng(12), 4)
+        employee = create_employee('anna', encodings[0])
+        for encoding in encodings[1:3]:
+            employee.add_face_template(encoding)
+        with mock.patch('employee.signals.invalidate_gallery') as invalidate, \
+                mock.patch('employee.signals.invalidate_employee') as invalidate_employee, \
+                self.captureOnCommitCallbacks(execute=True):
+            employee.add_face_template(encodings[3], replace=True)
+        invalidate.assert_called_once_with()
+        invalidate_employee.assert_called_once_with(employee.pk)
+
+
+class GalleryPartitionMoveTests(TransactionTestCase):
+    def setUp(self):
+        invalidate_gallery()
+        self.encodings = random_encodings(np.random.default_rng(10), 2)
+        self.sales = Department.objects.create(name='Sales')
+        self.employee = create_employee('anna', self.encodings[0], Department.objects.create(name='R&D'))
+        create_employee('bob', self.encodings[1], self.sales)
+
+    def test_department_change_moves_the_employee_without_a_rebuild(self):
+        get_gallery().partition(self.sales.pk)
+        with mock.patch.object(FaceGallery, 'from_database') as from_database:
+            with transaction.atomic():
+                self.employee.department = self.sales
+                self.employee.site = 'HN'
+                self.employee.save()
+            gallery = get_gallery()
+        from_database.assert_not_called()
+        self.assertEqual(gallery.departments, ['Sales', 'Sales'])
+        self.assertEqual(len(gallery.partition(self.sales.pk)), 2)
+        self.assertEqual(list(gallery.partition(site='HN').employee_pks), [self.employee.pk])
+
+    def test_department_edit_only_moves_the_employee(self):
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        url = reverse('employee:edit_employee', args=[self.employee.pk])
+        form = self.client.get(url).context['form']
+        data = {name: form[name].value() for name in form.fields if name != 'face_image'}
+        data = {name: value for name, value in data.items() if value is not None}
+        data.update(department=self.sales.pk, email='anna@example.com')
+        with mock.patch('employee.signals.invalidate_gallery') as invalidate, \
+                mock.patch('employee.signals.move_employee') as move:
+            self.assertRedirects(self.client.post(url, data), reverse('employee:employee_list'))
+        invalidate.assert_not_called()
+        move.assert_called_once_with(self.employee.pk, self.sales.pk, 'Sales', '')
+
+    def test_only_name_changes_rebuild_the_gallery(self):
+        user = self.employee.user
+        with mock.patch('employee.signals.invalidate_gallery') as invalidate:
+            user.email = 'anna@example.com'
+            user.save(update_fields=['email'])
+            invalidate.assert_not_called()
+            user.first_name = 'Ann'
+            user.save(update_fields=['first_name'])
+            invalidate.assert_called_once_with()
+
+    def test_full_user_saves_rebuild_only_on_a_name_change(self):
+        user = User.objects.get(pk=self.employee.user_id)
+        with mock.patch('employee.signals.invalidate_gallery') as invalidate:
+            user.email = 'anna@example.com'
+            user.save()
+            User.objects.defer('first_name').get(pk=user.pk).save(update_fields=['email'])
+            invalidate.assert_not_called()
+            user.last_name = 'Nguyen'
+            user.save()
+            invalidate.assert_called_once_with()
+            user.save()
+            invalidate.assert_called_once_with()
+
+    def test_deactivation_rebuilds_the_gallery(self):
+        get_gallery()
+        with mock.patch('employee.signals.move_employee') as move, transaction.atomic():
+            self.employee.is_active = False
+            self.employee.save()
+        move.assert_not_called()
+        self.assertEqual(len(get_gallery()), 1)
+
+
+class WarmUpTests(TestCase):
+    def test_steps_are_timed(self):
+        invalidate_gallery()
+        create_employee('anna', random_encodings(np.random.default_rng(11), 1)[0])
+        timings = warm_up(steps={'gallery', 'urls', 'templates'})
+        self.assertEqual(set(timings), {'gallery', 'urls', 'templates'})
+        self.assertTrue(all(seconds >= 0 for seconds in timings.values()))
+
+    def test_server_hooks_log_failures_instead_of_raising(self):
+        with mock.patch('employee.warmup.STEPS', [('models', mock.Mock(side_effect=RuntimeError('no models')))]), \
+                self.assertLogs('employee.warmup', level='ERROR'):
+            safe_warm_up()
+
+    def test_warm_up_on_start_is_opt_in(self):
+        with mock.patch('employee.warmup.safe_warm_up') as hook:
+            with override_settings(FACE_WARM_UP_ON_START=False):
+                warm_up_on_start()
+            hook.assert_not_called()
+            with override_settings(FACE_WARM_UP_ON_START=True):
+                warm_up_on_start()
+            hook.assert_called_once()
+
+
+class FaceTemplateTests(TestCase):
+    def setUp(self):
+        invalidate_gallery()
+        self.encodings = random_encodings(np.random.default_rng(5), 4)
+        self.employee = create_employee('anna', self.encodings[0])
+
+    @override_settings(FACE_MAX_TEMPLATES=2)
+    def test_only_the_newest_templates_are_kept(self):
+        for encoding in self.encodings[1:]:
+            self.employee.add_face_template(encoding)
+        stored = [decode_encoding(e) for e in self.employee.face_templates.order_by('pk').values_list(
+            'encoding', flat=True)]
+        np.testing.assert_allclose(stored, self.encodings[2:], atol=1e-6)
+        np.testing.assert_allclose(decode_encoding(self.employee.face_encoding), self.encodings[3], atol=1e-6)
+        np.testing.assert_allclose(decode_encoding(self.employee.face_centroid), self.encodings[2:].mean(axis=0),
+                                   atol=1e-6)
+
+    def test_gallery_matches_any_template(self):
+        self.employee.add_face_template(self.encodings[1])
+        gallery = get_gallery()
+        self.assertEqual(len(gallery.owners), 2)
+        self.assertAlmostEqual(gallery.best_match(self.encodings[0]).distance, 0.0, places=3)
+        self.assertAlmostEqual(gallery.best_match(self.encodings[1]).distance, 0.0, places=3)
+
+    def test_admin_change_page_loads(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+        response = self.client.get(reverse('admin:employee_employee_change', args=[self.employee.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_deleting_templates_refreshes_the_primary_encoding(self):
+        self.employee.add_face_template(self.encodings[1])
+        self.employee.face_templates.order_by('-pk').first().delete()
+        self.employee.refresh_face_encoding()
+        np.testing.assert_allclose(decode_encoding(self.employee.face_encoding), self.encodings[0], atol=1e-6)
+        self.employee.face_templates.all().delete()
+        self.employee.refresh_face_encoding()
+        self.assertIsNone(self.employee.face_encoding)
+        self.assertEqual(len(self.employee.get_face_templates()), 0)
+
+    def test_appending_refuses_a_different_face(self):
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        url = reverse('employee:admin_register_face', args=[self.employee.pk])
+        with tempfile.TemporaryDirectory() as directory, override_settings(MEDIA_ROOT=directory):
+            for encoding in (self.encodings[1], self.encodings[0] + 0.01):
+                with mock.patch('employee.views.run_recognition', return_value=([(0, 100, 100, 0)], [encoding])):
+                    self.client.post(url, {'face_image': jpeg_upload(), 'append': '1'})
+        stored = self.employee.face_templates.order_by('pk').values_list('encoding', flat=True)
+        self.assertEqual(len(stored), 2)
+        np.testing.assert_allclose(decode_encoding(stored[1]), self.encodings[0] + 0.01, atol=1e-6)
+
+
+class EncodingJobTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=directory.name))
+        self.encoding = random_encodings(np.random.default_rng(7), 1)[0]
+        self.employee = create_employee('anna')
+
+    def upload_face(self, employee, seed=0):
+        with self.captureOnCommitCallbacks(execute=True):
+            employee.face_image.save(f'{employee.user.username}.jpg', jpeg_upload(seed=seed))
+        return EncodingJob.objects.filter(employee=employee).order_by('pk').last()
+
+    def test_new_face_images_are_queued_once(self):
+        job = self.upload_face(self.employee)
+        self.assertEqual((job.image, job.status), (self.employee.face_image.name, 'queued'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.employee.position = 'manager'
+            self.employee.save()
+        self.assertIsNone(EncodingJob.enqueue(self.employee.pk, job.image))
+        self.assertEqual(EncodingJob.objects.count(), 1)
+
+    def test_claim_marks_the_oldest_jobs_running(self):
+        jobs = [self.upload_face(self.employee, seed) for seed in range(3)]
+        claimed = claim_jobs(2)
+        self.assertEqual([job.pk for job in claimed], [job.pk for job in jobs[:2]])
+        self.assertEqual([(job.status, job.attempts) for job in claimed], [('running', 1)] * 2)
+        self.assertEqual([job.pk for job in claim_jobs(2)], [jobs[2].pk])
+        self.assertEqual(requeue_stale_jobs(older_than=-1), 3)
+
+    def test_run_records_encodings_and_failures(self):
+        other = create_employee('bob')
+        jobs = [self.upload_face(self.employee), self.upload_face(other, seed=1)]
+        results = [([(0, 100, 100, 0)], [self.encoding], None), ([], [], None)]
+        self.assertEqual(run_jobs(claim_jobs(2), lambda images: results), 1)
+
+        statuses = dict(EncodingJob.objects.values_list('pk', 'status'))
+        self.assertEqual([statuses[job.pk] for job in jobs], ['done', 'failed'])
+        self.employee.refresh_from_db()
+        template = self.employee.face_templates.get()
+        self.assertEqual((template.image.name, template.source), (self.employee.face_image.name, 'upload'))
+        np.testing.assert_allclose(decode_encoding(self.employee.face_encoding), self.encoding, atol=1e-6)
+
+    def test_a_failed_batch_is_retried_until_attempts_run_out(self):
+        job = self.upload_face(self.employee)
+
+        def crash(images):
+            raise RuntimeError('pool crashed')
+
+        run_jobs(claim_jobs(1), crash, max_attempts=2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.finished_at), ('queued', None))
+        run_jobs(claim_jobs(1), crash, max_attempts=2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('failed', 'pool crashed'))
+
+
+def inline_pool(max_workers, mp_context=None, **kwargs):
+    """Thread pool standing in for the command's process pool, so face_recognition patches apply"""
+    return ThreadPoolExecutor(max_workers=1)
+
+
+@mock.patch('employee.management.commands.reencode_faces.ProcessPoolExecutor', inline_pool)
+class ReencodeFacesTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=directory.name))
+        self.checkpoint = os.path.join(directory.name, 'checkpoint.json')
+        self.encodings = random_encodings(np.random.default_rng(6), 2)
+        self.employees = []
+        for seed, username in enumerate(['anna', 'bob']):
+            employee = create_employee(username)
+            employee.face_image.save(f'{username}.jpg', jpeg_upload(seed=seed))
+            self.employees.append(employee)
+
+    def reencode(self, *args):
+        call_command('reencode_faces', '--checkpoint', self.checkpoint, *args, stdout=io.StringIO(),
+                     stderr=io.StringIO())
+
+    def test_unchanged_images_are_skipped(self):
+        with recognizing(self.encodings[0]):
+            self.reencode()
+        for employee in self.employees:
+            employee.refresh_from_db()
+            np.testing.assert_allclose(decode_encoding(employee.face_encoding), self.encodings[0], atol=1e-6)
+            self.assertEqual(employee.face_templates.count(), 1)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        with mock.patch('employee.management.commands.reencode_faces.detect_and_encode_batch') as encode:
+            self.reencode()
+        encode.assert_not_called()
+        with recognizing(self.encodings[1]):
+            self.reencode('--force')
+        employee.refresh_from_db()
+        np.testing.assert_allclose(decode_encoding(employee.face_encoding), self.encodings[1], atol=1e-6)
+
+    def test_every_template_image_is_reencoded(self):
+        employee = self.employees[0]
+        employee.add_face_template(self.encodings[0])
+        burst = default_storage.save('face_templates/burst.jpg', jpeg_upload(seed=5))
+        employee.add_face_template(self.encodings[0], image=burst)
+        with recognizing(self.encodings[1]):
+            self.reencode('--employee', employee.employee_id)
+        for template in employee.face_templates.all():
+            np.testing.assert_allclose(decode_encoding(template.encoding), self.encodings[1], atol=1e-6)
+            self.assertEqual(len(template.image_hash), 64)
+
+    def test_primary_encoding_stays_the_newest_template(self):
+        employee = self.employees[0]
+        employee.add_face_template(self.encodings[0])
+        burst = default_storage.save('face_templates/burst.jpg', jpeg_upload(seed=5))
+        newest = employee.add_face_template(self.encodings[1], image=burst)
+        with default_storage.open(burst, 'rb') as f:
+            FaceTemplate.objects.filter(pk=newest.pk).update(image_hash=hashlib.sha256(f.read()).hexdigest())
+        # Only the older face image template is re-encoded
+        with recognizing(self.encodings[0] + 0.1):
+            self.reencode('--employee', employee.employee_id)
+        employee.refresh_from_db()
+        np.testing.assert_allclose(decode_encoding(employee.face_encoding), self.encodings[1], atol=1e-6)
+
+    def test_resumes_after_the_checkpoint(self):
+        first, second = self.employees
+        signature = {'employee_ids': [], 'department': None, 'include_inactive': False}
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'signature': signature, 'last_pk': first.pk}, f)
+        with recognizing(self.encodings[0]):
+            self.reencode()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertIsNone(first.face_encoding)
+        self.assertIsNotNone(second.face_encoding)
+
+    def test_checkpoint_of_another_selection_is_refused(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'signature': {'department': 'R&D'}, 'last_pk': 1}, f)
+        with self.assertRaises(CommandError):
+            self.reencode()
+
+
+class AsyncKioskBenchmarkTests(TransactionTestCase):
+    # The test runner already provides the throwaway database the command would create
+    @mock.patch('employee.management.commands.benchmark_async_kiosk.teardown_test_environment')
+    @mock.patch('employee.management.commands.benchmark_async_kiosk.setup_test_environment')
+    @mock.patch('django.db.connection.creation.destroy_test_db')
+    @mock.patch('django.db.connection.creation.create_test_db', return_value='configured')
+    def test_benchmark_runs_on_a_test_database(self, create_test_db, destroy_test_db, *environment):
+        stdout = io.StringIO()
+        call_command('benchmark_async_kiosk', '--requests', '4', '--concurrency', '2', '--employees', '3',
+                     '--engine-ms', '1', stdout=stdout)
+        create_test_db.assert_called_once()
+        destroy_test_db.assert_called_once_with('configured', verbosity=0)
+        for path in ('WSGI', 'ASGI'):
+            self.assertRegex(stdout.getvalue(), rf'{path}: 4 requests .* 0 failed')
+
+
+@mock.patch('employee.face_debounce._frames', None)
+@mock.patch('employee.face_debounce._scans', None)
+class KioskRecognitionTests(TestCase):
+    url = reverse('employee:process_auto_attendance')
+
+    def setUp(self):
+        invalidate_gallery()
+        # Primary keys are reused between tests, so start from an empty process-wide cache
+        get_face_cache().clear()
+        self.encodings = random_encodings(np.random.default_rng(3), 3)
+        self.employees = [create_employee(f'user{i}', encoding) for i, encoding in enumerate(self.encodings)]
+        self.client.force_login(User.objects.create_user('kiosk', password='pw', is_staff=True))
+        # Every scan sends a new camera frame unless a test repeats one
+        self.frames = itertools.count()
+
+    def scan(self, *encodings, frame=None, **data):
+        frame = next(self.frames) if frame is None else frame
+        with recognizing(*encodings):
+            return self.client.post(self.url, {'face_image': jpeg_upload(seed=frame), **data}).json()
+
+    def test_staff_scan_checks_in_the_closest_employee(self):
+        result = self.scan(self.encodings[1] + 0.01)
+        self.assertTrue(result['success'])
+        self.assertEqual(result['employee_id'], self.employees[1].employee_id)
+        attendance = Attendance.objects.get(employee=self.employees[1])
+        self.assertIsNotNone(attendance.check_in)
+        self.assertIsNone(attendance.check_out)
+
+    @mock.patch('employee.face_candidates._cache', None)
+    @mock.patch('employee.face_metrics._registry', new_callable=MetricsRegistry)
+    def test_kiosk_rematches_from_its_short_list(self, registry):
+        for _ in range(2):
+            result = self.scan(self.encodings[1] + 0.01, kiosk_id='lobby')
+            self.assertEqual(result['employee_id'], self.employees[1].employee_id)
+        self.assertEqual(registry.counters['face_recognition_candidate_lookups_total'], {'hit': 1})
+
+    @mock.patch('employee.face_metrics._registry', new_callable=MetricsRegistry)
+    def test_repeat_scans_get_the_earlier_response(self, registry):
+        first = self.scan(self.encodings[1])
+        with mock.patch('employee.views.record_attendance') as record_attendance:
+            repeated = self.scan(self.encodings[1] + 0.01)
+        record_attendance.assert_not_called()
+        self.assertEqual(repeated, dict(first, repeated=True))
+        self.assertEqual(registry.counters['face_recognition_debounced_scans_total'], {'repeat': 1})
+        # The next person at the same kiosk is matched and recorded on their own face
+        other = self.scan(self.encodings[0])
+        self.assertEqual(other['employee_id'], self.employees[0].employee_id)
+        self.assertNotIn('repeated', other)
+        self.assertTrue(Attendance.objects.filter(employee=self.employees[0]).exists())
+
+    @mock.patch('employee.face_metrics._registry', new_callable=MetricsRegistry)
+    def test_a_resent_frame_never_reaches_the_engine(self, registry):
+        first = self.scan(self.encodings[1], frame=7)
+        with mock.patch('employee.face_engine.DlibEngine.detect') as detect, \
+                mock.patch('employee.face_engine.DlibEngine.encode') as encode, \
+                mock.patch('employee.views.record_attendance') as record_attendance:
+            repeated = self.client.post(self.url, {'face_image': jpeg_upload(seed=7)}).json()
+        detect.assert_not_called()
+        encode.assert_not_called()
+        record_attendance.assert_not_called()
+        self.assertEqual(repeated, dict(first, repeated=True))
+        self.assertEqual(registry.counters['face_recognition_debounced_scans_total'], {'frame': 1})
+        # Another kiosk sending the same picture is recognized as usual
+        self.assertNotIn('repeated', self.scan(self.encodings[1], frame=7, kiosk_id='lobby'))
+
+    @override_settings(FACE_SCAN_FRAME_TTL=0)
+    def test_frame_check_can_be_disabled(self):
+        self.scan(self.encodings[1], frame=7)
+        with mock.patch('employee.views.run_recognition', side_effect=RecognitionBusy('busy')) as run_recognition:
+            self.scan(self.encodings[1], frame=7)
+        run_recognition.assert_called_once()
+
+    @override_settings(FACE_SCAN_DEBOUNCE_TTL=0)
+    @mock.patch('employee.face_metrics._registry', new_callable=MetricsRegistry)
+    def test_debouncing_can_be_disabled(self, registry):
+        self.scan(self.encodings[1])
+        again = self.scan(self.encodings[1])
+        self.assertNotIn('repeated', again)
+        # A scan right after checking in still does not check the employee out
+        self.assertEqual(again['attendance_status'], 'Đã chấm công vào')
+        self.assertEqual(registry.counters['face_recognition_debounced_scans_total'], {'cooldown': 1})
+        self.assertIsNone(Attendance.objects.get(employee=self.employees[1]).check_out)
+
+    def test_scans_without_registered_faces_say_so(self):
+        FaceTemplate.objects.all().delete()
+        invalidate_gallery()
+        self.assertEqual(self.scan(self.encodings[1])['error_type'], 'no_registered_faces')
+
+    def test_unknown_face_is_rejected(self):
+        result = self.scan(random_encodings(np.random.default_rng(4), 1)[0])
+        self.assertEqual(result['error_type'], 'low_confidence')
+        self.assertFalse(Attendance.objects.exists())
+
+    @mock.patch('employee.face_metrics._registry', new_callable=MetricsRegistry)
+    def test_stages_and_errors_are_exported(self, registry):
+        self.scan(random_encodings(np.random.default_rng(4), 1)[0])
+        metrics = self.client.get(reverse('employee:recognition_metrics')).content.decode()
+        self.assertIn('face_recognition_errors_total{error_type="low_confidence"} 1', metrics)
+        for stage in ('request', 'recognition', 'match'):
+            self.assertIn(f'face_recognition_stage_seconds_count{{stage="{stage}"}} 1', metrics)
+
+    @override_settings(FACE_CHIP_ENABLED=True)
+    def test_face_chips_skip_detection(self):
+        chip = jpeg_upload('chip.jpg', size=(160, 160))
+        with recognizing(self.encodings[2]), \
+                mock.patch('face_recognition.face_locations') as face_locations:
+            result = self.client.post(self.url, {'face_chip': chip, 'chip_box': '20,140,140,20'}).json()
+        face_locations.assert_not_called()
+        self.assertEqual(result['employee_id'], self.employees[2].employee_id)
+
+    def test_face_chips_are_validated(self):
+        for enabled, box in [(False, '20,140,140,20'), (True, '60,100,100,60')]:
+            chip = jpeg_upload('chip.jpg', size=(160, 160))
+            with override_settings(FACE_CHIP_ENABLED=enabled), recognizing(self.encodings[2]):
+                result = self.client.post(self.url, {'face_chip': chip, 'chip_box': box}).json()
+            self.assertEqual(result['error_type'], 'invalid_face_chip')
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_frame_without_one_face(self):
+        self.assertEqual(self.scan()['error_type'], 'no_face_detected')
+        self.assertEqual(self.scan(*self.encodings[:2])['error_type'], 'multiple_faces')
+
+    def test_pool_errors_are_reported_to_the_kiosk(self):
+        for error, error_type in (
+            (RecognitionBusy('busy'), 'recognition_busy'), (RecognitionTimeout('timeout'), 'recognition_timeout')
+        ):
+            with mock.patch('employee.views.run_recognition', side_effect=error):
+                self.assertEqual(self.scan(self.encodings[0])['error_type'], error_type)
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_batch_matches_every_frame(self):
+        frames = [jpeg_upload(f'{i}.jpg', seed=i) for i in range(3)]
+        frames.append(SimpleUploadedFile('notes.txt', b'text', content_type='text/plain'))
+        with recognizing_frames(self.encodings[0], self.encodings[0] + 0.01, self.encodings[2]):
+            results = self.client.post(
+                reverse('employee:process_auto_attendance_batch'), {'face_images': frames}
+            ).json()['results']
+        self.assertEqual([result.get('employee_id') for result in results[:3]], [
+            self.employees[0].employee_id, self.employees[0].employee_id, self.employees[2].employee_id
+        ])
+        self.assertEqual(results[3]['error_type'], 'invalid_file')
+        # Frames of one person share one attendance update
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(Attendance.objects.count(), 2)
+
+    @override_settings(FACE_BATCH_MAX_FRAMES=2)
+    def test_batch_frame_limit(self):
+        frames = [jpeg_upload(f'{i}.jpg', seed=i) for i in range(3)]
+        result = self.client.post(reverse('employee:process_auto_attendance_batch'), {'face_images': frames}).json()
+        self.assertEqual(result['error_type'], 'too_many_frames')
+
+    def test_batch_is_staff_only(self):
+        self.client.force_login(self.employees[0].user)
+        result = self.client.post(
+            reverse('employee:process_auto_attendance_batch'), {'face_images': [jpeg_upload()]}
+        ).json()
+        self.assertEqual(result['error_type'], 'permission_denied')
+
+    def test_employee_without_templates_gets_a_mismatch(self):
+        self.client.force_login(self.employees[0].user)
+        with mock.patch('employee.views.get_employee_templates', return_value=np.empty((0, 128))):
+            self.assertEqual(self.scan(self.encodings[0])['error_type'], 'face_mismatch')
+
+    def test_group_frame_checks_in_every_face_once(self):
+        unknown = random_encodings(np.random.default_rng(4), 1)[0]
+        with recognizing(self.encodings[0] + 0.01, unknown, self.encodings[2] + 0.01):
+            response = self.client.post(reverse('employee:process_group_attendance'), {'face_image': jpeg_upload()})
+        results = response.json()['results']
+        self.assertEqual([result.get('employee_id') for result in results],
+                         [self.employees[0].employee_id, None, self.employees[2].employee_id])
+        self.assertEqual(results[1]['error_type'], 'low_confidence')
+        self.assertEqual([result['location'] for result in results], [[40, 120, 120, 60], [40, 180, 120, 120],
+                                                                       [40, 240, 120, 180]])
+        self.assertEqual(Attendance.objects.count(), 2)
+
+    def test_group_frame_limits(self):
+        url = reverse('employee:process_group_attendance')
+        with override_settings(FACE_GROUP_MAX_FACES=2), recognizing(*self.encodings):
+            self.assertEqual(self.client.post(url, {'face_image': jpeg_upload()}).json()['error_type'],
+                             'too_many_faces')
+        with recognizing():
+            self.assertEqual(self.client.post(url, {'face_image': jpeg_upload()}).json()['error_type'],
+                             'no_face_detected')
+        self.client.force_login(self.employees[0].user)
+        self.assertEqual(self.client.post(url, {'face_image': jpeg_upload()}).json()['error_type'],
+                         'permission_denied')
+
+    def test_group_frame_without_registered_faces_says_so(self):
+        FaceTemplate.objects.all().delete()
+        invalidate_gallery()
+        with recognizing(*self.encodings):
+            result = self.client.post(reverse('employee:process_group_attendance'), {'face_image': jpeg_upload()})
+        self.assertEqual(result.json()['error_type'], 'no_registered_faces')
+
+    def test_employee_scan_is_verified_against_their_own_face(self):
+        self.client.force_login(self.employees[0].user)
+        self.assertTrue(self.scan(self.encodings[0])['success'])
+        self.assertEqual(self.scan(self.encodings[2])['error_type'], 'face_mismatch')
+
+
+@mock.patch('employee.face_debounce._frames', None)
+@mock.patch('employee.face_debounce._scans', None)
+class AsyncKioskTests(TestCase):
+    def setUp(self):
+        invalidate_gallery()
+        get_face_cache().clear()
+        self.encodings = random_encodings(np.random.default_rng(6), 2)
+        self.employees = [create_employee(f'user{i}', encoding) for i, encoding in enumerate(self.encodings)]
+        self.staff = User.objects.create_user('kiosk', password='pw', is_staff=True)
+        self.frames = itertools.count()
+
+    async def scan(self, encoding, frame=None):
+        frame = next(self.frames) if frame is None else frame
+        with recognizing(encoding):
+            response = await self.async_client.post(
+                reverse('employee:process_auto_attendance_async'), {'face_image': jpeg_upload(seed=frame)}
+            )
+        return response.json()
+
+    @override_settings(FACE_SCAN_DEBOUNCE_TTL=0, FACE_SCAN_COOLDOWN=0)
+    async def test_scans_check_in_then_out(self):
+        await self.async_client.aforce_login(self.staff)
+        first = await self.scan(self.encodings[1])
+        self.assertEqual((first['employee_id'], first['attendance_status']),
+                         (self.employees[1].employee_id, 'Đã chấm công vào'))
+        second = await self.scan(self.encodings[1])
+        self.assertEqual(second['attendance_status'], 'Đã chấm công ra')
+        attendance = await Attendance.objects.aget(employee_id=self.employees[1].pk)
+        self.assertIsNotNone(attendance.check_out)
+
+    async def test_employee_scan_is_verified_against_their_own_face(self):
+        await self.async_client.aforce_login(self.employees[0].user)
+        self.assertTrue((await self.scan(self.encodings[0]))['success'])
+        self.assertEqual((await self.scan(self.encodings[1]))['error_type'], 'face_mismatch')
+
+    async def test_repeat_scans_get_the_earlier_response(self):
+        await self.async_client.aforce_login(self.staff)
+        first = await self.scan(self.encodings[1])
+        repeated = await self.scan(self.encodings[1])
+        self.assertEqual(repeated, dict(first, repeated=True))
+        other = await self.scan(self.encodings[0])
+        self.assertEqual(other['employee_id'], self.employees[0].employee_id)
+        self.assertNotIn('repeated', other)
+        attendance = await Attendance.objects.aget(employee_id=self.employees[1].pk)
+        self.assertIsNone(attendance.check_out)
+
+    async def test_a_resent_frame_never_reaches_the_engine(self):
+        await self.async_client.aforce_login(self.staff)
+        first = await self.scan(self.encodings[1], frame=7)
+        with mock.patch('employee.async_views.arun_recognition') as arun_recognition:
+            repeated = await self.scan(self.encodings[0], frame=7)
+        arun_recognition.assert_not_called()
+        self.assertEqual(repeated, dict(first, repeated=True))
+
+    async def test_employee_without_templates_gets_a_mismatch(self):
+        await self.async_client.aforce_login(self.employees[0].user)
+        with mock.patch('employee.async_views.get_employee_templates', return_value=np.empty((0, 128))):
+            self.assertEqual((await self.scan(self.encodings[0]))['error_type'], 'face_mismatch')
+
+    async def test_anonymous_requests_are_sent_to_login(self):
+        response = await self.async_client.post(reverse('employee:process_auto_attendance_async'))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(reverse('employee:login')))
+
+    async def test_check_in_and_out(self):
+        await self.async_client.aforce_login(self.employees[0].user)
+        await self.async_client.post(reverse('employee:check_in_async'))
+        attendance = await Attendance.objects.aget(employee_id=self.employees[0].pk)
+        self.assertIsNotNone(attendance.check_in)
+        self.assertIsNone(attendance.check_out)
+        await self.async_client.post(reverse('employee:check_out_async'))
+        await attendance.arefresh_from_db()
+        self.assertIsNotNone(attendance.check_out)
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 app_name = 'employee'
 
@@ -28,9 +28,16 @@ urlpatterns = [
     path('salary/<int:salary_id>/', views.salary_detail, name='salary_detail'),
     path('auto-attendance/', views.auto_mark_attendance, name='auto_mark_attendance'),
     path('process-auto-attendance/', views.process_auto_attendance, name='process_auto_attendance'),
+    path('process-auto-attendance/batch/', views.process_auto_attendance_batch, name='process_auto_attendance_batch'),
+    path('process-auto-attendance/group/', views.process_group_attendance, name='process_group_attendance'),
+    path('face-cache/stats/', views.face_cache_stats, name='face_cache_stats'),
+    path('metrics/', views.recognition_metrics, name='recognition_metrics'),
     path('regenerate-face-encoding/<int:employee_id>/', views.regenerate_face_encoding, name='regenerate_face_encoding'),
     path('check-in/', views.check_in, name='check_in'),
     path('check-out/', views.check_out, name='check_out'),
+    path('async/process-auto-attendance/', async_views.process_auto_attendance, name='process_auto_attendance_async'),
+    path('async/check-in/', async_views.check_in, name='check_in_async'),
+    path('async/check-out/', async_views.check_out, name='check_out_async'),
     path('submit-feedback/', views.submit_feedback, name='submit_feedback'),
     path('feedback/', views.feedback_list, name='feedback_list'),
     path('feedback/<int:feedback_id>/', views.feedback_detail, name='feedback_detail'),
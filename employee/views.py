@@ -3,9 +3,6 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
 from .models import Employee, Attendance, Department, Salary, Feedback
-import face_recognition
-import numpy as np
-import cv2
 from datetime import date, datetime
 import json
 from django.contrib.admin.views.decorators import staff_member_required
@@ -13,21 +10,28 @@ from django.db import transaction
 from django.contrib.auth import authenticate, login, logout
 from django.core.paginator import Paginator
 from .forms import EmployeeForm
+from .face_cache import get_employee_templates, get_face_cache
+from .face_candidates import assign_matches_in_scope, best_matches_in_scope, match_for_kiosk, remember_match
+from .face_debounce import in_cooldown, recent_frame, recent_result, remember_frame, remember_result
+from .face_executor import (
+    run_recognition, run_recognition_batch, detect_and_encode, detect_and_encode_timed, encode_chip_timed,
+    select_burst_frame, RecognitionError, RecognitionBusy, RecognitionTimeout
+)
+from .face_metrics import count_error, observe_timings, render_metrics, stage_timer, timed
+from .kiosk_logging import kiosk_logger, sampled_logging
 from django.contrib.auth.models import User
 from django.db.models import Q, Sum, Avg
 import os
 from django.http import JsonResponse, HttpResponse
 from django.utils.timezone import localtime
-from PIL import Image
-import io
 import logging
-import traceback
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill
 from django.urls import reverse
+from django.conf import settings
 
 # Set up logging
 logger = logging.getLogger(__name__)
+# Kiosk recognition path: detail logs only for sampled requests (FACE_LOG_SAMPLE_RATE)
+kiosk_log = kiosk_logger(__name__)
 
 def login_view(request):
     if request.user.is_authenticated:
@@ -160,31 +164,30 @@ def dashboard(request):
 
 @login_required
 def mark_attendance(request):
+    from .face_engine import get_engine
+
     if request.method == 'POST' and request.FILES.get('face_image'):
         try:
-            # Get the uploaded image
-            uploaded_image = face_recognition.load_image_file(request.FILES['face_image'])
-            face_locations = face_recognition.face_locations(uploaded_image)
+            # Detect and encode the uploaded image on the recognition pool
+            face_locations, face_encodings = run_recognition(
+                detect_and_encode, request.FILES['face_image'].read(), site='kiosk', max_faces=1
+            )
             
             if not face_locations:
                 messages.error(request, 'Không phát hiện khuôn mặt trong ảnh')
                 return redirect('mark_attendance')
             
             # Get face encoding of the uploaded image
-            face_encoding = face_recognition.face_encodings(uploaded_image)[0]
+            face_encoding = face_encodings[0]
             
             # Get the employee
             employee = get_object_or_404(Employee, user=request.user)
             
-            # Get stored face encoding
-            stored_encoding = np.frombuffer(employee.face_encoding)
-            
-            # Compare faces
-            matches = face_recognition.compare_faces([stored_encoding], face_encoding)
-            face_distances = face_recognition.face_distance([stored_encoding], face_encoding)
+            # Compare against every stored face template; the closest one decides
+            face_distance = get_engine().distance(get_employee_templates(employee), face_encoding).min(initial=float('inf'))
             
-            if matches[0]:
-                confidence = (1 - face_distances[0]) * 100
+            if face_distance <= 0.6:
+                confidence = (1 - face_distance) * 100
                 
                 # Check if attendance already exists for today
                 today = date.today()
@@ -217,24 +220,76 @@ def mark_attendance(request):
     
     return render(request, 'employee/mark_attendance.html')
 
+def enroll_face(employee, face_image, location, face_encoding, source, append):
+    """Save a face template for `employee`; returns an error message or None.
+
+    Appending keeps the earlier templates and profile photo, but refuses a face
+    too far from the employee's template centroid to be the same person.
+    """
+    top, right, bottom, left = location
+    face_size = max(bottom - top, right - left)
+
+    if append and employee.face_centroid:
+        distance = employee.centroid_distance(face_encoding)
+        if distance > getattr(settings, 'FACE_TEMPLATE_MAX_DISTANCE', 0.6):
+            return 'Khuôn mặt không khớp với các mẫu đã đăng ký của nhân viên này.'
+        employee.add_face_template(face_encoding, image=face_image, source=source, face_size=face_size)
+    else:
+        employee.face_image = face_image
+        employee.add_face_template(face_encoding, source=source, face_size=face_size, replace=True)
+    return None
+
+def enrollment_upload(request):
+    """Whether the request carries an enrollment photo or burst"""
+    return bool(request.FILES.get('face_image') or request.FILES.get('face_images'))
+
+def enrollment_face(request):
+    """(uploaded file, face location, encoding) of an enrollment upload, or None if it shows no usable face.
+
+    A burst of `face_images` is ranked cheaply and only its best frames are
+    encoded (see `select_burst_frame`); a single `face_image` is encoded as is.
+    """
+    frames = request.FILES.getlist('face_images')[:getattr(settings, 'FACE_BURST_MAX_FRAMES', 10)]
+    if len(frames) > 1:
+        selected = run_recognition(
+            select_burst_frame, [frame.read() for frame in frames],
+            top_k=getattr(settings, 'FACE_BURST_TOP_K', 3), site='enrollment'
+        )
+        if selected is None:
+            return None
+        index, location, encoding, scores = selected
+        logger.info("Burst enrollment: frame %d of %d chosen, quality scores %s", index, len(frames), scores)
+        return frames[index], location, encoding
+    
+    image_file = frames[0] if frames else request.FILES['face_image']
+    face_locations, face_encodings = run_recognition(
+        detect_and_encode, image_file.read(), site='enrollment', max_faces=1
+    )
+    if not face_locations:
+        return None
+    return image_file, face_locations[0], face_encodings[0]
+
 @login_required
 def register_face(request):
     if not request.user.is_staff:
         employee = get_object_or_404(Employee, user=request.user)
         
-        if request.method == 'POST' and request.FILES.get('face_image'):
+        if request.method == 'POST' and enrollment_upload(request):
             try:
-                image = face_recognition.load_image_file(request.FILES['face_image'])
-                face_locations = face_recognition.face_locations(image)
+                face = enrollment_face(request)
                 
-                if not face_locations:
+                if face is None:
                     messages.error(request, 'Không phát hiện khuôn mặt trong ảnh')
                     return redirect('register_face')
                 
-                face_encoding = face_recognition.face_encodings(image)[0]
-                employee.face_encoding = face_encoding.tobytes()
-                employee.face_image = request.FILES['face_image']
-                employee.save()
+                image_file, location, face_encoding = face
+                error = enroll_face(
+                    employee, image_file, location, face_encoding,
+                    source='self', append=bool(request.POST.get('append'))
+                )
+                if error:
+                    messages.error(request, error)
+                    return redirect('register_face')
                 
                 messages.success(request, 'Đăng ký khuôn mặt thành công!')
                 return redirect('dashboard')
@@ -243,7 +298,10 @@ def register_face(request):
                 messages.error(request, f'Lỗi xử lý ảnh: {str(e)}')
                 return redirect('register_face')
         
-        return render(request, 'employee/register_face.html', {'employee': employee})
+        return render(request, 'employee/register_face.html', {
+            'employee': employee,
+            'burst_frames': getattr(settings, 'FACE_BURST_FRAMES', 5)
+        })
     
     return redirect('dashboard')
 
@@ -372,7 +430,7 @@ def add_employee(request):
                     employee = form.save(commit=False)
                     employee.user = user
                     
-                    # Handle face image
+                    # Handle face image; the encoding worker picks it up after commit
                     if 'face_image' in request.FILES:
                         employee.face_image = request.FILES['face_image']
                     
@@ -395,33 +453,31 @@ def edit_employee(request, employee_id):
     if request.method == 'POST':
         form = EmployeeForm(request.POST, request.FILES, instance=employee)
         if form.is_valid():
-            # Update user information
-            user.username = form.cleaned_data['username']
-            user.first_name = form.cleaned_data['first_name']
-            user.last_name = form.cleaned_data['last_name']
-            user.email = form.cleaned_data['email']
-            user.is_active = form.cleaned_data['is_active']  # Update user active status
+            # Update user information, including the active status; only changed fields are saved so
+            # that the face gallery is rebuilt just for name changes
+            changed_fields = [
+                field for field in ('username', 'first_name', 'last_name', 'email', 'is_active')
+                if getattr(user, field) != form.cleaned_data[field]
+            ]
+            for field in changed_fields:
+                setattr(user, field, form.cleaned_data[field])
             
             # Update password if provided
             if form.cleaned_data['password']:
                 if form.cleaned_data['password'] == form.cleaned_data['confirm_password']:
                     user.set_password(form.cleaned_data['password'])
+                    changed_fields.append('password')
                 else:
                     form.add_error('confirm_password', 'Mật khẩu xác nhận không khớp')
                     return render(request, 'employee/edit_employee.html', {'form': form, 'employee': employee})
             
-            user.save()
+            if changed_fields:
+                user.save(update_fields=changed_fields)
             employee = form.save()
 
-            # Handle face image update
+            # A new face image is encoded by the background worker (process_encoding_jobs)
             if 'face_image' in request.FILES:
-                employee.face_image = request.FILES['face_image']
-                employee.save()
-                # Regenerate face encoding
-                try:
-                    employee.generate_face_encoding()
-                except Exception as e:
-                    messages.error(request, f'Không thể tạo dữ liệu khuôn mặt: {str(e)}')
+                messages.info(request, 'Ảnh khuôn mặt mới đang được xử lý và sẽ sẵn sàng sau ít phút.')
 
             messages.success(request, 'Cập nhật thông tin nhân viên thành công!')
             return redirect('employee:employee_list')
@@ -508,25 +564,25 @@ def admin_mark_attendance(request, employee_id):
 def admin_register_face(request, employee_id):
     employee = get_object_or_404(Employee, id=employee_id)
     
-    if request.method == 'POST' and request.FILES.get('face_image'):
+    if request.method == 'POST' and enrollment_upload(request):
         try:
-            # Load and process the uploaded image
-            image = face_recognition.load_image_file(request.FILES['face_image'])
-            face_locations = face_recognition.face_locations(image)
+            # Detect and encode the uploaded image (or the best frames of a burst) on the recognition pool
+            face = enrollment_face(request)
             
-            if not face_locations:
+            if face is None:
                 messages.error(request, 'No face detected in the image')
                 return redirect(f'/employee/manage-attendance/?employee_id={employee_id}')
             
-            # Get face encoding
-            face_encoding = face_recognition.face_encodings(image)[0]
-            
-            # Save the face encoding and image
-            employee.face_encoding = face_encoding.tobytes()
-            employee.face_image = request.FILES['face_image']
-            employee.save()
-            
-            messages.success(request, f'Face registered for {employee.user.get_full_name()}')
+            # Save the face template and image
+            image_file, location, face_encoding = face
+            error = enroll_face(
+                employee, image_file, location, face_encoding,
+                source='admin', append=bool(request.POST.get('append'))
+            )
+            if error:
+                messages.error(request, error)
+            else:
+                messages.success(request, f'Face registered for {employee.user.get_full_name()}')
             
         except Exception as e:
             messages.error(request, f'Error processing image: {str(e)}')
@@ -548,241 +604,479 @@ def auto_mark_attendance(request):
     if request.user.is_staff:
         # For admin users, provide list of all active employees
         context['employees'] = Employee.objects.filter(is_active=True).order_by('user__first_name', 'user__last_name')
+    if getattr(settings, 'FACE_CHIP_ENABLED', False):
+        # The page crops the face in the browser and uploads only a chip of this size
+        context['face_chip_size'] = getattr(settings, 'FACE_CHIP_SIZE', 160)
     return render(request, 'employee/auto_mark_attendance.html', context)
 
-def optimize_image(image_file, max_size=(640, 480)):
-    """Optimize image size and quality for faster processing"""
-    try:
-        img = Image.open(image_file)
-        
-        # Convert to RGB if necessary
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Resize if larger than max_size while maintaining aspect ratio
-        if img.size[0] > max_size[0] or img.size[1] > max_size[1]:
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
+# Kiosk error messages shared by the single-frame and batch endpoints
+KIOSK_ERROR_MESSAGES = {
+    'invalid_file': 'Loại file không hợp lệ. Vui lòng tải lên file ảnh.',
+    'image_load_error': 'Lỗi tải ảnh. Vui lòng thử lại với ảnh khác.',
+    'face_detection_error': 'Lỗi phát hiện khuôn mặt. Vui lòng đảm bảo ánh sáng tốt và khuôn mặt rõ ràng.',
+    'encoding_error': 'Lỗi xử lý đặc trưng khuôn mặt. Vui lòng thử lại với ảnh rõ nét hơn.',
+    'no_face_detected': 'Không phát hiện khuôn mặt trong ảnh. Vui lòng đảm bảo khuôn mặt hiển thị rõ ràng.',
+    'multiple_faces': 'Phát hiện nhiều khuôn mặt. Vui lòng chỉ để một khuôn mặt trong khung hình.',
+    'recognition_busy': 'Hệ thống nhận diện đang bận. Vui lòng thử lại sau giây lát.',
+    'recognition_timeout': 'Quá thời gian xử lý nhận diện. Vui lòng thử lại.',
+    'invalid_face_chip': 'Ảnh khuôn mặt cắt sẵn không hợp lệ. Vui lòng gửi toàn bộ khung hình.',
+    'face_not_matched': 'Không xác định được nhân viên cho khuôn mặt này.',
+}
+
+# error_type reported for a failure inside the recognition task, keyed by stage
+RECOGNITION_ERROR_TYPES = {
+    'load': 'image_load_error',
+    'chip': 'invalid_face_chip',
+    'detect': 'face_detection_error',
+    'encode': 'encoding_error',
+}
+
+def kiosk_error(error_type, message=None):
+    count_error(error_type)
+    return {
+        'success': False,
+        'message': message or KIOSK_ERROR_MESSAGES[error_type],
+        'error_type': error_type
+    }
+
+def recognition_error_response(stage, message):
+    kiosk_log.error("Lỗi nhận diện (%s): %s", stage, message)
+    if stage in RECOGNITION_ERROR_TYPES:
+        return kiosk_error(RECOGNITION_ERROR_TYPES[stage])
+    return kiosk_error(
+        'unexpected_error',
+        f'Lỗi không mong đợi: {message}. Vui lòng thử lại hoặc liên hệ quản trị viên.'
+    )
+
+def kiosk_upload(request):
+    """The kiosk's image upload: a client-cropped face chip or a full frame"""
+    return request.FILES.get('face_chip') or request.FILES.get('face_image')
+
+def recognition_task(request, image_bytes):
+    """(task, args, kwargs) for the recognition pool; chips skip detection and are encoded at chip_box"""
+    if 'face_chip' in request.FILES:
+        if not getattr(settings, 'FACE_CHIP_ENABLED', False):
+            raise RecognitionError('chip', 'Face chips are not enabled')
+        return encode_chip_timed, (image_bytes, request.POST.get('chip_box', '').split(',')), {}
+    return detect_and_encode_timed, (image_bytes,), {
+        'site': 'kiosk', 'max_faces': 1, 'prefilter': getattr(settings, 'FACE_HAAR_PREFILTER', False)
+    }
+
+def kiosk_key(request):
+    """Key of the kiosk's recent-match short list: an explicit kiosk_id field, else the login session"""
+    return request.POST.get('kiosk_id') or request.session.session_key
+
+def kiosk_scope(request):
+    """(department id, site) a kiosk restricts matching to through its department_id/site fields, or None"""
+    department_id = request.POST.get('department_id', '')
+    site = request.POST.get('site', '').strip()
+    department_id = int(department_id) if department_id.isdigit() else None
+    if department_id is None and not site:
+        return None
+    return department_id, site
+
+def check_gallery_match(match):
+    """Return the kiosk error response for an unusable gallery match, or None"""
+    if match is None:
+        return kiosk_error('no_registered_faces', 'Không tìm thấy khuôn mặt đã đăng ký nào trong hệ thống.')
+    
+    confidence = (1 - match.distance) * 100
+    if confidence < 50:
+        return kiosk_error(
+            'low_confidence',
+            f'Độ tin cậy quá thấp ({confidence:.2f}%). Không thể xác định chính xác nhân viên.'
+        )
+    if confidence < 60:
+        kiosk_log.warning("Độ tin cậy trung bình (%.2f%%) cho nhân viên %s", confidence, match.employee_id)
+    return None
+
+def record_attendance(employee_pk, employee_name, employee_code, department_name, confidence):
+    """Record check-in (or check-out) for a recognized employee and build the kiosk response"""
+    today = date.today()
+    with stage_timer('attendance'):
+        attendance, created = Attendance.objects.get_or_create(
+            employee_id=employee_pk,
+            date=today,
+            defaults={
+                'status': 'present',
+                'check_in': timezone.now(),
+                'face_confidence': confidence
+            }
+        )
         
-        # Save optimized image to bytes
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='JPEG', quality=85, optimize=True)
-        img_byte_arr.seek(0)
+        current_time = localtime()
         
-        return img_byte_arr, None
-    except Exception as e:
-        error_msg = f"Image optimization error: {str(e)}"
-        logger.error(error_msg)
-        logger.error(traceback.format_exc())
-        return None, error_msg
-
-# Cache for storing face encodings
-face_encoding_cache = {}
+        if not created:
+            if not attendance.check_out and in_cooldown(attendance.check_in):
+                # Scanned again right after checking in: answer with the check-in, not a check-out
+                current_time = localtime(attendance.check_in)
+                status = "Đã chấm công vào"
+            elif not attendance.check_out:
+                attendance.check_out = current_time
+                attendance.save()
+                status = "Đã chấm công ra"
+            else:
+                status = "Đã chấm công đủ"
+        else:
+            status = "Đã chấm công vào"
+    
+    kiosk_log.info("Xử lý chấm công thành công cho nhân viên %s", employee_pk)
+    return attendance_response(employee_name, employee_code, department_name, status, current_time, confidence)
+
+def record_group_attendance(matches):
+    """Check in (or out) the distinct employees recognized in one group frame in a single transaction.
+
+    Returns the kiosk response for each FaceMatch, in order.
+    """
+    today = date.today()
+    now = timezone.now()
+    current_time = localtime(now)
+    with stage_timer('attendance'), transaction.atomic():
+        existing = {
+            attendance.employee_id: attendance
+            for attendance in Attendance.objects.select_for_update().filter(
+                employee_id__in=[match.employee_pk for match in matches], date=today
+            )
+        }
+        created, checked_out, statuses = [], [], []
+        for match in matches:
+            attendance = existing.get(match.employee_pk)
+            if attendance is None:
+                created.append(Attendance(
+                    employee_id=match.employee_pk, date=today, status='present', check_in=now,
+                    face_confidence=(1 - match.distance) * 100
+                ))
+                statuses.append("Đã chấm công vào")
+            elif not attendance.check_out and in_cooldown(attendance.check_in):
+                statuses.append("Đã chấm công vào")
+            elif not attendance.check_out:
+                attendance.check_out = current_time
+                checked_out.append(attendance)
+                statuses.append("Đã chấm công ra")
+            else:
+                statuses.append("Đã chấm công đủ")
+        # A single-face scan of the same employee may insert today's row after the lock above; that row is
+        # a check-in made moments ago, which is what the response already reports
+        Attendance.objects.bulk_create(created, ignore_conflicts=True)
+        Attendance.objects.bulk_update(checked_out, ['check_out'])
+    
+    kiosk_log.info("Chấm công nhóm thành công cho %d nhân viên", len(matches))
+    return [
+        attendance_response(
+            match.name, match.employee_id, match.department, status, current_time, (1 - match.distance) * 100
+        )
+        for match, status in zip(matches, statuses)
+    ]
 
-def get_face_encoding(employee_id, face_encoding_bytes):
-    """Get face encoding from cache or compute and cache it"""
-    if employee_id not in face_encoding_cache:
-        face_encoding_cache[employee_id] = np.frombuffer(face_encoding_bytes)
-    return face_encoding_cache[employee_id]
+def attendance_response(employee_name, employee_code, department_name, status, current_time, confidence):
+    return {
+        'success': True,
+        'message': f'Đã nhận diện thành công {employee_name}!',
+        'employee_name': employee_name,
+        'employee_id': employee_code,
+        'department': department_name,
+        'attendance_status': status,
+        'timestamp': current_time.strftime('%H:%M'),
+        'confidence': f'{confidence:.2f}%'
+    }
 
 @login_required
+@timed('request')
+@sampled_logging
 def process_auto_attendance(request):
     """Process the face recognition and mark attendance"""
-    if request.method == 'POST' and request.FILES.get('face_image'):
+    from .face_engine import get_engine
+    from .face_gallery import get_gallery
+
+    image_file = kiosk_upload(request)
+    if request.method == 'POST' and image_file:
         try:
-            logger.info("=== Bắt đầu quá trình nhận diện khuôn mặt ===")
-            logger.info(f"Phương thức yêu cầu: {request.method}")
-            logger.info(f"File trong yêu cầu: {request.FILES.keys()}")
-            logger.info(f"Loại file ảnh: {request.FILES['face_image'].content_type}")
-            logger.info(f"Kích thước file: {request.FILES['face_image'].size}")
+            kiosk_log.info("=== Bắt đầu quá trình nhận diện khuôn mặt ===")
+            kiosk_log.info("Phương thức yêu cầu: %s", request.method)
+            kiosk_log.info("File trong yêu cầu: %s", list(request.FILES))
+            kiosk_log.info("Loại file ảnh: %s", image_file.content_type)
+            kiosk_log.info("Kích thước file: %s", image_file.size)
             
-            image_file = request.FILES['face_image']
             if not image_file.content_type.startswith('image/'):
-                logger.error(f"Loại file không hợp lệ: {image_file.content_type}")
-                return JsonResponse({
-                    'success': False,
-                    'message': 'Loại file không hợp lệ. Vui lòng tải lên file ảnh.',
-                    'error_type': 'invalid_file'
-                })
-
-            logger.info("Bước 1: Tối ưu hóa ảnh tải lên")
-            optimized_image, error = optimize_image(image_file)
-            if error:
-                logger.error(f"Lỗi tối ưu hóa ảnh: {error}")
-                return JsonResponse({
-                    'success': False,
-                    'message': error,
-                    'error_type': 'optimization_error'
-                })
-            logger.info("Tối ưu hóa ảnh thành công")
-            
+                kiosk_log.error("Loại file không hợp lệ: %s", image_file.content_type)
+                return JsonResponse(kiosk_error('invalid_file'))
+
+            image_bytes = image_file.read()
+            kiosk = kiosk_key(request)
+            digest, previous = recent_frame(kiosk, image_bytes)
+            if previous:
+                kiosk_log.info("Ảnh lặp lại từ kiosk, trả lại kết quả trước đó")
+                return JsonResponse(previous)
+
             try:
-                logger.info("Bước 2: Đang tải ảnh đã tối ưu")
-                uploaded_image = face_recognition.load_image_file(optimized_image)
-                logger.info(f"Tải ảnh thành công. Kích thước: {uploaded_image.shape}")
-            except Exception as e:
-                logger.error(f"Lỗi tải ảnh: {str(e)}")
-                logger.error(traceback.format_exc())
-                return JsonResponse({
-                    'success': False,
-                    'message': 'Lỗi tải ảnh. Vui lòng thử lại với ảnh khác.',
-                    'error_type': 'image_load_error'
-                })
+                kiosk_log.info("Bước 1-3: Giải mã ảnh, phát hiện và mã hóa khuôn mặt")
+                task, args, kwargs = recognition_task(request, image_bytes)
+                # 'recognition' adds pool queueing and transfer to the stages timed inside the task
+                with stage_timer('recognition'):
+                    face_locations, face_encodings, timings = run_recognition(task, *args, **kwargs)
+                observe_timings(timings)
+                kiosk_log.info("Số khuôn mặt phát hiện được: %d", len(face_locations))
+            except RecognitionBusy:
+                kiosk_log.warning("Hàng đợi nhận diện đã đầy")
+                return JsonResponse(kiosk_error('recognition_busy'))
+            except RecognitionTimeout:
+                kiosk_log.warning("Quá thời gian xử lý nhận diện")
+                return JsonResponse(kiosk_error('recognition_timeout'))
+            except RecognitionError as e:
+                return JsonResponse(recognition_error_response(e.stage, e.message))
             
-            try:
-                logger.info("Bước 3: Phát hiện khuôn mặt")
-                face_locations = face_recognition.face_locations(uploaded_image, model="hog")
-                logger.info(f"Số khuôn mặt phát hiện được: {len(face_locations)}")
-                
-                if not face_locations:
-                    logger.warning("Không phát hiện khuôn mặt trong ảnh")
-                    return JsonResponse({
-                        'success': False,
-                        'message': 'Không phát hiện khuôn mặt trong ảnh. Vui lòng đảm bảo khuôn mặt hiển thị rõ ràng.',
-                        'error_type': 'no_face_detected'
-                    })
-                
-                if len(face_locations) > 1:
-                    logger.warning("Phát hiện nhiều khuôn mặt trong ảnh")
-                    return JsonResponse({
-                        'success': False,
-                        'message': 'Phát hiện nhiều khuôn mặt. Vui lòng chỉ để một khuôn mặt trong khung hình.',
-                        'error_type': 'multiple_faces'
-                    })
-                
-                logger.info(f"Vị trí khuôn mặt: {face_locations[0]}")
-            except Exception as e:
-                logger.error(f"Lỗi phát hiện khuôn mặt: {str(e)}")
-                logger.error(traceback.format_exc())
-                return JsonResponse({
-                    'success': False,
-                    'message': 'Lỗi phát hiện khuôn mặt. Vui lòng đảm bảo ánh sáng tốt và khuôn mặt rõ ràng.',
-                    'error_type': 'face_detection_error'
-                })
+            if not face_locations:
+                kiosk_log.warning("Không phát hiện khuôn mặt trong ảnh")
+                return JsonResponse(kiosk_error('no_face_detected'))
             
-            try:
-                logger.info("Bước 4: Tạo mã hóa khuôn mặt")
-                face_encoding = face_recognition.face_encodings(uploaded_image, face_locations)[0]
-                logger.info("Tạo mã hóa khuôn mặt thành công")
-            except Exception as e:
-                logger.error(f"Lỗi mã hóa khuôn mặt: {str(e)}")
-                logger.error(traceback.format_exc())
-                return JsonResponse({
-                    'success': False,
-                    'message': 'Lỗi xử lý đặc trưng khuôn mặt. Vui lòng thử lại với ảnh rõ nét hơn.',
-                    'error_type': 'encoding_error'
-                })
+            if len(face_locations) > 1:
+                kiosk_log.warning("Phát hiện nhiều khuôn mặt trong ảnh")
+                return JsonResponse(kiosk_error('multiple_faces'))
+            
+            kiosk_log.info("Vị trí khuôn mặt: %s", face_locations[0])
+            face_encoding = face_encodings[0]
+            kiosk_log.info("Tạo mã hóa khuôn mặt thành công")
 
             if not request.user.is_staff:
                 current_employee = get_object_or_404(Employee, user=request.user)
                 if not current_employee.face_encoding:
-                    return JsonResponse({
-                        'success': False,
-                        'message': 'Chưa đăng ký khuôn mặt cho tài khoản của bạn. Vui lòng liên hệ quản trị viên.',
-                        'error_type': 'no_registered_face'
-                    })
+                    return JsonResponse(kiosk_error(
+                        'no_registered_face',
+                        'Chưa đăng ký khuôn mặt cho tài khoản của bạn. Vui lòng liên hệ quản trị viên.'
+                    ))
                 
-                stored_encoding = np.frombuffer(current_employee.face_encoding)
-                matches = face_recognition.compare_faces([stored_encoding], face_encoding)
-                face_distances = face_recognition.face_distance([stored_encoding], face_encoding)
+                # Closest of the employee's face templates, same 0.6 tolerance as compare_faces
+                with stage_timer('match'):
+                    face_distance = get_engine().distance(get_employee_templates(current_employee), face_encoding).min(initial=float('inf'))
                 
-                if not matches[0]:
-                    return JsonResponse({
-                        'success': False,
-                        'message': 'Khuôn mặt không khớp với khuôn mặt đã đăng ký. Vui lòng đảm bảo bạn đang sử dụng đúng tài khoản của mình.',
-                        'error_type': 'face_mismatch'
-                    })
+                if face_distance > 0.6:
+                    return JsonResponse(kiosk_error(
+                        'face_mismatch',
+                        'Khuôn mặt không khớp với khuôn mặt đã đăng ký. Vui lòng đảm bảo bạn đang sử dụng đúng tài khoản của mình.'
+                    ))
                 
-                confidence = (1 - face_distances[0]) * 100
+                confidence = (1 - face_distance) * 100
                 if confidence < 60:
-                    return JsonResponse({
-                        'success': False,
-                        'message': 'Độ tin cậy nhận diện khuôn mặt quá thấp. Vui lòng thử lại với điều kiện ánh sáng tốt hơn.',
-                        'error_type': 'low_confidence'
-                    })
-            else:
-                employees = Employee.objects.exclude(face_encoding__isnull=True)
-                known_face_encodings = []
-                known_employees = []
-                
-                for employee in employees:
-                    if employee.face_encoding:
-                        known_face_encodings.append(np.frombuffer(employee.face_encoding))
-                        known_employees.append(employee)
+                    return JsonResponse(kiosk_error(
+                        'low_confidence',
+                        'Độ tin cậy nhận diện khuôn mặt quá thấp. Vui lòng thử lại với điều kiện ánh sáng tốt hơn.'
+                    ))
                 
-                if not known_face_encodings:
-                    return JsonResponse({
-                        'success': False,
-                        'message': 'Không tìm thấy khuôn mặt đã đăng ký nào trong hệ thống.',
-                        'error_type': 'no_registered_faces'
-                    })
-                
-                face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-                best_match_index = np.argmin(face_distances)
-                confidence = (1 - face_distances[best_match_index]) * 100
-                
-                if confidence >= 60:
-                    current_employee = known_employees[best_match_index]
-                elif confidence >= 50:
-                    current_employee = known_employees[best_match_index]
-                    logger.warning(f"Độ tin cậy trung bình ({confidence:.2f}%) cho nhân viên {current_employee.employee_id}")
-                else:
-                    return JsonResponse({
-                        'success': False,
-                        'message': f'Độ tin cậy quá thấp ({confidence:.2f}%). Không thể xác định chính xác nhân viên.',
-                        'error_type': 'low_confidence'
-                    })
-            
-            today = date.today()
-            attendance, created = Attendance.objects.get_or_create(
-                employee=current_employee,
-                date=today,
-                defaults={
-                    'status': 'present',
-                    'check_in': timezone.now(),
-                    'face_confidence': confidence
-                }
-            )
-            
-            current_time = localtime()
-            
-            if not created:
-                if not attendance.check_out:
-                    attendance.check_out = current_time
-                    attendance.save()
-                    status = "Đã chấm công ra"
-                else:
-                    status = "Đã chấm công đủ"
+                employee_pk = current_employee.pk
+                employee_name = current_employee.user.get_full_name()
+                employee_code = current_employee.employee_id
+                department_name = current_employee.department.name if current_employee.department else ''
             else:
-                status = "Đã chấm công vào"
-            
-            logger.info(f"Xử lý chấm công thành công cho nhân viên {current_employee.id}")
+                with stage_timer('match'):
+                    match = match_for_kiosk(get_gallery(), face_encoding, kiosk, kiosk_scope(request))
+                error = check_gallery_match(match)
+                if error:
+                    return JsonResponse(error)
+                remember_match(kiosk, match.employee_pk)
+                
+                confidence = (1 - match.distance) * 100
+                employee_pk = match.employee_pk
+                employee_name = match.name
+                employee_code = match.employee_id
+                department_name = match.department
             
-            return JsonResponse({
-                'success': True,
-                'message': f'Đã nhận diện thành công {current_employee.user.get_full_name()}!',
-                'employee_name': current_employee.user.get_full_name(),
-                'employee_id': current_employee.employee_id,
-                'department': current_employee.department.name,
-                'attendance_status': status,
-                'timestamp': current_time.strftime('%H:%M'),
-                'confidence': f'{confidence:.2f}%'
-            })
+            previous = recent_result(kiosk, employee_pk)
+            if previous:
+                kiosk_log.info("Nhân viên vừa được nhận diện tại kiosk này, trả lại kết quả trước đó")
+                remember_frame(kiosk, digest, previous)
+                return JsonResponse(previous)
+
+            response = record_attendance(employee_pk, employee_name, employee_code, department_name, confidence)
+            remember_result(kiosk, employee_pk, response, digest)
+            return JsonResponse(response)
                 
         except Exception as e:
-            logger.error(f"Lỗi không mong đợi trong quá trình nhận diện khuôn mặt: {str(e)}")
-            logger.error(traceback.format_exc())
-            return JsonResponse({
-                'success': False,
-                'message': f'Lỗi không mong đợi: {str(e)}. Vui lòng thử lại hoặc liên hệ quản trị viên.',
-                'error_type': 'unexpected_error'
-            })
-    
-    logger.error("Yêu cầu không hợp lệ: Không có file ảnh")
-    return JsonResponse({
-        'success': False,
-        'message': 'Yêu cầu không hợp lệ. Vui lòng cung cấp ảnh.',
-        'error_type': 'invalid_request'
-    })
+            kiosk_log.exception("Lỗi không mong đợi trong quá trình nhận diện khuôn mặt: %s", e)
+            return JsonResponse(kiosk_error(
+                'unexpected_error',
+                f'Lỗi không mong đợi: {str(e)}. Vui lòng thử lại hoặc liên hệ quản trị viên.'
+            ))
+    
+    kiosk_log.error("Yêu cầu không hợp lệ: Không có file ảnh")
+    return JsonResponse(kiosk_error('invalid_request', 'Yêu cầu không hợp lệ. Vui lòng cung cấp ảnh.'))
+
+@login_required
+@timed('batch_request')
+@sampled_logging
+def process_auto_attendance_batch(request):
+    """Recognize several kiosk frames in one request.
+
+    The frames are detected and encoded in parallel, one chunk per pool
+    process, and matched against the gallery with a single distance matrix.
+    Each item of `results` uses the single-frame response format; frames
+    showing the same employee share one attendance update.
+    """
+    from .face_gallery import get_gallery
+
+    if not request.user.is_staff:
+        return JsonResponse(kiosk_error('permission_denied', 'Chỉ tài khoản quản trị mới được dùng chức năng này.'))
+    
+    image_files = request.FILES.getlist('face_images')
+    if request.method != 'POST' or not image_files:
+        kiosk_log.error("Yêu cầu không hợp lệ: Không có file ảnh")
+        return JsonResponse(kiosk_error('invalid_request', 'Yêu cầu không hợp lệ. Vui lòng cung cấp ảnh.'))
+    
+    max_frames = getattr(settings, 'FACE_BATCH_MAX_FRAMES', 16)
+    if len(image_files) > max_frames:
+        return JsonResponse(kiosk_error('too_many_frames', f'Tối đa {max_frames} ảnh cho mỗi yêu cầu.'))
+    
+    try:
+        kiosk_log.info("=== Nhận diện theo lô: %d ảnh ===", len(image_files))
+        results = [None] * len(image_files)
+        frames, positions = [], []
+        for position, image_file in enumerate(image_files):
+            if not image_file.content_type.startswith('image/'):
+                results[position] = kiosk_error('invalid_file')
+                continue
+            frames.append(image_file.read())
+            positions.append(position)
+        
+        detections = []
+        if frames:
+            try:
+                with stage_timer('recognition_batch'):
+                    detections = run_recognition_batch(
+                        frames, site='kiosk', max_faces=1, prefilter=getattr(settings, 'FACE_HAAR_PREFILTER', False)
+                    )
+            except RecognitionBusy:
+                kiosk_log.warning("Hàng đợi nhận diện đã đầy")
+                return JsonResponse(kiosk_error('recognition_busy'))
+            except RecognitionTimeout:
+                kiosk_log.warning("Quá thời gian xử lý nhận diện")
+                return JsonResponse(kiosk_error('recognition_timeout'))
+            except RecognitionError as e:
+                return JsonResponse(recognition_error_response(e.stage, e.message))
+        
+        encoded_positions, encodings = [], []
+        for position, (locations, face_encodings, error) in zip(positions, detections):
+            if error:
+                results[position] = recognition_error_response(*error)
+            elif not locations:
+                results[position] = kiosk_error('no_face_detected')
+            elif len(locations) > 1:
+                results[position] = kiosk_error('multiple_faces')
+            else:
+                encoded_positions.append(position)
+                encodings.append(face_encodings[0])
+        
+        if encodings:
+            with stage_timer('match_batch'):
+                matches = best_matches_in_scope(get_gallery(), encodings, kiosk_scope(request))
+            recorded = {}
+            # Best match first, so repeated frames of one person reuse its attendance result
+            ranked = sorted(zip(encoded_positions, matches), key=lambda item: item[1].distance if item[1] else 0)
+            for position, match in ranked:
+                error = check_gallery_match(match)
+                if error:
+                    results[position] = error
+                elif match.employee_pk in recorded:
+                    results[position] = recorded[match.employee_pk]
+                else:
+                    recorded[match.employee_pk] = results[position] = record_attendance(
+                        match.employee_pk, match.name, match.employee_id, match.department,
+                        (1 - match.distance) * 100
+                    )
+        
+        return JsonResponse({'success': True, 'results': results})
+    
+    except Exception as e:
+        kiosk_log.exception("Lỗi không mong đợi trong quá trình nhận diện khuôn mặt: %s", e)
+        return JsonResponse(kiosk_error(
+            'unexpected_error',
+            f'Lỗi không mong đợi: {str(e)}. Vui lòng thử lại hoặc liên hệ quản trị viên.'
+        ))
+
+@login_required
+@timed('group_request')
+@sampled_logging
+def process_group_attendance(request):
+    """Recognize every face in one kiosk frame, for a group checking in together.
+
+    The faces are matched against the gallery with one distance matrix and
+    assigned one-to-one, so two faces never claim the same employee, and all
+    attendance rows are written in one transaction. Each item of `results`
+    uses the single-frame response format plus the face's `location`
+    (top, right, bottom, left).
+    """
+    from .face_gallery import get_gallery
+
+    if not request.user.is_staff:
+        return JsonResponse(kiosk_error('permission_denied', 'Chỉ tài khoản quản trị mới được dùng chức năng này.'))
+    
+    image_file = request.FILES.get('face_image')
+    if request.method != 'POST' or not image_file:
+        kiosk_log.error("Yêu cầu không hợp lệ: Không có file ảnh")
+        return JsonResponse(kiosk_error('invalid_request', 'Yêu cầu không hợp lệ. Vui lòng cung cấp ảnh.'))
+    if not image_file.content_type.startswith('image/'):
+        kiosk_log.error("Loại file không hợp lệ: %s", image_file.content_type)
+        return JsonResponse(kiosk_error('invalid_file'))
+    
+    try:
+        max_faces = getattr(settings, 'FACE_GROUP_MAX_FACES', 10)
+        try:
+            with stage_timer('recognition'):
+                face_locations, face_encodings, timings = run_recognition(
+                    detect_and_encode_timed, image_file.read(), site='kiosk', max_faces=max_faces,
+                    prefilter=getattr(settings, 'FACE_HAAR_PREFILTER', False)
+                )
+            observe_timings(timings)
+        except RecognitionBusy:
+            kiosk_log.warning("Hàng đợi nhận diện đã đầy")
+            return JsonResponse(kiosk_error('recognition_busy'))
+        except RecognitionTimeout:
+            kiosk_log.warning("Quá thời gian xử lý nhận diện")
+            return JsonResponse(kiosk_error('recognition_timeout'))
+        except RecognitionError as e:
+            return JsonResponse(recognition_error_response(e.stage, e.message))
+        
+        kiosk_log.info("Chấm công nhóm: phát hiện %d khuôn mặt", len(face_locations))
+        if not face_locations:
+            return JsonResponse(kiosk_error('no_face_detected'))
+        if len(face_locations) > max_faces:
+            return JsonResponse(kiosk_error('too_many_faces', f'Tối đa {max_faces} khuôn mặt trong một khung hình.'))
+        
+        gallery = get_gallery()
+        if not len(gallery):
+            return JsonResponse(check_gallery_match(None))
+        with stage_timer('match_group'):
+            matches = assign_matches_in_scope(gallery, face_encodings, kiosk_scope(request))
+        
+        results, accepted, accepted_positions = [], [], []
+        for position, match in enumerate(matches):
+            error = check_gallery_match(match) if match is not None else kiosk_error('face_not_matched')
+            results.append(error)
+            if not error:
+                accepted.append(match)
+                accepted_positions.append(position)
+        if accepted:
+            for position, response in zip(accepted_positions, record_group_attendance(accepted)):
+                results[position] = response
+        
+        for location, result in zip(face_locations, results):
+            result['location'] = list(location)
+        return JsonResponse({'success': True, 'results': results})
+    
+    except Exception as e:
+        kiosk_log.exception("Lỗi không mong đợi trong quá trình nhận diện khuôn mặt: %s", e)
+        return JsonResponse(kiosk_error(
+            'unexpected_error',
+            f'Lỗi không mong đợi: {str(e)}. Vui lòng thử lại hoặc liên hệ quản trị viên.'
+        ))
+
+@staff_member_required
+def face_cache_stats(request):
+    """Hit, miss and eviction counters of this worker's face encoding cache"""
+    return JsonResponse(get_face_cache().stats())
+
+@staff_member_required
+def recognition_metrics(request):
+    """Stage latency histograms and error counters of this worker, in Prometheus text format"""
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @staff_member_required
 def delete_employee(request, employee_id):
@@ -813,22 +1107,27 @@ def regenerate_face_encoding(request, employee_id):
     try:
         if employee.face_image:
             # Load the image
-            image_path = employee.face_image.path
-            image = face_recognition.load_image_file(image_path)
+            with employee.face_image.open('rb') as image_file:
+                image_bytes = image_file.read()
             
-            # Detect faces
-            face_locations = face_recognition.face_locations(image)
+            # Detect faces and generate the encoding on the recognition pool
+            face_locations, face_encodings = run_recognition(
+                detect_and_encode, image_bytes, site='enrollment', max_faces=1
+            )
             
             if not face_locations:
                 messages.error(request, 'Không phát hiện khuôn mặt trong ảnh đã lưu. Vui lòng tải lên ảnh mới.')
                 return redirect('employee:edit_employee', employee_id=employee_id)
             
-            # Generate face encoding
-            face_encoding = face_recognition.face_encodings(image)[0]
+            top, right, bottom, left = face_locations[0]
             
-            # Save the encoding
-            employee.face_encoding = face_encoding.tobytes()
-            employee.save()
+            # Replace the template taken from this image, keeping any others
+            with transaction.atomic():
+                employee.face_templates.filter(image=employee.face_image.name).delete()
+                employee.add_face_template(
+                    face_encodings[0], image=employee.face_image.name, source='regenerate',
+                    face_size=max(bottom - top, right - left)
+                )
             
             messages.success(request, f'Tạo lại mã hóa khuôn mặt thành công cho {employee.user.get_full_name()}')
         else:
@@ -990,18 +1289,11 @@ def attendance_list(request):
 @staff_member_required
 def export_employee_list(request):
     """Export employee list to Excel"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Employee List"
+    from .exports import autosize_columns, new_sheet, xlsx_response
 
     # Define headers
     headers = ['Employee ID', 'Full Name', 'Department', 'Position', 'Email', 'Phone', 'Join Date', 'Status']
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-        cell.alignment = Alignment(horizontal='center')
+    wb, ws = new_sheet("Employee List", headers)
 
     # Add data
     employees = Employee.objects.select_related('user', 'department').all()
@@ -1016,39 +1308,18 @@ def export_employee_list(request):
         ws.cell(row=row, column=8, value='Active' if employee.is_active else 'Inactive')
 
     # Adjust column widths
-    for column in ws.columns:
-        max_length = 0
-        column = [cell for cell in column]
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = (max_length + 2)
-        ws.column_dimensions[column[0].column_letter].width = adjusted_width
-
-    # Create response
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename=employee_list.xlsx'
-    wb.save(response)
-    return response
+    autosize_columns(ws)
+
+    return xlsx_response(wb, 'employee_list.xlsx')
 
 @staff_member_required
 def export_attendance_list(request):
     """Export attendance list to Excel"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Attendance List"
+    from .exports import autosize_columns, new_sheet, xlsx_response
 
     # Define headers
     headers = ['Date', 'Employee ID', 'Employee Name', 'Department', 'Check In', 'Check Out', 'Status', 'Working Hours']
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-        cell.alignment = Alignment(horizontal='center')
+    wb, ws = new_sheet("Attendance List", headers)
 
     # Get filter parameters
     start_date = request.GET.get('start_date')
@@ -1077,40 +1348,19 @@ def export_attendance_list(request):
         ws.cell(row=row, column=8, value=round(record.calculate_working_hours(), 2) if record.check_in and record.check_out else 0)
 
     # Adjust column widths
-    for column in ws.columns:
-        max_length = 0
-        column = [cell for cell in column]
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = (max_length + 2)
-        ws.column_dimensions[column[0].column_letter].width = adjusted_width
-
-    # Create response
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename=attendance_list.xlsx'
-    wb.save(response)
-    return response
+    autosize_columns(ws)
+
+    return xlsx_response(wb, 'attendance_list.xlsx')
 
 @staff_member_required
 def export_salary_list(request):
     """Export salary list to Excel"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Salary List"
+    from .exports import autosize_columns, bold, new_sheet, xlsx_response
 
     # Define headers
     headers = ['Month', 'Employee ID', 'Employee Name', 'Department', 'Base Pay', 'Regular Hours Pay', 
               'Overtime Pay', 'Total Salary', 'Total Days', 'Working Hours', 'Overtime Hours']
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-        cell.alignment = Alignment(horizontal='center')
+    wb, ws = new_sheet("Salary List", headers)
 
     # Get filter parameters
     month = request.GET.get('month')
@@ -1141,29 +1391,15 @@ def export_salary_list(request):
 
     # Add summary row
     summary_row = ws.max_row + 2
-    ws.cell(row=summary_row, column=1, value="Total").font = Font(bold=True)
+    bold(ws.cell(row=summary_row, column=1, value="Total"))
     for col in range(5, 9):  # Columns E to H (5 to 8) - monetary values
         column_letter = ws.cell(row=1, column=col).column_letter
-        ws.cell(row=summary_row, column=col, value=f"=SUM({column_letter}2:{column_letter}{ws.max_row-2})").font = Font(bold=True)
+        bold(ws.cell(row=summary_row, column=col, value=f"=SUM({column_letter}2:{column_letter}{ws.max_row-2})"))
 
     # Adjust column widths
-    for column in ws.columns:
-        max_length = 0
-        column = [cell for cell in column]
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = (max_length + 2)
-        ws.column_dimensions[column[0].column_letter].width = adjusted_width
-
-    # Create response
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename=salary_list.xlsx'
-    wb.save(response)
-    return response
+    autosize_columns(ws)
+
+    return xlsx_response(wb, 'salary_list.xlsx')
 
 @login_required
 def check_in(request):
@@ -1316,9 +1552,7 @@ def resolve_feedback(request, feedback_id):
 @staff_member_required
 def export_feedback_list(request):
     """Export feedback list to Excel"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Danh Sách Phản Hồi"
+    from .exports import autosize_columns, new_sheet, xlsx_response
 
     # Define headers
     headers = [
@@ -1327,12 +1561,7 @@ def export_feedback_list(request):
         'Thời Gian Xử Lý', 'Ghi Chú Xử Lý'
     ]
     
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-        cell.alignment = Alignment(horizontal='center')
+    wb, ws = new_sheet("Danh Sách Phản Hồi", headers)
 
     # Get filter parameters
     department_id = request.GET.get('department')
@@ -1372,23 +1601,9 @@ def export_feedback_list(request):
         ws.cell(row=row, column=9, value=feedback.resolution_notes if feedback.resolution_notes else '')
 
     # Adjust column widths
-    for column in ws.columns:
-        max_length = 0
-        column = [cell for cell in column]
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = (max_length + 2)
-        ws.column_dimensions[column[0].column_letter].width = adjusted_width
-
-    # Create response
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename=danh_sach_phan_hoi.xlsx'
-    wb.save(response)
-    return response
+    autosize_columns(ws)
+
+    return xlsx_response(wb, 'danh_sach_phan_hoi.xlsx')
 
 @staff_member_required
 def feedback_detail(request, feedback_id):
@@ -0,0 +1,90 @@
+"""Pre-loads what the first kiosk scan after a deploy would otherwise wait for.
+
+`warm_up` loads the face models (in the recognition pool's processes too),
+builds the gallery, resolves the URLconf and compiles the kiosk templates,
+returning the seconds each step took. Everything it loads is cached per
+process, so it has to run in every web worker: with FACE_WARM_UP_ON_START
+the WSGI and ASGI applications run it when a worker loads them. Servers
+that load the application before forking (gunicorn --preload) must leave
+that setting off and use the `post_worker_init` hook from their config
+instead, so the pool and DB connections are created after the fork.
+`manage.py warm_up` runs the same steps once to check and time them on a
+deployed host.
+"""
+import logging
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Templates rendered on the recognition paths; templates are compiled once per process by the cached loader
+HOT_TEMPLATES = (
+    'base.html',
+    'employee/auto_mark_attendance.html',
+    'employee/mark_attendance.html',
+    'employee/register_face.html',
+)
+
+
+def warm_models():
+    from .face_executor import warm_up_recognition
+    warm_up_recognition()
+
+
+def warm_gallery():
+    from .face_gallery import get_gallery
+    get_gallery()
+
+
+def warm_urls():
+    from django.urls import get_resolver, reverse
+    get_resolver().url_patterns
+    # The first reverse() builds the resolver's reverse lookup tables
+    reverse('employee:auto_mark_attendance')
+
+
+def warm_templates():
+    from django.template.loader import get_template
+    for name in HOT_TEMPLATES:
+        get_template(name)
+
+
+STEPS = (
+    ('models', warm_models),
+    ('gallery', warm_gallery),
+    ('urls', warm_urls),
+    ('templates', warm_templates),
+)
+
+
+def warm_up(steps=None):
+    """Run the warm-up steps (all by default) and return {step: seconds}"""
+    timings = {}
+    for name, step in STEPS:
+        if steps is not None and name not in steps:
+            continue
+        started = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - started
+        logger.info('Warm-up %s: %.0f ms', name, timings[name] * 1000)
+    return timings
+
+
+def safe_warm_up():
+    """`warm_up` for server hooks: a failing step is logged, never raised, so the worker still starts"""
+    try:
+        warm_up()
+    except Exception:
+        logger.exception('Warm-up failed; the first requests will load what is missing')
+
+
+def warm_up_on_start():
+    """Called by mysite/wsgi.py and asgi.py once the application is loaded"""
+    if getattr(settings, 'FACE_WARM_UP_ON_START', False):
+        safe_warm_up()
+
+
+def post_worker_init(worker):
+    """gunicorn hook, for gunicorn.conf.py: `from employee.warmup import post_worker_init`"""
+    safe_warm_up()
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_asgi_application()
+
+# Pre-loads face models, gallery and templates when FACE_WARM_UP_ON_START is set (see employee/warmup.py)
+from employee.warmup import warm_up_on_start  # noqa: E402
+
+warm_up_on_start()
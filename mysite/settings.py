@@ -138,3 +138,160 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_URL = 'employee:login'
 LOGIN_REDIRECT_URL = 'employee:dashboard'
 LOGOUT_REDIRECT_URL = 'employee:login'
+
+# Face recognition
+# Approximate nearest-neighbour index for large galleries; smaller galleries use exact search
+FACE_ANN_ENABLED = False
+FACE_ANN_MIN_GALLERY = 5000
+FACE_ANN_RECALL_TARGET = 0.99
+FACE_ANN_LISTS = None  # defaults to sqrt(gallery size)
+
+# Shared memory-mapped gallery file; None keeps a private in-memory gallery per worker. Gallery changes only
+# bump its generation: run `manage.py export_face_gallery --watch` alongside the web workers to rewrite the
+# file, which workers remap once it reaches the new generation (until then they build from the database).
+FACE_GALLERY_FILE = None
+
+# Face detection/encoding backend (see employee/face_engine.py); 'employee.face_engine.HashEngine' is a
+# deterministic NumPy fake without dlib for benchmarks and load tests, never for real attendance
+FACE_ENGINE = 'employee.face_engine.DlibEngine'
+
+# Recognition process pool. Every web worker process starts its own pool, so a host runs
+# WEB_CONCURRENCY x FACE_POOL_SIZE recognition processes besides the web workers themselves (4 gunicorn
+# workers with a pool of 4 each are 16 dlib processes, each holding its own copy of the models). None shares
+# the host's CPUs out between the web workers: os.cpu_count() // WEB_CONCURRENCY processes each, at least 1.
+# 0 runs detection/encoding inline in the request thread, as under runserver.
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))  # web worker processes per host, as gunicorn reads it
+FACE_POOL_SIZE = 0 if DEBUG else None
+FACE_POOL_QUEUE_DEPTH = 16  # tasks allowed to wait for a free process before requests are rejected
+FACE_TASK_TIMEOUT = 5.0  # seconds per detection/encoding task
+FACE_BATCH_MAX_FRAMES = 16  # frames accepted per batch kiosk request
+FACE_GROUP_MAX_FACES = 10  # faces encoded per group check-in frame
+
+# Uploads are decoded once, no larger than FACE_IMAGE_MAX_SIZE; HOG runs on a smaller copy
+# and encodings use the full-resolution crop. Kiosk and enrollment calls size that copy with
+# the detection policy below; other callers use FACE_DETECT_MAX_SIZE
+FACE_IMAGE_MAX_SIZE = (1600, 1600)
+FACE_DETECT_MAX_SIZE = (320, 240)
+
+# Per call site: detection latency budget (seconds), smallest face to find (fraction of the image's
+# longer side) and allowed models; see employee/face_policy.py. Costs are measured on this host by
+# `manage.py calibrate_face_detection` into FACE_DETECT_CALIBRATION
+FACE_DETECT_POLICY = {
+    'kiosk': {'budget': 0.15, 'min_face': 0.125, 'models': ('hog',)},
+    'enrollment': {'budget': 1.0, 'min_face': 0.08, 'models': ('hog',)},
+}
+FACE_DETECT_CALIBRATION = os.path.join(BASE_DIR, 'face_detect_calibration.json')
+
+# Face templates kept per employee (oldest dropped first) and the largest distance from
+# an employee's template centroid at which a new capture may be appended
+FACE_MAX_TEMPLATES = 10
+FACE_TEMPLATE_MAX_DISTANCE = 0.6
+
+# Payload of newly stored encodings: 'float32' (528 bytes) or 'int8' (144 bytes); see employee/face_codec.py
+FACE_ENCODING_DTYPE = 'float32'
+
+# Per-process LRU cache of decoded templates used for 1:1 verification, and how often
+# each process checks the database generation counter for changes made elsewhere
+FACE_CACHE_MAX_BYTES = 8 * 1024 * 1024
+FACE_CACHE_GENERATION_TTL = 1.0  # seconds
+
+# Newly uploaded face images are encoded by `manage.py process_encoding_jobs`; in-memory
+# galleries check the generation counter it bumps at most this often
+FACE_GALLERY_GENERATION_TTL = 1.0  # seconds
+
+# Per-stage latency histograms and error counters served in Prometheus format at
+# /employee/metrics/ (staff only, per worker process); False makes the timers no-ops
+FACE_METRICS_ENABLED = True
+
+# Logging: both handlers write on a background thread (employee.kiosk_logging.QueuedHandler);
+# request threads only enqueue records
+LOGS_DIR = os.path.join(BASE_DIR, 'logs')
+os.makedirs(LOGS_DIR, exist_ok=True)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'verbose': {
+            'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
+            'style': '{',
+        },
+        'simple': {
+            'format': '{levelname} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'file': {
+            'level': 'DEBUG',
+            'class': 'employee.kiosk_logging.QueuedHandler',
+            'target': 'logging.FileHandler',
+            'filename': os.path.join(LOGS_DIR, 'debug.log'),
+            'delay': True,
+            'formatter': 'verbose',
+        },
+        'console': {
+            'level': 'INFO',
+            'class': 'employee.kiosk_logging.QueuedHandler',
+            'target': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'employee': {
+            'handlers': ['file', 'console'],
+            'level': 'DEBUG',
+            'propagate': True,
+        },
+    },
+}
+
+# Share of kiosk recognition requests whose INFO/DEBUG detail lines are logged; warnings and
+# errors are always logged.
+FACE_LOG_SAMPLE_RATE = 1.0
+
+# Recently matched employees kept per kiosk (0 disables) and compared before the full gallery;
+# a short-list match is accepted only within the stricter distance below, and only when no other employee
+# can be closer (otherwise the scan is searched as usual)
+FACE_KIOSK_CANDIDATES = 50
+FACE_KIOSK_MAX_KIOSKS = 256
+FACE_KIOSK_CANDIDATE_MAX_DISTANCE = 0.4
+
+# Kiosks may send department_id and/or site to search that partition of the gallery first;
+# a scan not matched there within FACE_PARTITION_MAX_DISTANCE is searched globally unless fallback is off
+FACE_PARTITION_MAX_DISTANCE = 0.5
+FACE_PARTITION_FALLBACK = True
+
+# Kiosk frames are first screened by OpenCV Haar cascades on a grayscale copy no larger than
+# FACE_HAAR_MAX_SIZE: frames without a candidate are rejected before dlib, and HOG only searches
+# around the candidates (see `manage.py benchmark_haar_prefilter` for its false-reject rate)
+FACE_HAAR_PREFILTER = False
+FACE_HAAR_MAX_SIZE = (240, 180)
+
+# With FACE_CHIP_ENABLED the kiosk page finds the face in the browser (FaceDetector API) and uploads only
+# a FACE_CHIP_SIZE square crop plus its face box; the server skips detection and checks that the box
+# covers at least FACE_CHIP_MIN_FACE of the chip. Browsers without the API send the full frame.
+FACE_CHIP_ENABLED = False
+FACE_CHIP_SIZE = 160
+FACE_CHIP_MIN_FACE = 0.4
+
+# A kiosk frame within FACE_SCAN_HASH_DISTANCE bits (of a 256-bit difference hash) of a frame the same kiosk
+# answered in the last FACE_SCAN_FRAME_TTL seconds gets the earlier response back without recognition; keep
+# both small, so only a resend of the same picture matches. An employee the same kiosk recognized in the last
+# FACE_SCAN_DEBOUNCE_TTL seconds gets the earlier response back without another attendance update; a scan
+# within FACE_SCAN_COOLDOWN seconds of an employee's check-in does not check them out. 0 disables any of them.
+FACE_SCAN_FRAME_TTL = 2.0
+FACE_SCAN_HASH_DISTANCE = 4
+FACE_SCAN_DEBOUNCE_TTL = 5.0
+FACE_SCAN_COOLDOWN = 60
+
+# Burst enrollment: the registration page captures FACE_BURST_FRAMES frames; up to FACE_BURST_MAX_FRAMES
+# uploaded frames are ranked by sharpness, face size and pose, and only the FACE_BURST_TOP_K best are encoded
+FACE_BURST_FRAMES = 5
+FACE_BURST_MAX_FRAMES = 10
+FACE_BURST_TOP_K = 3
+
+# Run employee.warmup in each web worker as it loads the application, so the first scan does not pay for
+# model loading, the gallery build or template compilation; leave off with gunicorn --preload and use its
+# post_worker_init hook instead. `manage.py warm_up` runs and times the same steps.
+FACE_WARM_UP_ON_START = False